@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# purpose: to benchmark get_vol_info, get_ebs_data and get_rds offline against a synthetic fleet (storage_metrics/fakeaws.py)
+# every stage runs in its own process so its peak RSS is its own; API calls, wall time, peak RSS and rows/sec are
+# reported per stage and fleet size, and compared against a saved baseline to fail on regressions
+# usage: python benchmark-collection.py --fleet_size 100,1000 --save data/benchmark.json
+#        python benchmark-collection.py --fleet_size 100,1000 --baseline data/benchmark.json
+
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+
+STAGES = ['inventory', 'ebs', 'rds']
+# how each reported number gets worse
+HIGHER_IS_WORSE = {'api_calls': True, 'wall_seconds': True, 'peak_rss_mb': True, 'rows_per_second': False}
+
+# parse command-line arguments for fleet sizes, simulated latency and throttling, and the baseline to compare with
+def parse_args():
+    parser = argparse.ArgumentParser(description='collection benchmark script')
+    parser.add_argument('-f', '--fleet_size', help='comma separated resources per stage, e.g. 10,1000,100000', type=str, required=False)
+    parser.add_argument('-s', '--stages', help=f'comma separated stages out of {",".join(STAGES)}', type=str, required=False)
+    parser.add_argument('-d', '--days_back', help='days_back', type=int, required=False)
+    parser.add_argument('-w', '--workers', help='concurrent GetMetricData calls per region', type=int, required=False)
+    parser.add_argument('--regions', help='number of regions the fleet is spread over, up to 16', type=int, required=False)
+    parser.add_argument('--latency_ms', help='simulated base latency of every call', type=float, required=False)
+    parser.add_argument('--throttle_rate', help='share of calls throttled at random on top of the per-API quotas', type=float, required=False)
+    parser.add_argument('--seed', help='seed of the synthetic fleet', type=int, required=False)
+    parser.add_argument('--save', help='write the results as a baseline json', type=str, required=False)
+    parser.add_argument('--baseline', help='baseline json to compare with, exits 1 when a stage got worse', type=str, required=False)
+    parser.add_argument('--tolerance', help='allowed relative change before a number counts as worse', type=float, required=False)
+    parser.add_argument('--verbose', help='show the output of the benchmarked scripts', action='store_true')
+    # used internally to run one stage in a child process
+    parser.add_argument('--stage', help=argparse.SUPPRESS, type=str, required=False)
+    parser.add_argument('--result_file', help=argparse.SUPPRESS, type=str, required=False)
+    parser.set_defaults(fleet_size='1000', stages=','.join(STAGES), days_back=1, workers=8, regions=4, latency_ms=40, throttle_rate=0.01, seed=0, tolerance=0.15)
+    args = parser.parse_args()
+    return args
+
+# import a hyphenated script as a module
+def load_script(file_name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name)
+    spec = importlib.util.spec_from_file_location(file_name[:-3].replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# the script's own command-line arguments, so its defaults apply, writing to a temporary output
+def script_args(module, args, output_file):
+    argv = sys.argv
+    sys.argv = [module.__file__, '-d', str(args.days_back), '-w', str(args.workers), '-o', output_file, '--no_cache', '--quiet']
+    try:
+        return module.parse_args()
+    finally:
+        sys.argv = argv
+
+# input of get_ebs_data as get_vol_info would have built it, generated without any API calls
+def volume_info_frame(fleet):
+    from storage_metrics.fakeaws import NITRO_TYPES, NON_NITRO_TYPES
+    from storage_metrics.inventory import VolumeInventory
+    inventory = VolumeInventory()
+    inventory.nitro_types = dict(dict.fromkeys(NITRO_TYPES, True), **dict.fromkeys(NON_NITRO_TYPES, False))
+    for i in range(fleet.volume_count):
+        inventory.add_volumes(fleet.regions[fleet.volume_regions[i]], [fleet.volume(i)])
+    for j in range(-(-fleet.volume_count // fleet.volumes_per_instance)):
+        inventory.instances[fleet.instance_id(j)] = fleet.instance(j)
+    return pd.DataFrame([inventory.volume_row(ebs_id) for ebs_id in inventory.volumes])
+
+# instance rows as get_rds_info returns them, built straight from the fleet so the rds stage only measures collection
+def db_instance_frame(fleet):
+    from storage_metrics.inventory import db_instance_row
+    return pd.DataFrame([db_instance_row(fleet.regions[fleet.db_regions[k]], fleet.db_instance(k)) for k in range(fleet.db_instance_count)])
+
+# run one stage against the stand-in in this process; rows are the resources the stage produced
+def run_stage(args):
+    from storage_metrics import clients
+    from storage_metrics.fakeaws import REGIONS, FakeAWS, FakeFleet
+    from storage_metrics.telemetry import get_telemetry
+    fleet_size = int(args.fleet_size)
+    fleet = FakeFleet(volumes=fleet_size, db_instances=fleet_size, regions=REGIONS[:args.regions], seed=args.seed)
+    fake = FakeAWS(fleet, latency_ms=args.latency_ms, throttle_rate=args.throttle_rate, seed=args.seed)
+    clients.set_session_factory(fake.session)
+
+    get_telemetry().reset()
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = os.path.join(directory, 'output.csv')
+        if args.stage == 'inventory':
+            module = load_script('get-ebs-metrics.py')
+            stage_input = pd.DataFrame(fleet.input_rows('ebs'))
+            start = time.perf_counter()
+            rows = len(module.get_vol_info(script_args(module, args, output_file), stage_input))
+        elif args.stage == 'ebs':
+            module = load_script('get-ebs-metrics.py')
+            stage_input = volume_info_frame(fleet)
+            start = time.perf_counter()
+            module.get_ebs_data(script_args(module, args, output_file), stage_input)
+            rows = len(pd.read_csv(output_file))
+        else:
+            module = load_script('get-rds-storage-metrics.py')
+            stage_input = db_instance_frame(fleet)
+            start = time.perf_counter()
+            module.get_rds(script_args(module, args, output_file), stage_input)
+            rows = len(pd.read_csv(output_file))
+        wall_seconds = time.perf_counter() - start
+
+    stats = fake.stats()
+    return {
+        'stage': args.stage,
+        'fleet_size': fleet_size,
+        'rows': rows,
+        'api_calls': stats['api_calls'],
+        'throttles': stats['throttles'],
+        'datapoints': stats['datapoints'],
+        'response_mb': round(stats['response_bytes'] / 2 ** 20, 2),
+        'wall_seconds': round(wall_seconds, 3),
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'rows_per_second': round(rows / wall_seconds, 1) if wall_seconds else 0.0,
+        'calls': stats['calls'],
+        # busy seconds per pipeline stage, from the run's telemetry
+        'stages': get_telemetry().summary()['stages']
+    }
+
+# run a stage in a child process and read back its result
+def run_child(args, stage, fleet_size):
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as result_file:
+        path = result_file.name
+    command = [sys.executable, os.path.abspath(__file__), '--stage', stage, '--fleet_size', str(fleet_size), '--result_file', path,
+               '-d', str(args.days_back), '-w', str(args.workers), '--regions', str(args.regions),
+               '--latency_ms', str(args.latency_ms), '--throttle_rate', str(args.throttle_rate), '--seed', str(args.seed)]
+    try:
+        subprocess.run(command, check=True, stdout=None if args.verbose else subprocess.DEVNULL)
+        with open(path) as f:
+            return json.load(f)
+    finally:
+        os.remove(path)
+
+# every number of every stage that got worse than the baseline by more than the tolerance
+def regressions(results, baseline, tolerance):
+    previous = {(result['stage'], result['fleet_size']): result for result in baseline['results']}
+    worse = []
+    for result in results:
+        before = previous.get((result['stage'], result['fleet_size']))
+        if before is None:
+            continue
+        for metric, higher_is_worse in HIGHER_IS_WORSE.items():
+            change = (result[metric] - before[metric]) / before[metric] if before[metric] else 0.0
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                worse.append(f'{result["stage"]} x{result["fleet_size"]}: {metric} {before[metric]} -> {result[metric]} ({change:+.0%})')
+    return worse
+
+def main():
+    args = parse_args()
+    if args.stage:
+        with open(args.result_file, 'w') as f:
+            json.dump(run_stage(args), f)
+        return
+
+    settings = {name: getattr(args, name) for name in ['days_back', 'workers', 'regions', 'latency_ms', 'throttle_rate', 'seed']}
+    results = []
+    for fleet_size in [int(size) for size in args.fleet_size.split(',')]:
+        for stage in args.stages.split(','):
+            print(f'Running {stage} against {fleet_size} synthetic resources')
+            results.append(run_child(args, stage, fleet_size))
+
+    pd.set_option('display.width', 200)
+    print(pd.DataFrame(results).drop(columns=['calls', 'stages']).to_string(index=False))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'settings': settings, 'results': results}, f, indent=2)
+        print(f'Wrote benchmark results to {args.save}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['settings'] != settings:
+            print(f'Baseline was run with other settings: {baseline["settings"]}')
+        worse = regressions(results, baseline, args.tolerance)
+        if worse:
+            print(f'Regressions against {args.baseline}:')
+            for line in worse:
+                print(f'  {line}')
+            sys.exit(1)
+        print(f'No regressions against {args.baseline} within {args.tolerance:.0%}')
+
+if __name__ == "__main__":
+    main()
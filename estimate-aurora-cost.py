@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# purpose: to estimate Aurora Standard vs I/O-Optimized monthly cost from the output of get-ebs-metrics.py or get-rds-storage-metrics.py
+# usage: python estimate-aurora-cost.py -i data/ebs-cw-output.csv --io_growth 0.5,1,2
+
+import argparse
+import time
+import pandas as pd
+from storage_metrics.cost import CostModel, read_prices, read_scenarios, scenario_grid
+from storage_metrics.resources import PLUGINS
+from storage_metrics.writer import read_output
+
+# parse command-line arguments for the collected metrics, price table and what-if scenarios
+# each multiplier takes a comma separated list and every combination is priced
+def parse_args():
+    parser = argparse.ArgumentParser(description='aurora cost estimate script')
+    parser.add_argument('-i', '--input_file', help='collected metrics, csv, jsonl or a parquet directory', type=str, required=False)
+    parser.add_argument('-o', '--output_file', help='per-resource costs of the first scenario', type=str, required=False)
+    parser.add_argument('-r', '--resource', help='resource type the metrics were collected for', choices=sorted(PLUGINS), required=False)
+    parser.add_argument('-p', '--price_file', help='Aurora prices per region', type=str, required=False)
+    parser.add_argument('-s', '--summary_file', help='fleet totals per scenario', type=str, required=False)
+    parser.add_argument('--scenario_file', help='csv of scenarios with any of io_growth, storage_growth, io_price_scale, storage_price_scale', type=str, required=False)
+    parser.add_argument('--io_growth', help='I/O volume multipliers, e.g. 0.5,1,2', type=str, required=False)
+    parser.add_argument('--storage_growth', help='storage size multipliers', type=str, required=False)
+    parser.add_argument('--io_price_scale', help='Standard I/O price multipliers', type=str, required=False)
+    parser.add_argument('--storage_price_scale', help='storage price multipliers', type=str, required=False)
+    parser.add_argument('--instance_column', help='input column with the monthly instance cost, for the I/O-Optimized instance uplift; resources without it get no recommendation', type=str, required=False)
+    parser.set_defaults(input_file='data/ebs-cw-output.csv', output_file='data/aurora-cost.csv', resource='ebs', price_file='data/aurora-prices.csv', summary_file='data/aurora-cost-scenarios.csv')
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = parse_args()
+
+    metrics_df = read_output(args.input_file)
+    if args.scenario_file:
+        scenarios = read_scenarios(args.scenario_file)
+    else:
+        multipliers = {name: [float(value) for value in getattr(args, name).split(',')] for name in ['io_growth', 'storage_growth', 'io_price_scale', 'storage_price_scale'] if getattr(args, name)}
+        scenarios = scenario_grid(**multipliers)
+
+    start = time.perf_counter()
+    model = CostModel(metrics_df, PLUGINS[args.resource], read_prices(args.price_file), args.instance_column)
+    summary_df = model.fleet_summary(scenarios)
+    cost_df = model.resource_costs(scenarios)
+    elapsed = time.perf_counter() - start
+    if model.unpriced:
+        print(f'No Aurora prices for regions: {model.unpriced}, add them to {args.price_file}')
+    # without the instance cost the 30% I/O-Optimized uplift is left out, which favours I/O-Optimized
+    missing = {name: count for name, count in model.missing.items() if count}
+    if missing:
+        print(f'WARNING: unknown {", ".join(f"{name} for {count} of {len(metrics_df)} resources" for name, count in missing.items())}; '
+              f'they are priced without it and get no recommendation (pass --instance_column with the monthly instance cost, RDS storage comes from the instance_storage column)')
+
+    cost_df.to_csv(args.output_file, index=False)
+    summary_df.round(2).to_csv(args.summary_file, index=False)
+    pd.set_option('display.width', 200)
+    print(f'Priced {len(metrics_df)} resources under {len(scenarios)} scenarios in {elapsed:.3f}s')
+    print(summary_df.round(2))
+    print(f'Wrote per-resource costs for scenario {scenarios.scenario.iloc[0]} to {args.output_file} and scenario totals to {args.summary_file}')
+    
+if __name__ == "__main__":
+    main()
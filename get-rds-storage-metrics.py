@@ -2,151 +2,49 @@
 # purpose: to pull and calculate throughput and IO statistics for a set of RDS instances; data source source is cloudwatch
 # usage: python -i data/rds-input.csv storage-get-metrics.py
 
-import argparse
-import boto3
-from botocore.config import Config
-from datetime import datetime, timedelta
 import pandas as pd
-import numpy as np
-import time
-from random import randrange
+from storage_metrics.cli import parse_args as parse_cli_args
+from storage_metrics.inventory import ACCOUNT_COLUMN, account_value, db_instance_row, load_db_instances
+from storage_metrics.pipeline import collect_metrics, pull_metric, reads_input, run
+from storage_metrics.resources import RDS
 
 # parse command-line arguments for input instance file, output file, and days back to pull metrics 
-# csv must have columns: type,region,instance
+# csv must have columns: type,region,instance and optionally account (an account id or role ARN to assume)
 def parse_args():
-    parser = argparse.ArgumentParser(description='instance check script')
-    parser.add_argument('-i', '--input_file', help='input_file', type=str, required=False)
-    parser.add_argument('-o', '--ouput_file', help='ouput_file', type=str, required=False)
-    parser.add_argument('-d', '--days_back', help='days_back', type=int, required=False)
-    parser.set_defaults(input_file='data/input.csv', output_file='data/output.csv', days_back=30)
-    args = parser.parse_args()
-    return args
-
-def cw_rds_pull_metric(cw_client, df, metric_name, namespace, instance_name, instance, stat, period, days_back):
-    id_name = f'rdsmetricpull{randrange(1000000)}'
-    start = ((datetime.utcnow().replace(microsecond=0, second=0, minute=0) - timedelta(hours=1)) - timedelta(days=days_back))
-    end = (datetime.utcnow().replace(microsecond=0, second=0, minute=0) - timedelta(hours=1))
+    return parse_cli_args(RDS, input_file='data/input.csv', output_file='data/output.csv')
 
+# pull a single metric for one instance, reading through the cache when one is given
+# get_rds batches many instances per call instead
+def cw_rds_pull_metric(cw_client, df, metric_name, namespace, instance_name, instance, stat, period, days_back, cache=None):
     print(metric_name, namespace, instance_name, instance, stat, period, days_back)
-    cw_response = cw_client.get_metric_data(
-        MetricDataQueries=[
-            {
-                'Id': id_name,
-                'MetricStat': {
-                    'Metric': {
-                        'Namespace': namespace,
-                        'MetricName': metric_name,
-                        'Dimensions': [
-                            {
-                                'Name': instance_name,
-                                'Value': instance
-                            },
-                        ]
-                    },
-                    'Period': period,
-                    'Stat': stat,
-                },
-                'ReturnData': True
-            }
-        ],
-        StartTime=start,
-        EndTime=end,
-        ScanBy='TimestampDescending'
-    )
-    df[metric_name] = cw_response['MetricDataResults'][0]['Values']
+    plugin = RDS.copy(namespace=namespace, dimension_name=instance_name)
+    df[metric_name] = pull_metric(cw_client, plugin, instance, metric_name, stat, period, days_back, cache)
     return df
 
-# check for dividing by zero and return 0 versus NaN
-def divide_numbers(x,y):
-    np.seterr(invalid='ignore')
-    try:
-        val = x / y
-        if np.isnan(val):
-            return 0
-        else:
-            return val
-    except:
-        return 0
-    
-# to determine the average 
-def calc_avg_iop(row_dict):
-    # divide monthly throughput by monthly IOPS per month 
-    row_dict['VolumeIOPSSum'] = row_dict['ReadIOPSSum'] + row_dict['WriteIOPSSum'] 
-    row_dict['VolumeBytesSum'] = row_dict['WriteThroughputSum'] + row_dict['ReadThroughputSum'] 
-    row_dict['IoSize'] = divide_numbers(row_dict['VolumeBytesSum'], row_dict['VolumeIOPSSum'])
-    return row_dict
-
-
-def get_rds(args, instance_df):
-    
-    output_df = pd.DataFrame()
-    
-    # rds metrics of interest
-    instance_metrics = {
-        'ReadIOPS': 'Count',
-        'WriteIOPS': 'Count',
-        'WriteThroughput': 'Bytes',
-        'ReadThroughput': 'Bytes'
-    }
-
-    # stats of interest 
-    storage_stats = ['Maximum', 'Sum']
-    
-    # days back period to poll cloudwatch 
-    days_back = args.days_back
-    month_span = days_back/30
-    
-    # boto3 client config
-    config = Config(
-        retries = dict(
-            max_attempts = 10
-        )
-    )
-        
+# look up every instance's allocated storage and create time, a few DescribeDBInstances calls per region
+# instances that cannot be found are still collected, without them
+def get_rds_info(args, instance_df):
+    instances = load_db_instances(instance_df)
+    rows = []
     for row in instance_df.itertuples():
-        cw_client = boto3.client('cloudwatch', region_name=row.region, config=config)
-        row_dict = {}
-        for stat in storage_stats:
-            for metric_name, unit in instance_metrics.items():
-                try:
-                    time.sleep(0)
-                    df = pd.DataFrame()
-                    # maximum statistic is only supported on Nitro-based and RDS instances 
-                    # adjust period in seconds based upon the days back
-                    df = cw_rds_pull_metric(cw_client, df, metric_name, 'AWS/RDS', 'DBInstanceIdentifier', row.instance, stat, 300, days_back)
-                    # divide by 60 seconds 1 hertz data for a 60 second period 
-                    if stat == 'Maximum':
-                        df_max = df.div(60)
-                        df_max = df_max.round(1)
-                        max_value = df_max[metric_name].max()
-                        row_dict[metric_name + 'Maximum'] = max_value
-                    # only get Sum for all metrics pulled
-                    if stat == 'Sum' and (metric_name == 'ReadIOPS' or 'WriteIOPS' or 'WriteThroughput' or 'ReadThroughput'):
-                        row_dict[metric_name + 'Sum'] = (df[metric_name].sum()/month_span)
-                    
-                    # can decide to remove any column but at least keep region and volumn_id
-                    row_dict['type'] = row.type
-                    row_dict['region'] = row.region
-                    row_dict['instance'] = row.instance
-                except Exception as e: 
-                    print(f'An error occurred during making call for id: {row.instance}, metric: {metric_name}')
-                    print(e)
-                    pass
-        # calc IO average size - read and write combined
-        row_dict = calc_avg_iop(row_dict)
-        # round off decimal values  
-        df_temp = pd.DataFrame(row_dict, index=[0]).round(0)
-        print(f'Query result: {df_temp}')
-        output_df = pd.concat([output_df, df_temp])
-    # get dataframe column list for ordering csv columns 
-    col_list = list(output_df.columns)
-    output_df.to_csv(args.output_file, index=False, columns=(sorted(col_list, reverse=True)))
+        account = account_value(getattr(row, ACCOUNT_COLUMN, None))
+        instance = instances.get((account, row.region, row.instance))
+        if instance is None:
+            print(f'An error occurred finding RDS instance: {row.instance} in region: {row.region}')
+            instance = {'DBInstanceIdentifier': row.instance}
+        rows.append(dict(db_instance_row(row.region, instance, account), type=row.type))
+    print(f'Found info for {len(instances)} RDS instances')
+    return pd.DataFrame(rows)
+
+# pull Cloudwatch data for instances and output to csv
+def get_rds(args, instance_df):
+    collect_metrics(args, RDS, instance_df)
 
 def main():
     args = parse_args()
-
-    instance_df = pd.read_csv(args.input_file)
-    get_rds(args, instance_df)
+    # with --discover the instances are found in every enabled region instead, and merging shards reads no input
+    instance_df = pd.read_csv(args.input_file, dtype={ACCOUNT_COLUMN: str}) if reads_input(args) else None
+    run(args, RDS, instance_df, prepare=get_rds_info, collect=get_rds)
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
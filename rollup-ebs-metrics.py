@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# purpose: to roll the EBS volumes of get-ebs-metrics.py up per EC2 instance or application tag, with the coincident peak IOPS and throughput of each group
+# usage: python rollup-ebs-metrics.py -i data/ebs-cw-output.csv --timeseries data/timeseries --group_by tag_app
+
+import argparse
+import time
+from storage_metrics.inventory import ACCOUNT_COLUMN
+from storage_metrics.resources import EBS
+from storage_metrics.rollup import CHUNK_RESOURCES, rollup
+from storage_metrics.writer import read_output
+
+# parse command-line arguments for the collected volumes, their time series and the columns to group them by
+# the volumes must have been collected with --timeseries, and with --tag_columns for any tag_<key> group column
+def parse_args():
+    parser = argparse.ArgumentParser(description='ebs rollup script')
+    parser.add_argument('-i', '--input_file', help='collected volume metrics, csv, jsonl or a parquet directory', type=str, required=False)
+    parser.add_argument('-o', '--output_file', help='one row per group', type=str, required=False)
+    parser.add_argument('--timeseries', help='time series directory the volumes were collected with', type=str, required=False)
+    parser.add_argument('-g', '--group_by', help='comma separated columns to group volumes by, e.g. ec2_instance_id or account,tag_app', type=str, required=False)
+    parser.add_argument('-d', '--days_back', help='days of time series to roll up', type=int, required=False)
+    parser.add_argument('--chunk_size', help='volumes whose series are held in memory at once, whole groups only', type=int, required=False)
+    parser.set_defaults(input_file='data/ebs-cw-output.csv', output_file='data/ebs-rollup.csv', timeseries='data/timeseries', group_by='ec2_instance_id', days_back=30, chunk_size=CHUNK_RESOURCES)
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = parse_args()
+
+    volumes_df = read_output(args.input_file, dtype={ACCOUNT_COLUMN: str})
+    group_columns = [column.strip() for column in args.group_by.split(',')]
+
+    start = time.perf_counter()
+    groups = rollup(volumes_df, EBS, args.timeseries, group_columns, args.output_file, args.days_back, args.chunk_size)
+    print(f'Wrote {groups} groups to {args.output_file} in {time.perf_counter() - start:.3f}s')
+    
+if __name__ == "__main__":
+    main()
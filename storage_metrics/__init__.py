@@ -0,0 +1 @@
+# shared helpers for the storage metrics scripts (get-ebs-metrics.py, get-rds-storage-metrics.py)
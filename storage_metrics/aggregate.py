@@ -0,0 +1,122 @@
+# purpose: reduce pulled series into preallocated arrays, then build the output columns in one vectorized pass
+# memory stays bounded by the size of the result (resources x metrics), not by the pulled series
+
+import numpy as np
+import pandas as pd
+
+# peak column suffix of Rate series: their peak is the busiest period average, not the busiest minute of Maximum/60
+RATE_PEAK = 'RateMaximum'
+
+
+# elementwise x / y that returns 0 instead of NaN or inf where y is 0 or missing
+def masked_divide(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    out = np.zeros(np.broadcast(x, y).shape)
+    np.divide(x, y, out=out, where=(y != 0) & ~np.isnan(y) & ~np.isnan(x))
+    return out
+
+
+# per resource and metric: the per-second peak and the total over the window
+# resources are keyed by their label in the input frame so duplicate ids still get their own row
+# Maximum series are divided by peak_divisor, 60 for the per-second peak of 1 hertz data in a 60 second period
+# a resource is complete once expected batches (one per query segment, or as many as it was planned in) have reported for it
+# peaks are written as {metric}{peak_name}, RATE_PEAK for Rate series
+class MetricSummary:
+    def __init__(self, labels, metric_names, peak_divisor=60, expected=1, peak_name='Maximum'):
+        self.peak_divisor = peak_divisor
+        self.peak_name = peak_name
+        self.labels = list(labels)
+        self.rows = {label: i for i, label in enumerate(self.labels)}
+        self.metric_names = list(metric_names)
+        self.columns = {name: j for j, name in enumerate(self.metric_names)}
+        self.expected = expected
+        self.peaks = np.full((len(self.labels), len(self.metric_names)), np.nan)
+        self.sums = np.zeros((len(self.labels), len(self.metric_names)))
+        self.received = np.zeros(len(self.labels), dtype=bool)
+        self.pending = np.full(len(self.labels), expected)
+
+    # add rows for resources that arrive while collection is running, e.g. from fleet discovery
+    # expected optionally gives each label its own number of batches, e.g. fewer segments for a new resource
+    # arrays grow by doubling so streaming many small chunks stays linear
+    def extend(self, labels, expected=None):
+        if expected is not None:
+            expected = dict(zip(labels, expected))
+        labels = [label for label in dict.fromkeys(labels) if label not in self.rows]
+        self.rows.update({label: len(self.labels) + i for i, label in enumerate(labels)})
+        self.labels += labels
+        capacity = len(self.received)
+        if len(self.labels) > capacity:
+            grow = max(len(self.labels), 2 * capacity) - capacity
+            self.peaks = np.vstack([self.peaks, np.full((grow, len(self.metric_names)), np.nan)])
+            self.sums = np.vstack([self.sums, np.zeros((grow, len(self.metric_names)))])
+            self.received = np.concatenate([self.received, np.zeros(grow, dtype=bool)])
+            self.pending = np.concatenate([self.pending, np.full(grow, self.expected)])
+        if expected is not None and labels:
+            self.pending[[self.rows[label] for label in labels]] = [expected[label] for label in labels]
+
+    # resources that are known to have no data are complete without any batch, with empty peaks and zero sums
+    def skip(self, labels):
+        rows = np.array([self.rows[label] for label in labels], dtype=int)
+        self.received[rows] = True
+        self.pending[rows] = 0
+        return list(labels)
+
+    # fold one (partial) series into the summary; repeated calls keep the max of maxima and the sum of sums
+    # Rate series are already per second (metric math m/PERIOD(m)) and give both the peak of the period averages and,
+    # times the period, the sum
+    def add(self, label, metric_name, stat, values, period=None):
+        i, j = self.rows[label], self.columns[metric_name]
+        values = np.asarray(values, dtype=float)
+        self.received[i] = True
+        if not values.size:
+            return
+        if stat == 'Maximum':
+            self.peaks[i, j] = np.fmax(self.peaks[i, j], np.nanmax(values) / self.peak_divisor)
+        elif stat == 'Sum':
+            self.sums[i, j] += np.nansum(values)
+        elif stat == 'Rate':
+            self.peaks[i, j] = np.fmax(self.peaks[i, j], np.nanmax(values))
+            self.sums[i, j] += np.nansum(values) * period
+
+    # count one finished batch for each label and return the labels that have now received every batch
+    def finish(self, labels):
+        rows = np.array([self.rows[label] for label in labels], dtype=int)
+        self.pending[rows] -= 1
+        return [self.labels[i] for i in rows if self.pending[i] == 0]
+
+    # wide frame of {metric}{peak_name} and {metric}Sum for every resource that received data,
+    # or only for the given labels, e.g. the resources of a finished batch
+    # peaks are rounded to one decimal, sums normalised to a 30 day month
+    def to_frame(self, month_span, labels=None):
+        rows = np.flatnonzero(self.received)
+        if labels is not None:
+            rows = np.array([i for i in sorted({self.rows[label] for label in labels}) if self.received[i]], dtype=int)
+        labels = [self.labels[i] for i in rows]
+        peaks = np.round(self.peaks[rows], 1)
+        sums = self.sums[rows] / month_span
+        df = pd.concat([
+            pd.DataFrame(peaks, index=labels, columns=[name + self.peak_name for name in self.metric_names]),
+            pd.DataFrame(sums, index=labels, columns=[name + 'Sum' for name in self.metric_names])
+        ], axis=1)
+        return df
+
+
+# combined read+write totals and the average IO size, for every row at once
+def add_io_size(df, ops_columns, bytes_columns, ops_total, bytes_total):
+    df[ops_total] = df[ops_columns].sum(axis=1)
+    df[bytes_total] = df[bytes_columns].sum(axis=1)
+    df['IoSize'] = masked_divide(df[bytes_total], df[ops_total])
+    return df
+
+
+# every output column in csv order: metadata, {metric}{peak_name}/{metric}Sum, the totals, IoSize and any extra columns
+def output_columns(meta_columns, metric_names, ops_total, bytes_total, extra_columns=(), peak_name='Maximum'):
+    columns = list(meta_columns) + [name + stat for name in metric_names for stat in [peak_name, 'Sum']] + [ops_total, bytes_total, 'IoSize'] + list(extra_columns)
+    return sorted(set(columns), reverse=True)
+
+
+# join the metric columns onto the resource metadata, round off decimals and order columns as the csv expects
+def build_output(summary_df, resources_df, meta_columns):
+    output_df = pd.concat([resources_df.loc[summary_df.index, meta_columns], summary_df], axis=1).round(0)
+    return output_df[sorted(output_df.columns, reverse=True)]
@@ -0,0 +1,150 @@
+# purpose: on-disk SQLite cache of CloudWatch datapoints so reruns only fetch the time ranges they are missing
+# series are keyed by (namespace, dimension name, dimension value, metric, stat, period) once in the series table,
+# datapoints only by (series id, timestamp) so a datapoint row is a few integers, not the series key repeated
+
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+# the newest datapoints can still change while CloudWatch aggregates them, so they are never marked as covered
+SETTLE_SECONDS = 15 * 60
+
+# a series row carries the covered [start_ts, end_ts) of its datapoints, NULL until a fetch settles
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY, namespace TEXT, dimension TEXT, resource_id TEXT, metric TEXT, stat TEXT, period INTEGER,
+    start_ts INTEGER, end_ts INTEGER,
+    UNIQUE (namespace, dimension, resource_id, metric, stat, period)
+);
+CREATE TABLE IF NOT EXISTS points (
+    series_id INTEGER, ts INTEGER, value REAL,
+    PRIMARY KEY (series_id, ts)
+) WITHOUT ROWID;
+'''
+
+SERIES_WHERE = 'namespace = ? AND dimension = ? AND resource_id = ? AND metric = ? AND stat = ? AND period = ?'
+
+
+# seconds since the epoch for naive UTC or timezone aware datetimes
+def to_epoch(dt):
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def from_epoch(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+
+class MetricCache:
+    # ttl_days evicts datapoints older than that many days each time the cache is opened
+    # writes go through one connection under the lock, reads through a connection per thread that WAL lets
+    # run alongside the writer, so worker threads read their cached series at the same time
+    def __init__(self, path, ttl_days=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.series_ids = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        if ttl_days:
+            self.evict(time.time() - ttl_days * 86400)
+
+    def reader(self):
+        if getattr(self.local, 'conn', None) is None:
+            self.local.conn = sqlite3.connect(self.path, check_same_thread=False)
+        return self.local.conn
+
+    # id of a series, None when it has never been stored
+    def series_id(self, key):
+        series_id = self.series_ids.get(key)
+        if series_id is None:
+            row = self.reader().execute(f'SELECT id FROM series WHERE {SERIES_WHERE}', key).fetchone()
+            if row is not None:
+                series_id = self.series_ids[key] = row[0]
+        return series_id
+
+    # covered [start_ts, end_ts) of a series, or None
+    def coverage(self, key):
+        row = self.reader().execute(f'SELECT start_ts, end_ts FROM series WHERE {SERIES_WHERE}', key).fetchone()
+        return None if row is None or row[0] is None else row
+
+    # time ranges of [start, end) not in the cache yet, as (start, end) datetimes
+    def missing_ranges(self, key, start, end):
+        covered = self.coverage(key)
+        start_ts, end_ts = to_epoch(start), to_epoch(end)
+        if covered is None or covered[1] <= start_ts or covered[0] >= end_ts:
+            return [(start, end)]
+        ranges = []
+        if start_ts < covered[0]:
+            ranges.append((start, from_epoch(covered[0])))
+        if covered[1] < end_ts:
+            ranges.append((from_epoch(covered[1]), end))
+        return ranges
+
+    # save fetched datapoints and extend the series coverage to the fetched range, minus the unsettled tail
+    def store(self, key, timestamps, values, start, end):
+        period = key[-1]
+        start_ts = to_epoch(start)
+        settled_ts = int(time.time() - SETTLE_SECONDS) // period * period
+        end_ts = min(to_epoch(end), settled_ts)
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO series (namespace, dimension, resource_id, metric, stat, period) VALUES (?, ?, ?, ?, ?, ?)', key)
+            series_id, covered_start, covered_end = self.conn.execute(f'SELECT id, start_ts, end_ts FROM series WHERE {SERIES_WHERE}', key).fetchone()
+            self.series_ids[key] = series_id
+            self.conn.executemany('INSERT OR REPLACE INTO points VALUES (?, ?, ?)', [(series_id, to_epoch(ts), value) for ts, value in zip(timestamps, values)])
+            if end_ts <= start_ts:
+                return
+            # merge with the existing coverage when the ranges touch, otherwise the new range replaces it
+            if covered_start is not None and covered_start <= end_ts and start_ts <= covered_end:
+                start_ts, end_ts = min(start_ts, covered_start), max(end_ts, covered_end)
+            self.conn.execute('UPDATE series SET start_ts = ?, end_ts = ? WHERE id = ?', (start_ts, end_ts, series_id))
+
+    # cached values of [start, end) in time order
+    def read(self, key, start, end):
+        return self.read_series(key, start, end)[1]
+
+    # cached (timestamps, values) of [start, end) in time order
+    def read_series(self, key, start, end):
+        series_id = self.series_id(key)
+        if series_id is None:
+            return [], []
+        rows = self.reader().execute('SELECT ts, value FROM points WHERE series_id = ? AND ts >= ? AND ts < ? ORDER BY ts', (series_id, to_epoch(start), to_epoch(end))).fetchall()
+        return [from_epoch(row[0]) for row in rows], [row[1] for row in rows]
+
+    # drop datapoints older than cutoff (epoch seconds) and shrink coverage to match
+    def evict(self, cutoff):
+        cutoff = int(cutoff)
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM points WHERE ts < ?', (cutoff,))
+            self.conn.execute('UPDATE series SET start_ts = NULL, end_ts = NULL WHERE end_ts <= ?', (cutoff,))
+            self.conn.execute('UPDATE series SET start_ts = ? WHERE start_ts < ?', (cutoff, cutoff))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# the cache as seen from one account: resource ids are stored as <account>/<resource id>, since names such as
+# RDS instance identifiers repeat across accounts; the default account keeps the plain keys
+class AccountCache:
+    def __init__(self, cache, account):
+        self.cache = cache
+        self.account = account
+
+    def key(self, key):
+        return key[:2] + (f'{self.account}/{key[2]}',) + key[3:]
+
+    def missing_ranges(self, key, start, end):
+        return self.cache.missing_ranges(self.key(key), start, end)
+
+    def store(self, key, timestamps, values, start, end):
+        self.cache.store(self.key(key), timestamps, values, start, end)
+
+    def read(self, key, start, end):
+        return self.cache.read(self.key(key), start, end)
+
+    def read_series(self, key, start, end):
+        return self.cache.read_series(self.key(key), start, end)
@@ -0,0 +1,47 @@
+# purpose: command-line options shared by every collection script
+
+import argparse
+from storage_metrics.shard import parse_shard
+from storage_metrics.writer import OUTPUT_FORMATS
+
+
+# parse command-line arguments for input file, output file, and days back to pull metrics
+# --metric_math is only offered for plugins that declare totals, --discover for plugins read from their own columns
+def parse_args(plugin, input_file, output_file, description='instance check script', discovery=True):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-i', '--input_file', help='input_file', type=str, required=False)
+    parser.add_argument('-o', '--output_file', '--ouput_file', help='output_file', type=str, required=False)
+    parser.add_argument('-d', '--days_back', help='days_back', type=int, required=False)
+    parser.add_argument('-t', '--tps', help='starting TPS per API, e.g. GetMetricData=25 (repeatable)', action='append', required=False)
+    parser.add_argument('-w', '--workers', help='concurrent GetMetricData calls per region', type=int, required=False)
+    parser.add_argument('--cache_file', help='SQLite cache of pulled datapoints, reruns only fetch missing time ranges', type=str, required=False)
+    parser.add_argument('--cache_ttl_days', help='evict cached datapoints older than this many days', type=int, required=False)
+    parser.add_argument('--inventory_cache_file', help='SQLite cache of volume and instance metadata, reruns skip most Describe* calls', type=str, required=False)
+    parser.add_argument('--inventory_ttl_hours', help='describe cached volumes and instances again after this many hours; until then a volume detached from a running instance keeps its cached attachment', type=float, required=False)
+    parser.add_argument('--no_cache', help='always pull the full window from CloudWatch and describe every volume and instance again', action='store_true')
+    parser.add_argument('--output_format', help='output file format', choices=OUTPUT_FORMATS, required=False)
+    if plugin.totals:
+        parser.add_argument('--metric_math', help='compute per-second rates and read+write totals server side with CloudWatch metric math, peaks are written as *RateMaximum (busiest period average)', action='store_true')
+    parser.add_argument('--timeseries', help='keep the pulled series as partitioned Parquet in this directory and add p50/p95/p99 columns and hourly profiles', type=str, required=False)
+    if discovery:
+        parser.add_argument('--discover', help='discover resources in every enabled region instead of reading input_file', action='store_true')
+        parser.add_argument('--regions', help='comma separated regions to discover in, defaults to every enabled region', type=str, required=False)
+        parser.add_argument('--tag', help='only discover resources with this tag, Key=Value or Key (repeatable)', action='append', required=False)
+        parser.add_argument('--type', help='only discover this volume type or DB engine, e.g. gp3 or aurora-mysql (repeatable)', action='append', required=False)
+        parser.add_argument('--state', help='only discover resources in this state, e.g. in-use or available (repeatable)', action='append', required=False)
+        parser.add_argument('--accounts', help='comma separated account ids or role ARNs to discover in through an assumed role', type=str, required=False)
+        # used internally: a shard's part of the resources the --processes driver discovered
+        parser.add_argument('--discovered', help=argparse.SUPPRESS, type=str, required=False)
+    parser.add_argument('--tag_columns', help='comma separated tag keys written as tag_<key> columns, e.g. to roll volumes up by application', type=str, required=False)
+    parser.add_argument('--role_name', help='role assumed in accounts given by id, in the input account column or --accounts', type=str, required=False)
+    parser.add_argument('--external_id', help='external id required by the assumed role', type=str, required=False)
+    parser.add_argument('--no_preflight', help='query every resource as listed: keep duplicate ids, and query Maximum and the full window for all', action='store_true')
+    parser.add_argument('-q', '--quiet', help='no per-batch or per-resource printing, show a progress line with ETA instead', action='store_true')
+    parser.add_argument('--summary_file', help='JSON run summary of stage timings and per-region API counters, defaults to <output_file>.summary.json', type=str, required=False)
+    parser.add_argument('--shard', help='only collect shard i of N (0 to N-1) by a hash of the resource id, written to <output_file>.shard-i-of-N', type=parse_shard, required=False)
+    parser.add_argument('--processes', help='run N shards in local worker processes and merge their outputs into output_file', type=int, required=False)
+    parser.add_argument('--merge_shards', help='merge the outputs of N shards, e.g. collected on several hosts, into output_file and exit', type=int, required=False)
+    parser.add_argument('--resume', help='skip resources already written by an interrupted run and append to its output', action='store_true')
+    parser.set_defaults(input_file=input_file, output_file=output_file, days_back=30, workers=8, cache_file='data/metrics-cache.sqlite', cache_ttl_days=90, inventory_cache_file='data/inventory-cache.sqlite', inventory_ttl_hours=24, output_format='csv', metric_math=False, discover=False, quiet=False)
+    args = parser.parse_args()
+    return args
@@ -0,0 +1,102 @@
+# purpose: cache one boto3 client per (account, service, region) so threads and batches reuse connections
+# other accounts are reached through an assumed role, one session per account whose credentials refresh before they expire
+
+import threading
+from datetime import datetime
+import boto3
+import botocore.session
+from botocore.config import Config
+from botocore.credentials import DeferredRefreshableCredentials
+from storage_metrics.ratelimit import attach_rate_limiter
+from storage_metrics.telemetry import attach_telemetry
+
+# increasing attempts in case of rate limiting, and enough pooled connections for the worker threads
+CLIENT_CONFIG = Config(
+    retries = dict(
+        max_attempts = 10
+    ),
+    max_pool_connections = 50
+)
+
+# role assumed in accounts given by id, a full role ARN is used as is
+ROLE_NAME = 'OrganizationAccountAccessRole'
+ROLE_SESSION_NAME = 'storage-metrics'
+ROLE_SESSION_SECONDS = 3600
+# region of the STS endpoint the roles are assumed through
+STS_REGION = 'us-east-1'
+
+_clients = {}
+_clients_lock = threading.Lock()
+_sessions = {}
+_session_factory = boto3.session.Session
+_role = {'name': ROLE_NAME, 'external_id': None}
+
+
+# role name and optional external id used for accounts given by id
+def configure_roles(role_name=None, external_id=None):
+    _role['name'] = role_name or ROLE_NAME
+    _role['external_id'] = external_id
+
+
+def role_arn(account):
+    if account.startswith('arn:'):
+        return account
+    return f'arn:aws:iam::{account}:role/{_role["name"]}'
+
+
+# 12 digit account id of an account id or role ARN
+def account_id(account):
+    return account.split(':')[4] if account.startswith('arn:') else account
+
+
+# short-term credentials for the account's role, fetched with the default credentials
+# botocore calls this again ahead of the expiry, while the current credentials are still valid
+def assume_role_credentials(account):
+    def refresh():
+        params = dict(RoleArn=role_arn(account), RoleSessionName=ROLE_SESSION_NAME, DurationSeconds=ROLE_SESSION_SECONDS)
+        if _role['external_id']:
+            params['ExternalId'] = _role['external_id']
+        credentials = get_client('sts', STS_REGION).assume_role(**params)['Credentials']
+        expiration = credentials['Expiration']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': expiration.isoformat() if isinstance(expiration, datetime) else expiration
+        }
+    return DeferredRefreshableCredentials(refresh_using=refresh, method='sts-assume-role')
+
+
+# one session per account, None is the default credential chain; called with the clients lock held
+# the role is only assumed when the account's first client makes its first call
+def get_session(account=None):
+    if account not in _sessions:
+        if account is None:
+            _sessions[account] = _session_factory()
+        else:
+            session = botocore.session.Session()
+            session._credentials = assume_role_credentials(account)
+            _sessions[account] = _session_factory(botocore_session=session)
+    return _sessions[account]
+
+
+# boto3's default session is not thread safe, so clients are created from one session per account under a lock
+# every account and region gets its own rate limit buckets, as API quotas are per account and region
+def get_client(service, region, account=None):
+    with _clients_lock:
+        key = (account, service, region)
+        if key not in _clients:
+            client = get_session(account).client(service, region_name=region, config=CLIENT_CONFIG)
+            scope = None if account is None else account_id(account)
+            _clients[key] = attach_telemetry(attach_rate_limiter(client, region, scope), region, scope)
+        return _clients[key]
+
+
+# create every session from now on with this factory, called as factory() for the default credentials and
+# factory(botocore_session=...) for an assumed role, e.g. the offline stand-in in fakeaws
+def set_session_factory(factory):
+    global _session_factory
+    with _clients_lock:
+        _session_factory = factory
+        _sessions.clear()
+        _clients.clear()
@@ -0,0 +1,222 @@
+# purpose: build, batch and run CloudWatch GetMetricData queries for many resources at once
+
+import math
+import re
+from datetime import datetime, timedelta
+
+# GetMetricData accepts at most 500 metric data queries per request
+MAX_QUERIES_PER_REQUEST = 500
+# a single response holds at most 100,800 datapoints, anything beyond comes back behind NextToken
+MAX_DATAPOINTS_PER_REQUEST = 100800
+
+
+# lowercase tokens in a metric math expression are query Ids, functions such as SUM and PERIOD are uppercase
+EXPRESSION_ID = re.compile(r'\b[a-z]\w*\b')
+
+
+# a set of queries sent in one GetMetricData request
+# keys maps each deterministic query Id back to its (resource_id, metric_name, stat);
+# hidden intermediate series of metric math have a key of None
+class MetricBatch:
+    def __init__(self):
+        self.resources = []
+        self.queries = []
+        self.keys = {}
+        self.groups = []
+        self.datapoints = 0
+        # earliest start of the batch's resources, None when they all share the window's start
+        self.start = None
+
+    # a resource's queries may carry local Ids that its expressions refer to, e.g. 'm0/PERIOD(m0)';
+    # they are renumbered to Ids unique in the batch and the expressions rewritten to match
+    def add(self, resource, resource_queries):
+        self.resources.append(resource)
+        local_ids = {query['Id']: f'q{len(self.queries) + i}' for i, (key, query) in enumerate(resource_queries) if 'Id' in query}
+        group = []
+        for key, query in resource_queries:
+            query = dict(query, Id=f'q{len(self.queries)}')
+            if 'Expression' in query:
+                query['Expression'] = EXPRESSION_ID.sub(lambda match: local_ids.get(match.group(0), match.group(0)), query['Expression'])
+            group.append(self.add_query(key, query))
+        self.groups.append(group)
+
+    # queries keep their Id when given one, so a resource's group can be re-sent as is
+    def add_query(self, key, query):
+        query = dict(query, Id=query.get('Id', f'q{len(self.queries)}'))
+        self.keys[query['Id']] = key
+        self.queries.append(query)
+        return key, query
+
+    def add_group(self, group):
+        self.groups.append([self.add_query(key, query) for key, query in group])
+
+    # (key, query) pairs in request order
+    def items(self):
+        return [(self.keys[query['Id']], query) for query in self.queries]
+
+    def __len__(self):
+        return len(self.queries)
+
+
+# build one MetricStat query per metric and stat for a single resource
+# unit is optional, e.g. RDS metrics are not filtered by unit
+def build_metric_queries(resource_id, namespace, dimension_name, metrics, stats, period):
+    resource_queries = []
+    for stat in stats:
+        for metric_name, unit in metrics.items():
+            metric_stat = {
+                'Metric': {
+                    'Namespace': namespace,
+                    'MetricName': metric_name,
+                    'Dimensions': [
+                        {
+                            'Name': dimension_name,
+                            'Value': resource_id
+                        },
+                    ]
+                },
+                'Period': period,
+                'Stat': stat
+            }
+            if unit:
+                metric_stat['Unit'] = unit
+            resource_queries.append(((resource_id, metric_name, stat), {'MetricStat': metric_stat, 'ReturnData': True}))
+    return resource_queries
+
+
+# per resource, hidden Sum series with one returned per-second rate expression `m/PERIOD(m)` per metric;
+# the rate is the average over each period, so its peak is the busiest period (5 minutes for EBS) rather than the
+# busiest minute a Maximum query gives, and rate x period gives back the Sum; only half as many series come back
+# as with separate Maximum and Sum queries
+# totals maps a combined name to the metrics it adds up, e.g. {'VolumeOps': ['VolumeReadOps', 'VolumeWriteOps']},
+# and returns the coincident read+write rate `SUM([r,w])/PERIOD(r)`
+def build_metric_math_queries(resource_id, namespace, dimension_name, metrics, period, totals=None):
+    raw_queries = build_metric_queries(resource_id, namespace, dimension_name, metrics, ['Sum'], period)
+    local_ids = {}
+    resource_queries = []
+    for i, ((_, metric_name, stat), query) in enumerate(raw_queries):
+        local_ids[metric_name] = f'm{i}'
+        resource_queries.append((None, dict(query, Id=f'm{i}', ReturnData=False)))
+    for metric_name, local_id in local_ids.items():
+        resource_queries.append(((resource_id, metric_name, 'Rate'), {'Expression': f'{local_id}/PERIOD({local_id})', 'Label': metric_name, 'Period': period, 'ReturnData': True}))
+    for total_name, total_metrics in (totals or {}).items():
+        ids = [local_ids[metric_name] for metric_name in total_metrics]
+        resource_queries.append(((resource_id, total_name, 'Rate'), {'Expression': f'SUM([{",".join(ids)}])/PERIOD({ids[0]})', 'Label': total_name, 'Period': period, 'ReturnData': True}))
+    return resource_queries
+
+
+# number of datapoints a query returns over the window; hidden intermediate series return none
+def query_datapoints(query, start, end):
+    if not query.get('ReturnData', True):
+        return 0
+    period = query['MetricStat']['Period'] if 'MetricStat' in query else query['Period']
+    return math.ceil((end - start).total_seconds() / period)
+
+
+def resource_datapoints(resource_queries, start, end):
+    return sum(query_datapoints(query, start, end) for key, query in resource_queries)
+
+
+# pack the queries of many resources into batches of at most max_queries, sized so a batch
+# stays within the datapoint budget and never gets truncated into extra NextToken pages
+# all queries of a resource stay in the same batch so each batch yields complete rows
+# starts optionally gives each resource a later start, e.g. its creation time, in ascending order; each batch is
+# then queried from batch.start, the start of its first resource, and leaves out the range none of them existed in
+def plan_batches(resource_queries, start, end, max_queries=MAX_QUERIES_PER_REQUEST, max_datapoints=MAX_DATAPOINTS_PER_REQUEST, starts=None):
+    batches = []
+    batch = MetricBatch()
+    for i, (resource, queries) in enumerate(resource_queries):
+        resource_start = start if starts is None else starts[i]
+        datapoints = resource_datapoints(queries, batch.start or resource_start, end)
+        if len(batch) and (len(batch) + len(queries) > max_queries or batch.datapoints + datapoints > max_datapoints):
+            batches.append(batch)
+            batch = MetricBatch()
+            datapoints = resource_datapoints(queries, resource_start, end)
+        if starts is not None and batch.start is None:
+            batch.start = resource_start
+        batch.add(resource, queries)
+        batch.datapoints += datapoints
+    if len(batch):
+        batches.append(batch)
+    return batches
+
+
+# yield GetMetricData response pages one at a time, following NextToken until the results are complete
+def iter_metric_data_pages(cw_client, metric_data_queries, start, end, **kwargs):
+    request = dict(MetricDataQueries=metric_data_queries, StartTime=start, EndTime=end, **kwargs)
+    while True:
+        cw_response = cw_client.get_metric_data(**request)
+        yield cw_response
+        next_token = cw_response.get('NextToken')
+        if not next_token:
+            break
+        request['NextToken'] = next_token
+
+
+# yield the partial series (Id, timestamps, values) of each page as it arrives
+def iter_metric_data_results(pages):
+    for cw_response in pages:
+        for result in cw_response['MetricDataResults']:
+            yield result['Id'], result['Timestamps'], result['Values']
+
+
+# run one batch and merge the paged partial series back into {(resource_id, metric_name, stat): (timestamps, values)}
+def cw_pull_metric_series(cw_client, batch, start, end, **kwargs):
+    results = {key: ([], []) for key in batch.keys.values() if key is not None}
+    pages = iter_metric_data_pages(cw_client, batch.queries, start, end, **kwargs)
+    for query_id, timestamps, values in iter_metric_data_results(pages):
+        if batch.keys[query_id] is None:
+            continue
+        series = results[batch.keys[query_id]]
+        series[0].extend(timestamps)
+        series[1].extend(values)
+    return results
+
+
+# run one batch and return {(resource_id, metric_name, stat): values}
+def cw_pull_metric_batch(cw_client, batch, start, end, **kwargs):
+    return {key: values for key, (timestamps, values) in cw_pull_metric_series(cw_client, batch, start, end, **kwargs).items()}
+
+
+# cache key of a returned series: (namespace, dimension name, dimension value, metric, stat, period)
+# expressions take namespace and dimension from the resource's metrics and metric and stat from their key
+def series_key(key, query, metric_stat):
+    dimension = metric_stat['Metric']['Dimensions'][0]
+    period = query['MetricStat']['Period'] if 'MetricStat' in query else query['Period']
+    return (metric_stat['Metric']['Namespace'], dimension['Name'], dimension['Value'], key[1], key[2], period)
+
+
+# (cache key, batch key) of every returned series in a resource's group of queries
+def group_series_keys(group):
+    metric_stat = next(query['MetricStat'] for key, query in group if 'MetricStat' in query)
+    return [(series_key(key, query, metric_stat), key) for key, query in group if key is not None]
+
+
+# like cw_pull_metric_series, but only the time ranges missing from the cache are requested from CloudWatch
+# a resource's whole group is sent for each range it is missing so expressions keep their inputs,
+# resources missing the same range are sent together, then every series is read back from the cache
+def cw_pull_metric_series_cached(cw_client, batch, start, end, cache, **kwargs):
+    missing = {}
+    for group in batch.groups:
+        fetch_ranges = {fetch_range for cache_key, key in group_series_keys(group) for fetch_range in cache.missing_ranges(cache_key, start, end)}
+        for fetch_range in sorted(fetch_ranges):
+            missing.setdefault(fetch_range, MetricBatch()).add_group(group)
+    for (fetch_start, fetch_end), missing_batch in missing.items():
+        series = cw_pull_metric_series(cw_client, missing_batch, fetch_start, fetch_end, **kwargs)
+        for group in missing_batch.groups:
+            for cache_key, key in group_series_keys(group):
+                timestamps, values = series[key]
+                cache.store(cache_key, timestamps, values, fetch_start, fetch_end)
+    return {key: cache.read_series(cache_key, start, end) for group in batch.groups for cache_key, key in group_series_keys(group)}
+
+
+# like cw_pull_metric_batch, reading through the cache
+def cw_pull_metric_batch_cached(cw_client, batch, start, end, cache, **kwargs):
+    return {key: values for key, (timestamps, values) in cw_pull_metric_series_cached(cw_client, batch, start, end, cache, **kwargs).items()}
+
+
+# round a naive UTC datetime down to a whole number of seconds since the epoch, e.g. the metric period
+# aligned windows let daily reruns line up with what is already cached
+def floor_time(dt, seconds):
+    epoch = datetime(1970, 1, 1)
+    return epoch + timedelta(seconds=int((dt - epoch).total_seconds()) // seconds * seconds)
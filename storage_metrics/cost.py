@@ -0,0 +1,129 @@
+# purpose: estimate Aurora Standard vs I/O-Optimized monthly cost from already collected metrics
+# every resource and pricing scenario is priced at once as (resources x scenarios) arrays, CloudWatch is not called again
+
+import itertools
+import numpy as np
+import pandas as pd
+from storage_metrics.aggregate import masked_divide
+
+# Aurora counts a read I/O per 8 KiB page and a write I/O per 4 KiB unit
+READ_IO_BYTES = 8 * 1024
+WRITE_IO_BYTES = 4 * 1024
+
+PRICE_COLUMNS = ['standard_storage_gb_month', 'standard_io_per_million', 'io_optimized_storage_gb_month', 'io_optimized_instance_uplift']
+# multipliers a scenario may set, each defaults to 1
+SCENARIO_COLUMNS = ['io_growth', 'storage_growth', 'io_price_scale', 'storage_price_scale']
+
+
+# region,standard_storage_gb_month,... one row per region
+def read_prices(price_file):
+    prices = pd.read_csv(price_file).set_index('region')
+    missing = [column for column in PRICE_COLUMNS if column not in prices.columns]
+    if missing:
+        raise ValueError(f'{price_file} is missing price columns: {missing}')
+    return prices[PRICE_COLUMNS].astype(float)
+
+
+# every combination of the given multipliers as a scenario frame, e.g. scenario_grid(io_growth=[0.5, 1, 2])
+def scenario_grid(**multipliers):
+    unknown = [name for name in multipliers if name not in SCENARIO_COLUMNS]
+    if unknown:
+        raise ValueError(f'unknown scenario multipliers: {unknown}, expected {SCENARIO_COLUMNS}')
+    names = list(multipliers)
+    scenarios = pd.DataFrame(list(itertools.product(*multipliers.values())), columns=names) if names else pd.DataFrame(index=[0])
+    for column in SCENARIO_COLUMNS:
+        if column not in scenarios.columns:
+            scenarios[column] = 1.0
+    scenarios.insert(0, 'scenario', [','.join(f'{name}={row[name]:g}' for name in names) or 'baseline' for _, row in scenarios.iterrows()])
+    return scenarios
+
+
+# scenario csv with a scenario name column and any of SCENARIO_COLUMNS, missing multipliers default to 1
+def read_scenarios(scenario_file):
+    scenarios = pd.read_csv(scenario_file)
+    if 'scenario' not in scenarios.columns:
+        scenarios.insert(0, 'scenario', [f'scenario-{i}' for i in range(len(scenarios))])
+    for column in SCENARIO_COLUMNS:
+        if column not in scenarios.columns:
+            scenarios[column] = 1.0
+    return scenarios
+
+
+def _column(columns, word):
+    return next(column for column in columns if word in column)
+
+
+# monthly billed Aurora I/Os per resource from the collected *Sum columns, normalised to Aurora's page accounting
+# an operation larger than the page is billed as ceil(average size / page) I/Os
+def billed_ios(df, plugin):
+    read_ops = plugin.sum_to_total(df[_column(plugin.ops_columns, 'Read')].to_numpy(float))
+    write_ops = plugin.sum_to_total(df[_column(plugin.ops_columns, 'Write')].to_numpy(float))
+    read_bytes = plugin.sum_to_total(df[_column(plugin.bytes_columns, 'Read')].to_numpy(float))
+    write_bytes = plugin.sum_to_total(df[_column(plugin.bytes_columns, 'Write')].to_numpy(float))
+    read_ios = np.nan_to_num(read_ops) * np.maximum(1, np.ceil(masked_divide(read_bytes, read_ops) / READ_IO_BYTES))
+    write_ios = np.nan_to_num(write_ops) * np.maximum(1, np.ceil(masked_divide(write_bytes, write_ops) / WRITE_IO_BYTES))
+    return read_ios, write_ios
+
+
+class CostModel:
+    # df is the output of get_ebs_data/get_rds, one row per resource with region and the *Sum columns
+    # instance_column holds each resource's current monthly instance cost, for the I/O-Optimized uplift
+    # the uplift and the storage price often decide between the two, so a resource whose instance cost or storage
+    # size is unknown is priced with them as zero but gets no recommendation, and is listed in missing
+    def __init__(self, df, plugin, prices, instance_column=None):
+        self.df = df.reset_index(drop=True)
+        self.read_ios, self.write_ios = billed_ios(self.df, plugin)
+        self.ios = self.read_ios + self.write_ios
+        sizes = self.df[plugin.size_column] if plugin.size_column in self.df.columns else pd.Series(np.nan, index=self.df.index)
+        sizes = pd.to_numeric(sizes, errors='coerce')
+        self.storage_gb = sizes.fillna(0).to_numpy(float)
+        instance = pd.to_numeric(self.df[instance_column], errors='coerce') if instance_column else pd.Series(np.nan, index=self.df.index)
+        self.instance_monthly = instance.fillna(0).to_numpy(float)
+        self.missing = {'instance cost': int(instance.isna().sum()), 'storage size': int(sizes.isna().sum())}
+        self.recommendable = (instance.notna() & sizes.notna()).to_numpy()
+        # price rows aligned to the resources once, regions without a price come out as NaN
+        region_prices = prices.reindex(self.df['region'])
+        self.unpriced = sorted(set(self.df['region'][region_prices.isna().any(axis=1).to_numpy()]))
+        self.prices = {column: region_prices[column].to_numpy(float) for column in PRICE_COLUMNS}
+
+    # (resources x scenarios) monthly costs of both configurations
+    def price(self, scenarios):
+        s = {column: scenarios[column].to_numpy(float)[None, :] for column in SCENARIO_COLUMNS}
+        p = {column: values[:, None] for column, values in self.prices.items()}
+        storage_gb = self.storage_gb[:, None] * s['storage_growth']
+        ios = self.ios[:, None] * s['io_growth']
+        instance = self.instance_monthly[:, None]
+        standard_io = ios / 1e6 * p['standard_io_per_million'] * s['io_price_scale']
+        standard = storage_gb * p['standard_storage_gb_month'] * s['storage_price_scale'] + standard_io + instance
+        io_optimized = storage_gb * p['io_optimized_storage_gb_month'] * s['storage_price_scale'] + instance * (1 + p['io_optimized_instance_uplift'])
+        return standard, io_optimized, standard_io
+
+    # per-resource costs under one scenario, alongside the collected columns
+    def resource_costs(self, scenarios, scenario=0):
+        standard, io_optimized, standard_io = self.price(scenarios.iloc[[scenario]])
+        df = self.df.copy()
+        df['AuroraReadIOs'] = self.read_ios
+        df['AuroraWriteIOs'] = self.write_ios
+        df['AuroraStandardIoMonthly'] = standard_io[:, 0]
+        df['AuroraStandardMonthly'] = standard[:, 0]
+        df['AuroraIoOptimizedMonthly'] = io_optimized[:, 0]
+        df['AuroraIoOptimizedSavings'] = standard[:, 0] - io_optimized[:, 0]
+        # unpriced regions and resources without an instance cost or storage size get no recommendation
+        recommendation = np.where(io_optimized[:, 0] < standard[:, 0], 'io-optimized', 'standard')
+        df['AuroraRecommendation'] = np.where(np.isnan(standard[:, 0]) | ~self.recommendable, '', recommendation)
+        return df
+
+    # fleet totals per scenario: both configurations, the savings and how many resources each one wins
+    # resources that get no recommendation count as staying on Standard in the best mix
+    def fleet_summary(self, scenarios):
+        standard, io_optimized, standard_io = self.price(scenarios)
+        recommendable = self.recommendable[:, None]
+        summary = scenarios.copy()
+        summary['standard_monthly'] = np.nansum(standard, axis=0)
+        summary['io_optimized_monthly'] = np.nansum(io_optimized, axis=0)
+        summary['standard_io_share'] = masked_divide(np.nansum(standard_io, axis=0), summary['standard_monthly'])
+        summary['io_optimized_savings'] = summary['standard_monthly'] - summary['io_optimized_monthly']
+        summary['io_optimized_resources'] = ((io_optimized < standard) & recommendable).sum(axis=0)
+        summary['unrecommended_resources'] = (~recommendable | np.isnan(standard)).sum(axis=0)
+        summary['best_mix_monthly'] = np.nansum(np.where(recommendable, np.fmin(standard, io_optimized), standard), axis=0)
+        return summary
@@ -0,0 +1,125 @@
+# purpose: discover resources straight from the AWS APIs instead of a hand-maintained input csv
+# every region is paged in parallel and each page is handed to collection as soon as it arrives,
+# so metric batches start while discovery is still running
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from storage_metrics.clients import get_client
+from storage_metrics.inventory import MAX_DB_RESULTS, MAX_RESULTS, VolumeInventory, db_instance_row, tag_dict
+
+# region used for the DescribeRegions call that lists the enabled regions
+DEFAULT_REGION = 'us-east-1'
+
+
+# regions enabled for the account: the default ones plus any that were opted in
+def enabled_regions(account=None):
+    response = get_client('ec2', DEFAULT_REGION, account).describe_regions(Filters=[{'Name': 'opt-in-status', 'Values': ['opt-in-not-required', 'opted-in']}])
+    return sorted(region['RegionName'] for region in response['Regions'])
+
+
+# parse repeated --tag Key=Value command-line values, a bare Key matches any value
+def parse_tag_args(values):
+    tags = {}
+    for value in values or []:
+        key, _, tag_value = value.partition('=')
+        tags.setdefault(key.strip(), [])
+        if tag_value:
+            tags[key.strip()].append(tag_value.strip())
+    return tags
+
+
+# every tag filter must match; a key with values matches any of them
+def tags_match(tags, wanted):
+    return all(key in tags and (not values or tags[key] in values) for key, values in wanted.items())
+
+
+# pages of EBS volume rows for one region; tag, type and state are filtered server side
+def discover_volumes(region, tags, types, states, account=None):
+    filters = [{'Name': f'tag:{key}', 'Values': values} if values else {'Name': 'tag-key', 'Values': [key]} for key, values in tags.items()]
+    if types:
+        filters.append({'Name': 'volume-type', 'Values': list(types)})
+    if states:
+        filters.append({'Name': 'status', 'Values': list(states)})
+    paginator = get_client('ec2', region, account).get_paginator('describe_volumes')
+    for page in paginator.paginate(Filters=filters, PaginationConfig={'PageSize': MAX_RESULTS}):
+        # attached instances are looked up per page, so their names are ready when the page is collected
+        inventory = VolumeInventory()
+        inventory.add_volumes(region, page['Volumes'], account)
+        inventory.load_instances(region, list(inventory.volumes), account)
+        yield [inventory.volume_row(ebs_id) for ebs_id in inventory.volumes]
+
+
+# pages of RDS instance rows for one region; engine is filtered server side, tags and status on the results
+def discover_db_instances(region, tags, types, states, account=None):
+    filters = [{'Name': 'engine', 'Values': list(types)}] if types else []
+    paginator = get_client('rds', region, account).get_paginator('describe_db_instances')
+    for page in paginator.paginate(Filters=filters, PaginationConfig={'PageSize': MAX_DB_RESULTS}):
+        yield [
+            db_instance_row(region, instance, account)
+            for instance in page['DBInstances']
+            if (not states or instance['DBInstanceStatus'] in states) and tags_match(tag_dict(instance.get('TagList')), tags)
+        ]
+
+
+# discovery function per resource plugin name
+DISCOVERERS = {
+    'ebs': discover_volumes,
+    'rds': discover_db_instances
+}
+
+
+# run discover(region, ..., account=account) for every (account, region) on a thread pool and yield
+# ((account, region), rows) pages as they arrive; closing the generator stops the rest after their current page
+def stream_regions(locations, discover, *discover_args, max_workers=16):
+    pages = queue.Queue()
+    stop = threading.Event()
+
+    def work(location):
+        account, region = location
+        try:
+            for rows in discover(region, *discover_args, account=account):
+                if stop.is_set():
+                    break
+                pages.put((location, rows, None))
+        except Exception as e:
+            pages.put((location, None, e))
+        finally:
+            pages.put((location, None, None))
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(locations))), thread_name_prefix='discover')
+    try:
+        for location in locations:
+            pool.submit(work, location)
+        running = len(locations)
+        while running:
+            location, rows, error = pages.get()
+            if error is not None:
+                print(f'An error occurred discovering resources in region: {location_text(location)}')
+                print(error)
+            elif rows is None:
+                running -= 1
+            elif rows:
+                yield location, rows
+    finally:
+        stop.set()
+        pool.shutdown(wait=False)
+
+
+def location_text(location):
+    account, region = location
+    return region if account is None else f'{region} in account: {account}'
+
+
+# discovered resources as a stream of DataFrames, one per page, with labels unique across the whole run
+# accounts are account ids or role ARNs to discover in through an assumed role, every region of every account in parallel
+def discover_resources(plugin, regions=None, tags=None, types=None, states=None, max_workers=16, accounts=None):
+    locations = [(account, region) for account in accounts or [None] for region in regions or enabled_regions(account)]
+    print(f'Discovering {plugin.noun} in {len(locations)} regions' + (f' of {len(accounts)} accounts' if accounts else '') + f': {sorted({region for account, region in locations})}')
+    offset = 0
+    for location, rows in stream_regions(locations, DISCOVERERS[plugin.name], tags or {}, types or [], states or [], max_workers=max_workers):
+        df = pd.DataFrame(rows, index=range(offset, offset + len(rows)))
+        offset += len(rows)
+        print(f'Discovered {len(df)} {plugin.noun} in region: {location_text(location)}')
+        yield df
@@ -0,0 +1,74 @@
+# purpose: run collection work concurrently across regions and batches
+# each region gets its own bounded thread pool, results flow back through a queue to a single writer
+
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+
+
+# round robin over per-region job lists so every region's pool is kept busy from the start
+def interleave_regions(jobs_by_region):
+    for jobs in zip_longest(*jobs_by_region.values()):
+        for job in jobs:
+            if job is not None:
+                yield job
+
+
+# a region, or the parts of an (account, region) key
+def pool_name(key):
+    return '-'.join(str(part) for part in key if part is not None) if isinstance(key, tuple) else key
+
+
+def print_error(region, payload, error):
+    print(f'An error occurred collecting a batch in region: {region}')
+    print(error)
+
+
+class CollectionEngine:
+    def __init__(self, max_workers_per_region=8, max_pending=256):
+        self.max_workers_per_region = max_workers_per_region
+        self.max_pending = max_pending
+
+    # jobs is an iterable of (region, payload) and is consumed lazily, region may also be an (account, region) key
+    # fetch(region, payload) runs on the region's worker threads
+    # handle_result(region, payload, result) only ever runs on the calling thread
+    def run(self, jobs, fetch, handle_result, handle_error=print_error):
+        results = queue.Queue()
+        pools = {}
+        pending = 0
+
+        def work(region, payload):
+            try:
+                results.put((region, payload, fetch(region, payload), None))
+            except BaseException as e:
+                results.put((region, payload, None, e))
+
+        def drain(block):
+            region, payload, result, error = results.get(block=block)
+            # interrupts and exits stop the run, ordinary errors only lose their batch
+            if error is not None and not isinstance(error, Exception):
+                raise error
+            if error is not None:
+                handle_error(region, payload, error)
+            else:
+                handle_result(region, payload, result)
+
+        try:
+            for region, payload in jobs:
+                # bound the work in flight, writing finished results while waiting
+                while pending >= self.max_pending:
+                    drain(True)
+                    pending -= 1
+                if region not in pools:
+                    pools[region] = ThreadPoolExecutor(max_workers=self.max_workers_per_region, thread_name_prefix=f'collect-{pool_name(region)}')
+                pools[region].submit(work, region, payload)
+                pending += 1
+                while not results.empty():
+                    drain(False)
+                    pending -= 1
+            while pending:
+                drain(True)
+                pending -= 1
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True, cancel_futures=True)
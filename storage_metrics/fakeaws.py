@@ -0,0 +1,624 @@
+# purpose: an offline stand-in for the CloudWatch, EC2 and RDS calls the scripts make, for benchmarks without AWS
+# responses are serialized in the wire protocol the client sent (JSON or XML) and handed to botocore from its
+# before-send event, so parsing, retries, pagination and the rate limiter run as they do against AWS;
+# only the network is replaced, by a latency, per (account, region, API) quota throttling and optional random throttles
+# usage: clients.set_session_factory(FakeAWS(FakeFleet(volumes=1000)).session)
+
+import math
+import random
+import json
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape
+import boto3
+import numpy as np
+from botocore.awsrequest import AWSResponse
+from storage_metrics.cloudwatch import MAX_DATAPOINTS_PER_REQUEST
+
+REGIONS = [
+    'us-east-1', 'us-west-2', 'eu-west-1', 'ap-southeast-2', 'us-east-2', 'us-west-1', 'eu-central-1', 'eu-west-2',
+    'ap-northeast-1', 'ap-southeast-1', 'ap-south-1', 'ca-central-1', 'sa-east-1', 'eu-north-1', 'ap-northeast-2', 'eu-west-3'
+]
+DEFAULT_REGIONS = REGIONS[:4]
+# a quota the stand-in enforces per (region, API), a call over it is answered with the service's throttling error
+QUOTA_TPS = {
+    'GetMetricData': 50,
+    'DescribeVolumes': 20,
+    'DescribeInstances': 20,
+    'DescribeInstanceTypes': 20,
+    'DescribeVolumesModifications': 20,
+    'DescribeTags': 20,
+    'DescribeRegions': 20,
+    'DescribeDBInstances': 10,
+    'AssumeRole': 20
+}
+# keys of the default credentials, and the prefix of the keys AssumeRole hands out, followed by the account id
+ACCESS_KEY = 'AKIAFAKEBENCHMARK'
+ROLE_ACCESS_KEY = 'ASIAFAKE'
+ROLE_SECONDS = 3600
+# response time of a call: a base latency plus time per returned datapoint
+DEFAULT_LATENCY_MS = 40
+DATAPOINT_LATENCY_MS = 0.002
+
+# instance families whose EBS metrics have no per-minute Maximum
+NON_NITRO_TYPES = ['m4.large', 't2.medium', 'c4.xlarge', 'r4.large']
+NITRO_TYPES = ['m5.large', 'm5.xlarge', 'c5.2xlarge', 'r6i.xlarge', 'm6g.large', 't3.medium', 'm5.metal']
+VOLUME_TYPES = ['gp3', 'gp3', 'gp2', 'io2', 'st1', 'gp3', 'gp2', 'sc1']
+DB_ENGINES = ['aurora-mysql', 'aurora-postgresql', 'mysql', 'postgres']
+DB_CLASSES = ['db.r6g.large', 'db.r6g.xlarge', 'db.r5.2xlarge', 'db.m6g.large']
+
+
+# deterministic pseudo random number in [0, 1) for an index and a salt, so the fleet needs no state per resource
+def unit(index, salt):
+    x = (index * 0x9E3779B97F4A7C15 + salt * 0xBF58476D1CE4E5B9 + 1) % 2 ** 64
+    x = ((x ^ (x >> 31)) * 0x94D049BB133111EB) % 2 ** 64
+    return (x ^ (x >> 29)) / 2 ** 64
+
+
+# deterministic noise in [0, 1) for every timestamp of a series, the same on every call so cached reruns line up
+def noise(timestamps, salt):
+    return np.modf(np.abs(np.sin(timestamps * 12.9898 + salt * 78.233)) * 43758.5453)[0]
+
+
+# a synthetic fleet, every volume, instance and DB instance is generated from its index on demand
+# volumes are attached volumes_per_instance to an instance, unattached_share of them are available instead
+class FakeFleet:
+    def __init__(self, volumes=100, db_instances=10, regions=None, volumes_per_instance=3, unattached_share=0.1, seed=0, now=None):
+        self.volume_count = volumes
+        self.db_instance_count = db_instances
+        self.regions = list(regions or DEFAULT_REGIONS)
+        self.volumes_per_instance = volumes_per_instance
+        self.unattached_share = unattached_share
+        self.seed = seed
+        self.now = (now or datetime.utcnow()).replace(microsecond=0, tzinfo=timezone.utc)
+        self.volume_regions = np.array([self.region_index(i // volumes_per_instance) for i in range(volumes)], dtype=np.int32)
+        self.db_regions = np.arange(db_instances) % len(self.regions)
+        # volume index -> its latest ModifyVolume, as DescribeVolumesModifications reports it
+        self.modifications = {}
+        # volume index -> tags set on it since it was created, as CreateTags would
+        self.tag_changes = {}
+        # volume index -> when it was detached with detach_volume
+        self.detachments = {}
+
+    def region_index(self, instance_index):
+        return instance_index % len(self.regions)
+
+    def volume_id(self, i):
+        return f'vol-{i:017x}'
+
+    def instance_id(self, j):
+        return f'i-{j:017x}'
+
+    def db_instance_id(self, k):
+        return f'bench-db-{k:06d}'
+
+    # index of a generated id, None for ids the fleet does not have
+    def index(self, resource_id, prefix, count):
+        if not resource_id.startswith(prefix):
+            return None
+        try:
+            i = int(resource_id[len(prefix):], 16 if prefix != 'bench-db-' else 10)
+        except ValueError:
+            return None
+        return i if 0 <= i < count else None
+
+    def volume_index(self, ebs_id):
+        return self.index(ebs_id, 'vol-', self.volume_count)
+
+    def instance_index(self, instance_id):
+        return self.index(instance_id, 'i-', math.ceil(self.volume_count / self.volumes_per_instance))
+
+    def db_instance_index(self, instance):
+        return self.index(instance, 'bench-db-', self.db_instance_count)
+
+    def attached(self, i):
+        return i not in self.detachments and unit(i, self.seed + 1) >= self.unattached_share
+
+    # when an unattached volume was detached, up to 60 days ago unless set with detach_volume; its metrics stop then
+    def detached(self, i):
+        if i in self.detachments:
+            return self.detachments[i]
+        return self.now - timedelta(days=int(unit(i, self.seed + 50) * 60), hours=int(unit(i, self.seed + 51) * 24))
+
+    def nitro(self, j):
+        return unit(j, self.seed + 2) >= 0.2
+
+    def created(self, i, salt=3):
+        return self.now - timedelta(days=int(unit(i, self.seed + salt) * 730), hours=int(unit(i, self.seed + salt + 1) * 24))
+
+    # record a ModifyVolume of volume i, e.g. to see a cached inventory describe it again
+    def modify_volume(self, i, state='optimizing', start=None):
+        self.modifications[i] = {'ModificationState': state, 'StartTime': start or datetime.now(timezone.utc), 'Progress': 0 if state == 'modifying' else 50}
+
+    # record a DetachVolume of volume i at a time, e.g. to see a volume detached within the window keep its data
+    def detach_volume(self, i, at):
+        self.detachments[i] = at.replace(tzinfo=timezone.utc) if at.tzinfo is None else at
+
+    # record a CreateTags on volume i, e.g. to see a cached inventory describe it again
+    def tag_volume(self, i, key, value):
+        self.tag_changes.setdefault(i, {})[key] = value
+
+    # the tags of volume i, those set with tag_volume replacing its own
+    def volume_tags(self, i):
+        j = i // self.volumes_per_instance
+        tags = {'Name': f'bench-volume-{i}', 'app': f'app-{j % 20}', 'env': 'prod' if j % 3 else 'dev'}
+        tags.update(self.tag_changes.get(i, {}))
+        return [{'Key': key, 'Value': value} for key, value in tags.items()]
+
+    def region_volumes(self, region):
+        return np.flatnonzero(self.volume_regions == self.regions.index(region))
+
+    def region_db_instances(self, region):
+        return np.flatnonzero(self.db_regions == self.regions.index(region))
+
+    # DescribeVolumes item
+    def volume(self, i):
+        volume_type = VOLUME_TYPES[int(unit(i, self.seed + 5) * len(VOLUME_TYPES))]
+        j = i // self.volumes_per_instance
+        region = self.regions[self.volume_regions[i]]
+        volume = {
+            'VolumeId': self.volume_id(i),
+            'Size': [8, 20, 50, 100, 200, 500, 1000, 2000][int(unit(i, self.seed + 6) * 8)],
+            'AvailabilityZone': f'{region}a',
+            'State': 'in-use' if self.attached(i) else 'available',
+            'CreateTime': self.created(i),
+            'VolumeType': volume_type,
+            'Encrypted': True,
+            'MultiAttachEnabled': False,
+            'Attachments': [],
+            'Tags': self.volume_tags(i)
+        }
+        if volume_type in ['gp3', 'io2']:
+            volume['Iops'] = 3000 if volume_type == 'gp3' else 16000
+        if volume_type == 'gp3':
+            volume['Throughput'] = 125
+        if self.attached(i):
+            volume['Attachments'] = [{
+                'VolumeId': volume['VolumeId'], 'InstanceId': self.instance_id(j), 'Device': f'/dev/xvd{"abcdefghijklmnop"[i % self.volumes_per_instance % 16]}',
+                'State': 'attached', 'AttachTime': volume['CreateTime'], 'DeleteOnTermination': True
+            }]
+        return volume
+
+    # DescribeInstances item
+    def instance(self, j):
+        types = NITRO_TYPES if self.nitro(j) else NON_NITRO_TYPES
+        return {
+            'InstanceId': self.instance_id(j),
+            'InstanceType': types[int(unit(j, self.seed + 7) * len(types))],
+            'State': {'Code': 16, 'Name': 'running'},
+            'LaunchTime': self.created(j, salt=8),
+            'Placement': {'AvailabilityZone': f'{self.regions[self.region_index(j)]}a'},
+            'Tags': [{'Key': 'Name', 'Value': f'bench-host-{j}'}, {'Key': 'app', 'Value': f'app-{j % 20}'}]
+        }
+
+    # DescribeDBInstances item
+    def db_instance(self, k):
+        return {
+            'DBInstanceIdentifier': self.db_instance_id(k),
+            'DBInstanceClass': DB_CLASSES[int(unit(k, self.seed + 9) * len(DB_CLASSES))],
+            'Engine': DB_ENGINES[int(unit(k, self.seed + 10) * len(DB_ENGINES))],
+            'DBInstanceStatus': 'stopped' if unit(k, self.seed + 11) < 0.05 else 'available',
+            'AllocatedStorage': [20, 100, 500, 1000][int(unit(k, self.seed + 12) * 4)],
+            'StorageType': 'aurora' if unit(k, self.seed + 10) < 0.5 else 'gp3',
+            'InstanceCreateTime': self.created(k, salt=13),
+            'TagList': [{'Key': 'Name', 'Value': f'bench-db-{k}'}, {'Key': 'env', 'Value': 'prod' if k % 3 else 'dev'}]
+        }
+
+    # input csv frames of the scripts: region,ebs_id for EBS and type,region,instance for RDS
+    def input_rows(self, plugin_name):
+        if plugin_name == 'ebs':
+            return [{'region': self.regions[self.volume_regions[i]], 'ebs_id': self.volume_id(i)} for i in range(self.volume_count)]
+        return [{'type': 'rds', 'region': self.regions[self.db_regions[k]], 'instance': self.db_instance_id(k)} for k in range(self.db_instance_count)]
+
+    # per-second rate of a metric over the timestamps, None when the resource publishes no datapoints for it
+    # rates follow a daily cycle around a per resource base, bytes are ops times a per resource IO size
+    def metric_rates(self, namespace, dimension_value, metric_name, stat, timestamps):
+        if namespace == 'AWS/EBS':
+            i = self.volume_index(dimension_value)
+            # volumes only publish while attached, and Maximum only from Nitro instances
+            if i is None or (stat == 'Maximum' and not self.nitro(i // self.volumes_per_instance)):
+                return None
+            created = self.created(i)
+            if not self.attached(i):
+                timestamps = timestamps[timestamps < self.detached(i).timestamp()]
+        elif namespace == 'AWS/RDS':
+            i = self.db_instance_index(dimension_value)
+            if i is None:
+                return None
+            created = self.created(i, salt=13)
+        else:
+            return None
+        timestamps = timestamps[timestamps >= created.timestamp()]
+        direction = 1 if 'Read' in metric_name else 2
+        ops = 5 + 500 * unit(i, self.seed + 20 + direction)
+        if 'Bytes' in metric_name or 'Throughput' in metric_name:
+            ops *= 4096 * 2 ** int(unit(i, self.seed + 30 + direction) * 6)
+        phase = unit(i, self.seed + 40)
+        daily = 1 + 0.6 * np.sin(2 * np.pi * (timestamps / 86400 + phase))
+        return timestamps, ops * daily * (0.7 + 0.6 * noise(timestamps, i + direction))
+
+    # one MetricStat series as a CloudWatch statistic; EBS sums count per period, RDS publishes per-second rates every minute
+    def metric_stat(self, metric_stat, start, end):
+        period = metric_stat['Period']
+        metric = metric_stat['Metric']
+        timestamps = np.arange(math.ceil(start / period) * period, end, period, dtype=np.int64)
+        series = self.metric_rates(metric['Namespace'], metric['Dimensions'][0]['Value'], metric['MetricName'], metric_stat['Stat'], timestamps)
+        if series is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        timestamps, rates = series
+        per_minute = metric['Namespace'] == 'AWS/EBS'
+        peak = 1 + 0.8 * noise(timestamps, 7)
+        values = {
+            'Sum': rates * period if per_minute else rates * period / 60,
+            'Maximum': rates * peak * (60 if per_minute else 1),
+            'Average': rates * (60 if per_minute else 1),
+            'SampleCount': np.full(len(rates), period / 60)
+        }[metric_stat['Stat']]
+        return timestamps, values
+
+
+# a value as the JSON of its botocore shape: timestamps are epoch seconds, numpy arrays are converted in one go
+def json_value(shape, value):
+    if shape.type_name == 'structure':
+        return {name: json_value(shape.members[name], item) for name, item in value.items() if name in shape.members and item is not None}
+    if shape.type_name == 'list':
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        return [json_value(shape.member, item) for item in value]
+    if shape.type_name == 'timestamp':
+        return value.timestamp() if isinstance(value, datetime) else value
+    return value
+
+
+# encode a value as the XML of its botocore shape, member and list item names come from the service model
+def xml(shape, value):
+    if shape.type_name == 'structure':
+        parts = []
+        for name, item in value.items():
+            if name in shape.members and item is not None:
+                tag = shape.members[name].serialization.get('name', name)
+                parts.append(f'<{tag}>{xml(shape.members[name], item)}</{tag}>')
+        return ''.join(parts)
+    if shape.type_name == 'list':
+        tag = shape.member.serialization.get('name', 'member')
+        return ''.join(f'<{tag}>{xml(shape.member, item)}</{tag}>' for item in value)
+    if shape.type_name == 'timestamp':
+        if not isinstance(value, datetime):
+            value = datetime.fromtimestamp(int(value), tz=timezone.utc)
+        return value.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    if shape.type_name == 'boolean':
+        return 'true' if value else 'false'
+    return escape(str(value))
+
+
+# the raw body botocore reads a response from
+class RawBody:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+class Throttled(Exception):
+    pass
+
+
+# token bucket enforcing a quota, a call without a token is throttled instead of waiting
+class Quota:
+    def __init__(self, tps):
+        self.tps = tps
+        self.tokens = float(tps)
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.tps, self.tokens + (now - self.updated) * self.tps)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+# the stand-in itself: answers every call a session's clients send, and counts them per (region, API)
+class FakeAWS:
+    def __init__(self, fleet, latency_ms=DEFAULT_LATENCY_MS, throttle_rate=0.0, quotas=None, seed=0):
+        self.fleet = fleet
+        self.latency = latency_ms / 1000
+        self.throttle_rate = throttle_rate
+        self.quota_tps = dict(QUOTA_TPS, **(quotas or {}))
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.quotas = {}
+        self.calls = {}
+        self.throttles = {}
+        self.datapoints = 0
+        self.response_bytes = 0
+        self.params = threading.local()
+        self.operations = {
+            'GetMetricData': self.get_metric_data,
+            'DescribeVolumes': self.describe_volumes,
+            'DescribeInstances': self.describe_instances,
+            'DescribeInstanceTypes': self.describe_instance_types,
+            'DescribeVolumesModifications': self.describe_volumes_modifications,
+            'DescribeTags': self.describe_tags,
+            'DescribeRegions': self.describe_regions,
+            'DescribeDBInstances': self.describe_db_instances,
+            'AssumeRole': self.assume_role
+        }
+
+    # a boto3 session whose clients talk to the stand-in; the responder is registered last so the
+    # rate limiter's before-send still runs for every attempt
+    # a botocore session passed in keeps its credentials, e.g. the assumed role of clients.get_session
+    def session(self, botocore_session=None):
+        if botocore_session is not None:
+            session = boto3.session.Session(botocore_session=botocore_session, region_name=self.fleet.regions[0])
+        else:
+            session = boto3.session.Session(aws_access_key_id=ACCESS_KEY, aws_secret_access_key='fake', region_name=self.fleet.regions[0])
+        session.events.register('before-parameter-build', self.remember_params)
+        session.events.register_last('before-send', self.respond)
+        return session
+
+    # the call's parameters before serialization, botocore sends from the calling thread
+    # kept per operation, as signing a call can make a nested AssumeRole call on the same thread
+    def remember_params(self, params, event_name, **kwargs):
+        if not hasattr(self.params, 'value'):
+            self.params.value = {}
+        self.params.value[event_name.split('.', 1)[1]] = params
+
+    def respond(self, request, event_name, **kwargs):
+        operation = event_name.split('.')[-1]
+        region = urlsplit(request.url).hostname.split('.')[1]
+        service = event_name.split('.')[1]
+        try:
+            self.admit(region, operation, request_account(request))
+            result, datapoints = self.operations[operation](region, self.params.value.pop(event_name.split('.', 1)[1]))
+            time.sleep(self.latency * (0.5 + self.random.random()) + datapoints * DATAPOINT_LATENCY_MS / 1000)
+            response = self.serialize(request, service, operation, result)
+        except Throttled:
+            time.sleep(self.latency * 0.5)
+            response = self.throttle_response(request, service)
+        with self.lock:
+            self.response_bytes += len(response.raw.body)
+        return response
+
+    # count the call and throttle it when its (account, region, API) quota is used up, or at random
+    def admit(self, region, operation, account=None):
+        key = (region, operation)
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+            if (account,) + key not in self.quotas:
+                self.quotas[(account,) + key] = Quota(self.quota_tps.get(operation, 10))
+            if not self.quotas[(account,) + key].take() or self.random.random() < self.throttle_rate:
+                self.throttles[key] = self.throttles.get(key, 0) + 1
+                raise Throttled()
+
+    # answered in the protocol the client chose: JSON for CloudWatch on current botocore, XML for EC2, RDS
+    # and CloudWatch on older releases
+    def serialize(self, request, service, operation, result):
+        request_id = str(uuid.uuid4())
+        shape = _service_models(service).operation_model(operation).output_shape
+        if uses_json(request):
+            headers = {'content-type': 'application/x-amz-json-1.0', 'x-amzn-requestid': request_id}
+            return AWSResponse(request.url, 200, headers, RawBody(json.dumps(json_value(shape, result)).encode('utf-8')))
+        body = xml(shape, result)
+        if service == 'ec2':
+            body = f'<{operation}Response><requestId>{request_id}</requestId>{body}</{operation}Response>'
+        else:
+            wrapper = shape.serialization['resultWrapper']
+            body = f'<{operation}Response><{wrapper}>{body}</{wrapper}><ResponseMetadata><RequestId>{request_id}</RequestId></ResponseMetadata></{operation}Response>'
+        return AWSResponse(request.url, 200, {'content-type': 'text/xml', 'x-amzn-requestid': request_id}, RawBody(body.encode('utf-8')))
+
+    # the error each service answers a throttled call with
+    def throttle_response(self, request, service):
+        request_id = str(uuid.uuid4())
+        if uses_json(request):
+            headers = {'content-type': 'application/x-amz-json-1.0', 'x-amzn-query-error': 'Throttling;Sender', 'x-amzn-requestid': request_id}
+            return AWSResponse(request.url, 400, headers, RawBody(json.dumps({'__type': 'Throttling', 'message': 'Rate exceeded'}).encode('utf-8')))
+        if service == 'ec2':
+            body = f'<Response><Errors><Error><Code>RequestLimitExceeded</Code><Message>Request limit exceeded.</Message></Error></Errors><RequestID>{request_id}</RequestID></Response>'
+            return AWSResponse(request.url, 503, {'content-type': 'text/xml'}, RawBody(body.encode('utf-8')))
+        body = f'<ErrorResponse><Error><Type>Sender</Type><Code>Throttling</Code><Message>Rate exceeded</Message></Error><RequestId>{request_id}</RequestId></ErrorResponse>'
+        return AWSResponse(request.url, 400, {'content-type': 'text/xml', 'x-amzn-requestid': request_id}, RawBody(body.encode('utf-8')))
+
+    # counters per (region, API) and in total
+    def stats(self):
+        with self.lock:
+            return {
+                'api_calls': sum(self.calls.values()),
+                'throttles': sum(self.throttles.values()),
+                'datapoints': self.datapoints,
+                'response_bytes': self.response_bytes,
+                'calls': [{'region': region, 'api': api, 'calls': calls, 'throttles': self.throttles.get((region, api), 0)} for (region, api), calls in sorted(self.calls.items())]
+            }
+
+    # GetMetricData: every MetricStat series is generated, expressions are evaluated over them and the returned
+    # series are paged at the service's datapoint limit, NextToken is the position of the next datapoint
+    def get_metric_data(self, region, params):
+        start, end = epoch(params['StartTime']), epoch(params['EndTime'])
+        series, periods, returned = {}, {}, []
+        for query in params['MetricDataQueries']:
+            if 'MetricStat' in query:
+                series[query['Id']] = self.fleet.metric_stat(query['MetricStat'], start, end)
+                periods[query['Id']] = query['MetricStat']['Period']
+            else:
+                series[query['Id']] = evaluate(query['Expression'], series, periods)
+            if query.get('ReturnData', True):
+                returned.append(query)
+        descending = params.get('ScanBy', 'TimestampDescending') == 'TimestampDescending'
+        query_index, offset = map(int, params.get('NextToken', '0:0').split(':'))
+        results, budget = [], MAX_DATAPOINTS_PER_REQUEST
+        while query_index < len(returned) and budget > 0:
+            query = returned[query_index]
+            timestamps, values = series[query['Id']]
+            if descending:
+                timestamps, values = timestamps[::-1], values[::-1]
+            part = slice(offset, offset + budget)
+            budget -= len(timestamps[part])
+            complete = offset + len(timestamps[part]) >= len(timestamps)
+            results.append({
+                'Id': query['Id'], 'Label': query.get('Label', query['Id']),
+                'Timestamps': timestamps[part], 'Values': np.asarray(values[part], dtype=float),
+                'StatusCode': 'Complete' if complete else 'PartialData'
+            })
+            query_index, offset = (query_index + 1, 0) if complete else (query_index, offset + len(timestamps[part]))
+        response = {'MetricDataResults': results, 'Messages': []}
+        if query_index < len(returned):
+            response['NextToken'] = f'{query_index}:{offset}'
+        datapoints = MAX_DATAPOINTS_PER_REQUEST - budget
+        with self.lock:
+            self.datapoints += datapoints
+        return response, datapoints
+
+    def describe_volumes(self, region, params):
+        filters = filter_values(params)
+        ids = filters.pop('volume-id', None) or params.get('VolumeIds')
+        if ids is not None:
+            candidates = [i for i in map(self.fleet.volume_index, ids) if i is not None and self.fleet.volume_regions[i] == self.fleet.regions.index(region)]
+        else:
+            candidates = self.fleet.region_volumes(region)
+        fields = {'volume-type': lambda v: v['VolumeType'], 'status': lambda v: v['State']}
+        volumes = (self.fleet.volume(int(i)) for i in candidates)
+        matching = [v for v in volumes if all(matches(v, name, values, fields) for name, values in filters.items())]
+        return page(matching, params, 'Volumes', 'MaxResults', 'NextToken'), 0
+
+    def describe_instances(self, region, params):
+        filters = filter_values(params)
+        ids = filters.pop('instance-id', None) or params.get('InstanceIds') or []
+        indexes = [j for j in map(self.fleet.instance_index, ids) if j is not None and self.fleet.region_index(j) == self.fleet.regions.index(region)]
+        response = page([self.fleet.instance(j) for j in indexes], params, 'Instances', 'MaxResults', 'NextToken')
+        instances = response.pop('Instances')
+        response['Reservations'] = [{'ReservationId': f'r-{instance["InstanceId"][2:]}', 'OwnerId': '123456789012', 'Instances': [instance]} for instance in instances]
+        return response, 0
+
+    # modifications are only those recorded with FakeFleet.modify_volume
+    def describe_volumes_modifications(self, region, params):
+        modifications = [dict(modification, VolumeId=self.fleet.volume_id(i)) for i, modification in sorted(self.fleet.modifications.items())
+                         if self.fleet.volume_regions[i] == self.fleet.regions.index(region)]
+        return page(modifications, params, 'VolumesModifications', 'MaxResults', 'NextToken'), 0
+
+    # tags of the region's volumes, one item per tag; only volumes are tagged in the fleet
+    def describe_tags(self, region, params):
+        filters = filter_values(params)
+        if 'volume' not in filters.get('resource-type', ['volume']):
+            return page([], params, 'Tags', 'MaxResults', 'NextToken'), 0
+        ids = filters.get('resource-id')
+        candidates = self.fleet.region_volumes(region) if ids is None else [i for i in map(self.fleet.volume_index, ids) if i is not None]
+        tags = [dict(tag, ResourceId=self.fleet.volume_id(int(i)), ResourceType='volume') for i in candidates for tag in self.fleet.volume_tags(int(i))]
+        return page(tags, params, 'Tags', 'MaxResults', 'NextToken'), 0
+
+    def describe_instance_types(self, region, params):
+        types = [name for name in params.get('InstanceTypes', NITRO_TYPES + NON_NITRO_TYPES) if name in NITRO_TYPES + NON_NITRO_TYPES]
+        return {'InstanceTypes': [instance_type_info(name) for name in types]}, 0
+
+    def describe_regions(self, region, params):
+        return {'Regions': [{'RegionName': name, 'Endpoint': f'ec2.{name}.amazonaws.com', 'OptInStatus': 'opt-in-not-required'} for name in self.fleet.regions]}, 0
+
+    # credentials whose access key carries the account, so later calls count against that account's quotas
+    def assume_role(self, region, params):
+        account = params['RoleArn'].split(':')[4]
+        return {
+            'Credentials': {
+                'AccessKeyId': f'{ROLE_ACCESS_KEY}{account}',
+                'SecretAccessKey': 'fake',
+                'SessionToken': f'fake-{account}',
+                'Expiration': datetime.now(timezone.utc) + timedelta(seconds=params.get('DurationSeconds', ROLE_SECONDS))
+            },
+            'AssumedRoleUser': {'AssumedRoleId': f'AROAFAKE:{params["RoleSessionName"]}', 'Arn': f'arn:aws:sts::{account}:assumed-role/{params["RoleArn"].split("/")[-1]}/{params["RoleSessionName"]}'}
+        }, 0
+
+    def describe_db_instances(self, region, params):
+        filters = filter_values(params)
+        fields = {'engine': lambda d: d['Engine'], 'db-instance-id': lambda d: d['DBInstanceIdentifier']}
+        instances = (self.fleet.db_instance(int(k)) for k in self.fleet.region_db_instances(region))
+        matching = [d for d in instances if all(matches(d, name, values, fields) for name, values in filters.items())]
+        return page(matching, params, 'DBInstances', 'MaxRecords', 'Marker'), 0
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+# botocore service models, loaded once
+def _service_models(service):
+    with _models_lock:
+        if service not in _models:
+            _models[service] = boto3.session.Session()._session.get_service_model(service)
+        return _models[service]
+
+
+# DescribeInstanceTypes entry of a type; bare metal types report no hypervisor, as the real API does
+def instance_type_info(name):
+    if name.endswith('.metal'):
+        return {'InstanceType': name, 'BareMetal': True}
+    return {'InstanceType': name, 'Hypervisor': 'xen' if name in NON_NITRO_TYPES else 'nitro', 'BareMetal': False}
+
+
+def uses_json(request):
+    content_type = request.headers.get('Content-Type', b'')
+    return b'json' in (content_type if isinstance(content_type, bytes) else content_type.encode())
+
+
+# account of the credentials a request was signed with, None for the default credentials
+def request_account(request):
+    authorization = request.headers.get('Authorization', b'')
+    authorization = authorization.decode() if isinstance(authorization, bytes) else authorization
+    match = re.search(f'Credential={ROLE_ACCESS_KEY}(\\d+)/', authorization)
+    return match.group(1) if match else None
+
+
+# seconds since the epoch of a request timestamp, naive datetimes are UTC
+def epoch(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+# metric math the collection pipeline sends: id, SUM([ids]), either one optionally divided by PERIOD(id)
+MATH_EXPRESSION = re.compile(r'^(?:(?P<id>[a-z]\w*)|SUM\(\[(?P<ids>[a-z]\w*(?:,[a-z]\w*)*)\]\))(?:/PERIOD\((?P<period>[a-z]\w*)\))?$')
+
+
+# the series of one of those expressions over already evaluated queries, parsed rather than run as code
+def evaluate(expression, series, periods):
+    match = MATH_EXPRESSION.match(expression.replace(' ', ''))
+    if match is None:
+        raise ValueError(f'unsupported metric math expression: {expression}')
+    ids = [match.group('id')] if match.group('id') else match.group('ids').split(',')
+    if any(not len(series[query_id][0]) for query_id in ids):
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    values = np.sum([np.asarray(series[query_id][1], dtype=float) for query_id in ids], axis=0)
+    if match.group('period'):
+        values = values / periods[match.group('period')]
+    return series[ids[0]][0], values
+
+
+# {filter name: values} of a describe call
+def filter_values(params):
+    return {f['Name']: list(f['Values']) for f in params.get('Filters', [])}
+
+
+# describe filters on a field, or on a tag as tag:Key or tag-key
+def matches(item, name, values, fields):
+    if name in fields:
+        return fields[name](item) in values
+    tags = {tag['Key']: tag['Value'] for tag in item.get('Tags', item.get('TagList', []))}
+    if name == 'tag-key':
+        return any(key in tags for key in values)
+    if name.startswith('tag:'):
+        return tags.get(name[len('tag:'):]) in values
+    return True
+
+
+# one page of a describe call, the token is the offset of the next item
+def page(items, params, key, size_param, token_param):
+    offset = int(params.get(token_param) or 0)
+    size = params.get(size_param) or 1000
+    response = {key: items[offset:offset + size]}
+    if offset + size < len(items):
+        response[token_param] = str(offset + size)
+    return response
@@ -0,0 +1,296 @@
+# purpose: bulk load EBS volume and attached EC2 instance metadata, and RDS instance metadata
+# volumes and instances are described in batches per region instead of one lookup per CSV row, and only when
+# the shared metadata cache does not already hold them
+
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from storage_metrics.clients import get_client
+from storage_metrics.metadata import get_inventory_cache, volume_fingerprint
+
+# optional input column with the account id or role ARN a resource lives in, empty for the default credentials
+ACCOUNT_COLUMN = 'account'
+# tags chosen with --tag_columns are written as tag_<key> columns
+TAG_PREFIX = 'tag_'
+
+# EC2 accepts up to 200 values in a single filter, and describe pages hold up to 500 results, DescribeTags pages 1000
+MAX_FILTER_VALUES = 200
+MAX_RESULTS = 500
+MAX_TAG_RESULTS = 1000
+# DescribeInstanceTypes takes up to 100 instance types per call
+MAX_INSTANCE_TYPES = 100
+# RDS describe pages hold up to 100 results, and a filter takes up to 100 identifiers
+MAX_DB_RESULTS = 100
+
+
+def chunks(values, size):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+# page through a describe call filtered on a list of ids; ids that do not exist are simply
+# absent from the results instead of failing the whole call the way VolumeIds=[...] does
+def describe_by_filter(ec2_client, operation, filter_name, ids, result_key):
+    paginator = ec2_client.get_paginator(operation)
+    for id_chunk in chunks(sorted(set(ids)), MAX_FILTER_VALUES):
+        pages = paginator.paginate(Filters=[{'Name': filter_name, 'Values': id_chunk}], PaginationConfig={'PageSize': MAX_RESULTS})
+        for page in pages:
+            if result_key == 'Reservations':
+                for reservation in page['Reservations']:
+                    yield from reservation['Instances']
+            else:
+                yield from page[result_key]
+
+
+# AWS tag list to a plain dict
+def tag_dict(tags):
+    return {tag['Key']: tag['Value'] for tag in tags or []}
+
+
+def tag_column(key):
+    return TAG_PREFIX + key
+
+
+# tag_<key> columns from the tags column of resource rows, '' where a resource does not have the tag
+def add_tag_columns(df, keys):
+    tags = df['tags'] if 'tags' in df.columns else pd.Series([None] * len(df), index=df.index)
+    return df.assign(**{tag_column(key): [value.get(key, '') if isinstance(value, dict) else '' for value in tags] for key in keys})
+
+
+# account of an input value: None for empty cells, account ids keep their leading zeros
+def account_value(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)) or str(value).strip() == '':
+        return None
+    value = str(value).strip()
+    return value.zfill(12) if value.isdigit() else value
+
+
+# Nitro capability of a DescribeInstanceTypes entry: bare metal types run on Nitro but report no hypervisor,
+# any other type without one is left unknown ('') so its Maximum is still queried
+def nitro_type(info):
+    if info.get('Hypervisor') == 'nitro' or info.get('BareMetal'):
+        return True
+    return False if info.get('Hypervisor') else ''
+
+
+# (account, id) of every row, account '' without an account column, so an id repeated in another account is its own resource
+def resource_keys(df, id_column):
+    accounts = df[ACCOUNT_COLUMN].map(account_value).fillna('') if ACCOUNT_COLUMN in df.columns else pd.Series('', index=df.index)
+    return pd.Series(list(zip(accounts, df[id_column].astype(str))), index=df.index, dtype=object)
+
+
+# (account, region) groups of a resource frame, account None when there is no account column
+def group_locations(df):
+    if ACCOUNT_COLUMN not in df.columns:
+        return [((None, region), group) for region, group in df.groupby('region')]
+    accounts = df[ACCOUNT_COLUMN].map(account_value).fillna('')
+    return [((account or None, region), group) for (account, region), group in df.groupby([accounts, df['region']])]
+
+
+# one row per RDS instance with the columns get_rds writes, the create time the preflight pass clips queries to
+# and tags for --tag_columns; Aurora instances report no storage of their own, their cluster volume is shared
+def db_instance_row(region, instance, account=None):
+    row = {
+        'type': 'rds',
+        'region': region,
+        'instance': instance['DBInstanceIdentifier'],
+        'instance_storage': '' if instance.get('Engine', '').startswith('aurora') else instance.get('AllocatedStorage', ''),
+        'instance_create_time': instance.get('InstanceCreateTime'),
+        'tags': tag_dict(instance.get('TagList'))
+    }
+    if account is not None:
+        row[ACCOUNT_COLUMN] = account
+    return row
+
+
+# DB instances by identifier for every (account, region) of the frame, a paged call per 100 identifiers
+def load_db_instances(instance_df):
+    def load_region(region, identifiers, account):
+        paginator = get_client('rds', region, account).get_paginator('describe_db_instances')
+        found = {}
+        for id_chunk in chunks(sorted(set(identifiers)), MAX_DB_RESULTS):
+            for page in paginator.paginate(Filters=[{'Name': 'db-instance-id', 'Values': id_chunk}], PaginationConfig={'PageSize': MAX_DB_RESULTS}):
+                found.update({instance['DBInstanceIdentifier']: instance for instance in page['DBInstances']})
+        return found
+
+    locations = group_locations(instance_df)
+    instances = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(locations))) as pool:
+        futures = {(account, region): pool.submit(load_region, region, list(group['instance']), account) for (account, region), group in locations}
+        for (account, region), future in futures.items():
+            try:
+                instances.update({(account, region, identifier): instance for identifier, instance in future.result().items()})
+            except Exception as e:
+                print(f'An error occurred describing DB instances in region: {region}')
+                print(e)
+    return instances
+
+
+# in-memory index of volume -> instance -> tags, filled with a handful of calls per region
+class VolumeInventory:
+    def __init__(self):
+        self.volumes = {}
+        self.instances = {}
+        self.regions = {}
+        self.accounts = {}
+        # instance type -> Nitro based, from the hypervisor DescribeInstanceTypes reports
+        self.nitro_types = {}
+        # (account, region) -> {volume id: [start time, state]} of the latest ModifyVolume of each volume
+        self.modifications = {}
+        # (account, region) -> {volume id: [tags]} as DescribeTags lists them now
+        self.current_tags = {}
+
+    # cached volumes are used while their latest ModifyVolume and their current tags are unchanged, the others are described
+    # attaching and detaching change neither: a volume cached without an attachment is always described again, and so
+    # is one whose instance is no longer found or terminated; a volume detached from, or moved between, running
+    # instances keeps its cached attachment until the inventory TTL
+    def load_region(self, region, ebs_ids, account=None):
+        cached = get_inventory_cache().get_entries('volume', account, region, ebs_ids)
+        if cached:
+            modifications = self.load_modifications(region, account)
+            tags = self.load_current_tags(region, account)
+            cached = {ebs_id: volume for ebs_id, (fingerprint, volume) in cached.items()
+                      if tags is not None and volume.get('Attachments') and fingerprint == volume_fingerprint(dict(volume, Tags=tags.get(ebs_id, [])), modifications.get(ebs_id))}
+        self.index_volumes(region, cached.values(), account)
+        missing = [ebs_id for ebs_id in ebs_ids if ebs_id not in cached]
+        if missing:
+            self.add_volumes(region, describe_by_filter(get_client('ec2', region, account), 'describe_volumes', 'volume-id', missing, 'Volumes'), account)
+        self.load_instances(region, ebs_ids, account)
+        detached = [ebs_id for ebs_id in cached if self.instances.get(self.instance_id(ebs_id), {}).get('State', {}).get('Name', 'terminated') == 'terminated']
+        if detached:
+            self.add_volumes(region, describe_by_filter(get_client('ec2', region, account), 'describe_volumes', 'volume-id', detached, 'Volumes'), account)
+            self.load_instances(region, detached, account)
+
+    # latest ModifyVolume of every volume in the region, one paged call; empty when it cannot be listed
+    def load_modifications(self, region, account=None):
+        if (account, region) not in self.modifications:
+            modifications = {}
+            try:
+                paginator = get_client('ec2', region, account).get_paginator('describe_volumes_modifications')
+                for page in paginator.paginate(PaginationConfig={'PageSize': MAX_RESULTS}):
+                    for modification in page['VolumesModifications']:
+                        latest = modifications.get(modification['VolumeId'])
+                        start = modification['StartTime'].isoformat()
+                        if latest is None or start >= latest[0]:
+                            modifications[modification['VolumeId']] = [start, modification['ModificationState']]
+            except Exception as e:
+                print(f'An error occurred listing volume modifications in region: {region}')
+                print(e)
+            self.modifications[(account, region)] = modifications
+        return self.modifications[(account, region)]
+
+    # current tags of every volume in the region, one paged DescribeTags call; None when they cannot be listed,
+    # so cached volumes are described again instead of trusted
+    def load_current_tags(self, region, account=None):
+        if (account, region) not in self.current_tags:
+            tags = {}
+            try:
+                paginator = get_client('ec2', region, account).get_paginator('describe_tags')
+                for page in paginator.paginate(Filters=[{'Name': 'resource-type', 'Values': ['volume']}], PaginationConfig={'PageSize': MAX_TAG_RESULTS}):
+                    for tag in page['Tags']:
+                        tags.setdefault(tag['ResourceId'], []).append({'Key': tag['Key'], 'Value': tag['Value']})
+            except Exception as e:
+                print(f'An error occurred listing volume tags in region: {region}')
+                print(e)
+                tags = None
+            self.current_tags[(account, region)] = tags
+        return self.current_tags[(account, region)]
+
+    def index_volumes(self, region, volumes, account=None):
+        for volume in volumes:
+            self.volumes[volume['VolumeId']] = volume
+            self.regions[volume['VolumeId']] = region
+            self.accounts[volume['VolumeId']] = account
+
+    # index volumes that were just described, e.g. a page of fleet discovery, and cache them
+    # the attached instance of a volume whose tags or modification changed is described again as well
+    def add_volumes(self, region, volumes, account=None):
+        volumes = {volume['VolumeId']: volume for volume in volumes}
+        self.index_volumes(region, volumes.values(), account)
+        modifications = self.modifications.get((account, region), {})
+        fingerprints = {ebs_id: volume_fingerprint(volume, modifications.get(ebs_id)) for ebs_id, volume in volumes.items()}
+        changed = get_inventory_cache().put('volume', account, region, volumes, fingerprints)
+        get_inventory_cache().invalidate('instance', account, region, [self.instance_id(ebs_id) for ebs_id in changed if self.instance_id(ebs_id)])
+
+    # resolve every attached instance of the given volumes in one batched lookup, skipping cached instances
+    def load_instances(self, region, ebs_ids, account=None):
+        instance_ids = [self.instance_id(ebs_id) for ebs_id in ebs_ids if self.instance_id(ebs_id)]
+        instances = get_inventory_cache().get('instance', account, region, instance_ids)
+        missing = [instance_id for instance_id in instance_ids if instance_id not in instances]
+        described = {instance['InstanceId']: instance for instance in describe_by_filter(get_client('ec2', region, account), 'describe_instances', 'instance-id', missing, 'Reservations')}
+        get_inventory_cache().put('instance', account, region, described)
+        instances.update(described)
+        self.instances.update(instances)
+        self.load_instance_types(region, {instance['InstanceType'] for instance in instances.values()}, account)
+
+    # Nitro capability of the instance types not seen yet; left unknown when the lookup fails
+    def load_instance_types(self, region, instance_types, account=None):
+        types = sorted(set(instance_types) - set(self.nitro_types))
+        cached = get_inventory_cache().get('instance_type', None, '', types)
+        self.nitro_types.update(cached)
+        types = [instance_type for instance_type in types if instance_type not in cached]
+        try:
+            for type_chunk in chunks(types, MAX_INSTANCE_TYPES):
+                described = {info['InstanceType']: nitro_type(info) for info in get_client('ec2', region, account).describe_instance_types(InstanceTypes=type_chunk)['InstanceTypes']}
+                get_inventory_cache().put('instance_type', None, '', described)
+                self.nitro_types.update(described)
+        except Exception as e:
+            print(f'An error occurred looking up instance types in region: {region}')
+            print(e)
+
+    # vol_df must have region and ebs_id columns, and optionally account; every account and region is loaded in parallel
+    def load(self, vol_df):
+        locations = group_locations(vol_df)
+        with ThreadPoolExecutor(max_workers=max(1, len(locations))) as pool:
+            futures = {(account, region): pool.submit(self.load_region, region, list(group['ebs_id']), account) for (account, region), group in locations}
+        for (account, region), future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f'An error occurred loading EBS volume info for region: {region}' + (f' in account: {account}' if account else ''))
+                print(e)
+        return self
+
+    def attachment(self, ebs_id):
+        attachments = self.volumes.get(ebs_id, {}).get('Attachments')
+        return attachments[0] if attachments else {}
+
+    def instance_id(self, ebs_id):
+        return self.attachment(ebs_id).get('InstanceId', '')
+
+    def volume_tags(self, ebs_id):
+        return tag_dict(self.volumes.get(ebs_id, {}).get('Tags'))
+
+    def instance_tags(self, instance_id):
+        return tag_dict(self.instances.get(instance_id, {}).get('Tags'))
+
+    # True or False for a known instance type, '' when the volume is unattached or the type is unknown
+    def nitro(self, instance_id):
+        return self.nitro_types.get(self.instances.get(instance_id, {}).get('InstanceType'), '')
+
+    # one row per volume with the columns get_vol_info has always produced, the state, create time and Nitro flag
+    # the preflight pass plans queries with, plus the account for an assumed role
+    # tags are the instance's tags overlaid with the volume's own, for --tag_columns
+    def volume_row(self, ebs_id):
+        volume = self.volumes[ebs_id]
+        instance_id = self.instance_id(ebs_id)
+        row = {
+            'ebs_id': ebs_id,
+            'ebs_name': self.volume_tags(ebs_id).get('Name', ''),
+            'ebs_device': self.attachment(ebs_id).get('Device', ''),
+            'ec2_instance_id': instance_id,
+            'ec2_instance_name': self.instance_tags(instance_id).get('Name', ''),
+            'region': self.regions[ebs_id],
+            'az': volume['AvailabilityZone'],
+            'ebs_type': volume['VolumeType'],
+            'ebs_size': volume['Size'],
+            'ebs_iops': volume.get('Iops', ''),
+            'ebs_throughput': volume.get('Throughput', ''),
+            'ebs_state': volume.get('State', ''),
+            'ebs_create_time': volume.get('CreateTime'),
+            'ec2_instance_type': self.instances.get(instance_id, {}).get('InstanceType', ''),
+            'ec2_nitro': self.nitro(instance_id),
+            'tags': dict(self.instance_tags(instance_id), **self.volume_tags(ebs_id))
+        }
+        if self.accounts.get(ebs_id) is not None:
+            row[ACCOUNT_COLUMN] = self.accounts[ebs_id]
+        return row
@@ -0,0 +1,200 @@
+# purpose: memoized volume, instance and instance type metadata shared by every inventory in a run
+# an in-process LRU answers repeat lookups within a run, an optional SQLite store keeps entries across runs until
+# their TTL; a volume is described again once a ModifyVolume or a change of its tags is seen for it
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+# entries kept in memory, enough for the volumes and instances of a large fleet
+LRU_SIZE = 500000
+TTL_HOURS = 24
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metadata (
+    kind TEXT, account TEXT, region TEXT, id TEXT, fingerprint TEXT, body TEXT, updated_ts INTEGER,
+    PRIMARY KEY (kind, account, region, id)
+) WITHOUT ROWID;
+'''
+
+# SQLite caps the number of parameters of a statement
+MAX_SQL_VARIABLES = 500
+
+
+# describe results to JSON and back, timestamps such as CreateTime round trip as datetimes
+def encode(body):
+    return json.dumps(body, default=lambda value: value.isoformat())
+
+
+def decode(text):
+    def times(item):
+        for key, value in item.items():
+            if key.endswith('Time') and isinstance(value, str):
+                item[key] = datetime.fromisoformat(value)
+        return item
+    return json.loads(text, object_hook=times)
+
+
+# what invalidates a volume: its tags and the state of its latest ModifyVolume
+def volume_fingerprint(volume, modification=None):
+    tags = sorted((tag['Key'], tag['Value']) for tag in volume.get('Tags') or [])
+    return encode({'tags': tags, 'modification': modification})
+
+
+# least recently used entries are dropped once maxsize is reached
+class LRU:
+    def __init__(self, maxsize=LRU_SIZE):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            return self.entries.pop(key, None)
+
+
+class MetadataStore:
+    # ttl_hours evicts entries older than that each time the store is opened, and hides them after
+    def __init__(self, path, ttl_hours=TTL_HOURS):
+        self.ttl = ttl_hours * 3600
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        self.evict(time.time() - self.ttl)
+
+    # {id: (fingerprint, body)} of the ids stored and not expired
+    def get_many(self, kind, account, region, ids):
+        found = {}
+        cutoff = int(time.time() - self.ttl)
+        ids = list(ids)
+        with self.lock:
+            for i in range(0, len(ids), MAX_SQL_VARIABLES):
+                chunk = ids[i:i + MAX_SQL_VARIABLES]
+                rows = self.conn.execute(
+                    f'SELECT id, fingerprint, body FROM metadata WHERE kind = ? AND account = ? AND region = ? AND updated_ts >= ? AND id IN ({",".join("?" * len(chunk))})',
+                    (kind, account or '', region, cutoff, *chunk)).fetchall()
+                found.update({row[0]: (row[1], decode(row[2])) for row in rows})
+        return found
+
+    # items are (id, fingerprint, body)
+    def put_many(self, kind, account, region, items):
+        now = int(time.time())
+        rows = [(kind, account or '', region, resource_id, fingerprint, encode(body), now) for resource_id, fingerprint, body in items]
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def delete(self, kind, account, region, ids):
+        with self.lock, self.conn:
+            self.conn.executemany('DELETE FROM metadata WHERE kind = ? AND account = ? AND region = ? AND id = ?',
+                                  [(kind, account or '', region, resource_id) for resource_id in ids])
+
+    def evict(self, cutoff):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM metadata WHERE updated_ts < ?', (int(cutoff),))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# volumes, instances and instance types by (kind, account, region, id); instance types are the same everywhere
+# and kept under account None and region ''
+# lookups go to the LRU first, then to the store, whose hits are kept in the LRU for the rest of the run
+class InventoryCache:
+    def __init__(self, store=None, maxsize=LRU_SIZE):
+        self.store = store
+        self.lru = LRU(maxsize)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # {id: body} of the ids that are cached
+    def get(self, kind, account, region, ids):
+        return {resource_id: body for resource_id, (fingerprint, body) in self.get_entries(kind, account, region, ids).items()}
+
+    # {id: (fingerprint, body)} of the ids that are cached
+    def get_entries(self, kind, account, region, ids):
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        for resource_id in ids:
+            entry = self.lru.get((kind, account, region, resource_id))
+            if entry is not None:
+                found[resource_id] = entry
+        if self.store is not None and len(found) < len(ids):
+            stored = self.store.get_many(kind, account, region, [resource_id for resource_id in ids if resource_id not in found])
+            for resource_id, entry in stored.items():
+                self.lru.put((kind, account, region, resource_id), entry)
+            found.update(stored)
+        with self.lock:
+            self.hits += len(found)
+            self.misses += len(ids) - len(found)
+        return found
+
+    # fingerprints of the ids that are cached, without counting as lookups
+    def peek(self, kind, account, region, ids):
+        found = {}
+        for resource_id in ids:
+            entry = self.lru.get((kind, account, region, resource_id))
+            if entry is not None:
+                found[resource_id] = entry[0]
+        missing = [resource_id for resource_id in ids if resource_id not in found]
+        if self.store is not None and missing:
+            found.update({resource_id: entry[0] for resource_id, entry in self.store.get_many(kind, account, region, missing).items()})
+        return found
+
+    # bodies is {id: body}, fingerprints optionally {id: fingerprint}
+    # returns the ids that were cached with another fingerprint, e.g. volumes whose tags changed
+    def put(self, kind, account, region, bodies, fingerprints=None):
+        changed = []
+        if fingerprints:
+            changed = [resource_id for resource_id, fingerprint in self.peek(kind, account, region, list(bodies)).items() if fingerprint != fingerprints.get(resource_id)]
+        items = [(resource_id, (fingerprints or {}).get(resource_id), body) for resource_id, body in bodies.items()]
+        for resource_id, fingerprint, body in items:
+            self.lru.put((kind, account, region, resource_id), (fingerprint, body))
+        if self.store is not None and items:
+            self.store.put_many(kind, account, region, items)
+        return changed
+
+    def invalidate(self, kind, account, region, ids):
+        ids = list(ids)
+        for resource_id in ids:
+            self.lru.pop((kind, account, region, resource_id))
+        if self.store is not None and ids:
+            self.store.delete(kind, account, region, ids)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+_inventory_cache = InventoryCache()
+
+
+# the metadata cache of the current run, shared by every inventory and thread
+def get_inventory_cache():
+    return _inventory_cache
+
+
+# keep metadata on disk in path across runs, or only in memory for this run when path is None
+def configure_inventory_cache(path=None, ttl_hours=TTL_HOURS):
+    global _inventory_cache
+    _inventory_cache = InventoryCache(MetadataStore(path, ttl_hours) if path else None)
+    return _inventory_cache
@@ -0,0 +1,71 @@
+# purpose: pick the coarsest period that still answers each statistic, split by CloudWatch retention tiers
+# sums do not depend on the period so they use hourly or daily datapoints, peaks keep the finest
+# period each retention tier still holds
+
+from datetime import timedelta
+from storage_metrics.cloudwatch import floor_time
+
+HOUR = 3600
+DAY = 86400
+
+# CloudWatch keeps 1 minute datapoints for 15 days, 5 minute for 63 days and 1 hour for 455 days
+RETENTION_TIERS = [(15, 60), (63, 300), (455, 3600)]
+
+
+def ceil_time(dt, seconds):
+    floored = floor_time(dt, seconds)
+    return floored if floored == dt else floored + timedelta(seconds=seconds)
+
+
+# one GetMetricData window: stats pulled over [start, end) at period
+class QuerySegment:
+    def __init__(self, start, end, period, stats):
+        self.start = start
+        self.end = end
+        self.period = period
+        self.stats = list(stats)
+
+    def __repr__(self):
+        return f'QuerySegment({self.start:%Y-%m-%d %H:%M} - {self.end:%Y-%m-%d %H:%M}, period={self.period}, stats={self.stats})'
+
+
+# segments covering [start, end) at the finest period each retention tier keeps, never finer than base_period
+# tier boundaries sit on whole hours so both neighbouring periods divide them
+def peak_segments(start, end, base_period, stats, now):
+    segments = []
+    segment_end = end
+    for days, resolution in RETENTION_TIERS:
+        period = max(base_period, resolution)
+        segment_start = max(start, ceil_time(now - timedelta(days=days), HOUR))
+        if segment_start < segment_end:
+            if segments and segments[-1].period == period:
+                segments[-1].start = segment_start
+            else:
+                segments.append(QuerySegment(segment_start, segment_end, period, stats))
+            segment_end = segment_start
+    if segments:
+        segments[-1].start = floor_time(segments[-1].start, segments[-1].period)
+    return segments
+
+
+# one segment for totals: hourly datapoints up to the 63 day 5 minute tier, daily beyond it
+# the window is aligned to whole periods so reruns line up with cached datapoints
+def sum_segment(end, days_back, base_period, stats, now):
+    period = max(base_period, HOUR if days_back <= 63 else DAY)
+    segment_end = floor_time(end, period)
+    segment_start = max(segment_end - timedelta(days=days_back), ceil_time(now - timedelta(days=RETENTION_TIERS[-1][0]), period))
+    return QuerySegment(segment_start, segment_end, period, stats)
+
+
+# query plan for a days_back window ending at end: peak stats split by retention tier, sum stats in one coarse segment
+def plan_segments(end, days_back, base_period, peak_stats, sum_stats, now):
+    oldest = now - timedelta(days=RETENTION_TIERS[-1][0])
+    start = end - timedelta(days=days_back)
+    if start < oldest:
+        print(f'CloudWatch only keeps {RETENTION_TIERS[-1][0]} days of data, the window is clipped to start at {oldest:%Y-%m-%d}')
+    segments = []
+    if peak_stats:
+        segments += peak_segments(max(start, oldest), end, base_period, peak_stats, now)
+    if sum_stats:
+        segments.append(sum_segment(end, days_back, base_period, sum_stats, now))
+    return segments
@@ -0,0 +1,324 @@
+# purpose: the one collection core every resource plugin runs through
+# plan query periods, pack resources into GetMetricData batches, fetch them concurrently per region through
+# the rate limiter and cache, reduce each series as it arrives and stream finished rows to the output
+
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from storage_metrics.ratelimit import configure_rate_limits, parse_tps_args, rate_limiter_stats
+from storage_metrics.shard import merge_shards, run_shards, shard_path, shard_rows
+from storage_metrics.cloudwatch import MetricBatch, plan_batches, cw_pull_metric_batch, cw_pull_metric_batch_cached, cw_pull_metric_series, cw_pull_metric_series_cached
+from storage_metrics.cache import AccountCache, MetricCache
+from storage_metrics.clients import account_id, configure_roles, get_client
+from storage_metrics.engine import CollectionEngine, interleave_regions
+from storage_metrics.aggregate import RATE_PEAK, MetricSummary, add_io_size, build_output, output_columns
+from storage_metrics.writer import StreamingWriter, read_manifest
+from storage_metrics.periods import QuerySegment, plan_segments
+from storage_metrics.preflight import dedupe, drop_without_region, resource_segment
+from storage_metrics.discovery import discover_resources, parse_tag_args
+from storage_metrics.inventory import ACCOUNT_COLUMN, add_tag_columns, group_locations, resource_keys, tag_column
+from storage_metrics.metadata import configure_inventory_cache
+from storage_metrics.telemetry import get_telemetry, location
+from storage_metrics.timeseries import SeriesBuffer, TimeSeriesStore, add_combined_series, epoch_seconds, hourly_profile_frame, percentile_columns, percentile_frame
+
+
+# pull a single metric for one resource over the days_back window, reading through the cache when one is given
+# collect_metrics batches many resources per call instead
+def pull_metric(cw_client, plugin, resource_id, metric_name, stat, period, days_back, cache=None):
+    end = plugin.window_end(datetime.utcnow())
+    segment = QuerySegment(end - timedelta(days=days_back), end, period, [stat])
+    batch = MetricBatch()
+    batch.add(resource_id, plugin.copy(metrics={metric_name: plugin.metrics.get(metric_name)}).build_queries(resource_id, segment))
+    if cache is not None:
+        results = cw_pull_metric_batch_cached(cw_client, batch, segment.start, segment.end, cache, **plugin.fetch_kwargs)
+    else:
+        results = cw_pull_metric_batch(cw_client, batch, segment.start, segment.end, **plugin.fetch_kwargs)
+    return results[(resource_id, metric_name, stat)]
+
+
+# pull every metric for the resources and write one output row per resource
+# resources is a DataFrame or a stream of DataFrames (e.g. pages of fleet discovery) with labels unique across
+# the stream, each needs plugin.id_column, region and the plugin's meta columns, and optionally an account
+def collect_metrics(args, plugin, resources):
+    metric_names = plugin.metric_names(args.metric_math)
+    chunks = [resources] if isinstance(resources, pd.DataFrame) else resources
+    # resources in other accounts are written with their account, as ids and names can repeat across accounts
+    if isinstance(resources, pd.DataFrame) and ACCOUNT_COLUMN in resources.columns or getattr(args, 'accounts', None):
+        meta_columns = plugin.meta_columns + [ACCOUNT_COLUMN]
+    else:
+        meta_columns = plugin.meta_columns
+    # tags chosen with --tag_columns, e.g. an application tag to roll volumes up by
+    tag_keys = [key.strip() for key in getattr(args, 'tag_columns', None).split(',')] if getattr(args, 'tag_columns', None) else []
+    meta_columns = meta_columns + [tag_column(key) for key in tag_keys]
+
+    # days back period to poll cloudwatch
+    days_back = args.days_back
+    month_span = days_back/30
+
+    # Maximum keeps the finest period retention allows, Sum is pulled hourly or daily over the same window
+    # rates need fine datapoints for their peaks, so --metric_math plans every query like Maximum
+    # segments are aligned to their periods so daily reruns line up with what is already cached
+    now = datetime.utcnow()
+    end = plugin.window_end(now)
+    # --timeseries keeps the series, so Sum is pulled at the same fine periods as Maximum
+    timeseries = getattr(args, 'timeseries', None)
+    if args.metric_math:
+        segments = plan_segments(end, days_back, plugin.period, ['Rate'], [], now)
+    elif timeseries:
+        segments = plan_segments(end, days_back, plugin.period, ['Maximum', 'Sum'], [], now)
+    else:
+        segments = plan_segments(end, days_back, plugin.period, ['Maximum'], ['Sum'], now)
+    print(f'Query plan: {segments}')
+    cache = None if args.no_cache else MetricCache(args.cache_file, args.cache_ttl_days)
+
+    # percentiles and hourly profiles of the per-second rate of every metric and of the read+write totals
+    combined = plugin.combined_metrics()
+    percentile_names = list(plugin.metrics) + list(combined)
+    store = TimeSeriesStore(timeseries) if timeseries else None
+    buffer = SeriesBuffer()
+    telemetry = get_telemetry()
+    quiet = getattr(args, 'quiet', False)
+    preflight = not getattr(args, 'no_preflight', False)
+    failed = set()
+
+    # consumed lazily by the engine: each chunk is grouped per (account, region) and its resources packed into
+    # batched GetMetricData calls per segment, batches carry their chunk for the output metadata
+    # the preflight pass drops duplicate ids and plans each resource only for the segments, statistics and time
+    # range it can return data for; resources sorted by their start share batches with a shorter window
+    def jobs():
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            if ACCOUNT_COLUMN in meta_columns and ACCOUNT_COLUMN not in chunk.columns:
+                chunk = chunk.assign(**{ACCOUNT_COLUMN: None})
+            if tag_keys:
+                chunk = add_tag_columns(chunk, tag_keys)
+            if preflight:
+                chunk = dedupe(chunk, plugin)
+            # a single frame is the whole input, so the total and the ETA are known from its first batch on
+            # while a stream of pages (e.g. discovery) only has its total once the stream is exhausted
+            telemetry.add_total(len(chunk), final=isinstance(resources, pd.DataFrame))
+            planned = dict.fromkeys(chunk.index, 0)
+            batches_by_location = {}
+            for key, location_resources in group_locations(chunk):
+                rows = list(location_resources.itertuples())
+                row_segments = {row.Index: [resource_segment(plugin, row, segment) if preflight else segment for segment in segments] for row in rows}
+                rows.sort(key=lambda row: min((planned_segment.start for planned_segment in row_segments[row.Index] if planned_segment is not None), default=end))
+                rank = {row.Index: i for i, row in enumerate(rows)}
+                location_batches = []
+                for j, segment in enumerate(segments):
+                    resource_segments = [(row, row_segments[row.Index][j]) for row in rows]
+                    resource_segments = sorted([item for item in resource_segments if item[1] is not None], key=lambda item: item[1].start)
+                    for row, planned_segment in resource_segments:
+                        planned[row.Index] += 1
+                    resource_queries = [(row, plugin.build_queries(getattr(row, plugin.id_column), planned_segment, args.metric_math)) for row, planned_segment in resource_segments]
+                    starts = [planned_segment.start for row, planned_segment in resource_segments]
+                    location_batches += [(key, (QuerySegment(batch.start, segment.end, segment.period, segment.stats), batch, chunk))
+                                         for batch in plan_batches(resource_queries, segment.start, segment.end, starts=starts)]
+                # every segment's batches are packed as full as before, then queued by the first resource they hold:
+                # a coarse batch (e.g. hourly Sum for many resources) goes out with the first fine batch of its
+                # resources, and each fine batch that follows completes its resources, so rows are written steadily
+                # through the run instead of all at once after the location's whole first segment
+                location_batches.sort(key=lambda item: min(rank[row.Index] for row in item[1][1].resources))
+                batches_by_location[key] = location_batches
+            summary.extend(chunk.index, expected=list(planned.values()))
+            skipped = [label for label, count in planned.items() if not count]
+            if skipped:
+                write_skipped(chunk, skipped)
+            yield from interleave_regions(batches_by_location)
+        telemetry.finish_total()
+
+    # runs on the worker threads of each (account, region), one cached CloudWatch client and API quota for each
+    def fetch(key, job):
+        account, region = key
+        scope = None if account is None else account_id(account)
+        with telemetry.stage('fetch', location(region, scope)):
+            return fetch_batch(get_client('cloudwatch', region, account), cache if scope is None or cache is None else AccountCache(cache, scope), job)
+
+    def fetch_batch(cw_client, cache, job):
+        segment, batch, chunk = job
+        if store is not None and cache is not None:
+            return cw_pull_metric_series_cached(cw_client, batch, segment.start, segment.end, cache, **plugin.fetch_kwargs)
+        if store is not None:
+            return cw_pull_metric_series(cw_client, batch, segment.start, segment.end, **plugin.fetch_kwargs)
+        if cache is not None:
+            return cw_pull_metric_batch_cached(cw_client, batch, segment.start, segment.end, cache, **plugin.fetch_kwargs)
+        return cw_pull_metric_batch(cw_client, batch, segment.start, segment.end, **plugin.fetch_kwargs)
+
+    # runs on the main thread only, so the summary has a single writer
+    # each series is reduced to its peak or total straight away, nothing per row is kept
+    def write(key, job, results):
+        with telemetry.stage('aggregate'):
+            output, finished = aggregate(key, job, results)
+        if output is None:
+            return
+        with telemetry.stage('write'):
+            writer.write(output)
+        telemetry.advance(len(finished))
+        if not quiet:
+            print(f'Query result: {list(job[2].loc[finished, plugin.id_column])} {telemetry.progress_text()}')
+
+    def aggregate(key, job, results):
+        account, region = key
+        segment, batch, chunk = job
+        labels = {}
+        for row in batch.resources:
+            labels.setdefault(getattr(row, plugin.id_column), []).append(row.Index)
+        for (resource_id, metric_name, stat), values in results.items():
+            if store is not None:
+                timestamps, values = values
+                timestamps = epoch_seconds(timestamps)
+                store.add(region, account, resource_id, metric_name, stat, segment.period, timestamps, values)
+                if stat in ['Sum', 'Rate']:
+                    rates = np.asarray(values, dtype=float) if stat == 'Rate' else plugin.sum_to_rate(np.asarray(values, dtype=float), segment.period)
+                    for label in labels[resource_id]:
+                        buffer.add(label, metric_name, timestamps, rates)
+            for label in labels[resource_id]:
+                summary.add(label, metric_name, stat, values, period=segment.period)
+        # a resource is written once every segment it was planned in has come back for it
+        finished = summary.finish([row.Index for row in batch.resources])
+        if not finished:
+            return None, finished
+        return finished_output(chunk, finished), finished
+
+    # peaks, monthly sums and average IO size for the finished resources in one vectorized pass
+    def finished_output(chunk, finished):
+        summary_df = add_io_size(summary.to_frame(month_span, labels=finished), plugin.ops_columns, plugin.bytes_columns, plugin.ops_total, plugin.bytes_total)
+        if store is not None:
+            # the finished resources' series leave the buffer here, percentiles for all of them in one pass
+            series_by_label = add_combined_series(buffer.pop(summary_df.index), combined)
+            summary_df = summary_df.join(percentile_frame(series_by_label, percentile_names))
+            store.write_profiles(hourly_profile_frame(series_by_label, percentile_names, resource_keys(chunk, plugin.id_column), chunk['region']))
+        return build_output(summary_df, chunk, meta_columns)
+
+    # resources the preflight pass left without any query are written straight away, as rows without data
+    # called from jobs, which the engine consumes on the main thread, so the writer still has a single caller
+    def write_skipped(chunk, labels):
+        with telemetry.stage('aggregate'):
+            output = finished_output(chunk, summary.skip(labels))
+        with telemetry.stage('write'):
+            writer.write(output)
+        telemetry.advance(len(labels))
+        if not quiet:
+            print(f'No data expected for {plugin.noun}: {list(chunk.loc[labels, plugin.id_column])} {telemetry.progress_text()}')
+
+    # a resource that lost any of its batches is never written, it counts as failed once
+    def write_error(key, job, error):
+        segment, batch, chunk = job
+        print(f'An error occurred during making call for {plugin.name.upper()} ids: {[getattr(row, plugin.id_column) for row in batch.resources]}')
+        print(error)
+        lost = {row.Index for row in batch.resources} - failed
+        failed.update(lost)
+        telemetry.advance(len(lost), failed=True)
+
+    # rate peaks are period averages and get their own columns, so they are never mistaken for Maximum/60
+    peak_name = RATE_PEAK if args.metric_math else 'Maximum'
+    summary = MetricSummary([], metric_names, expected=len(segments), peak_name=peak_name)
+    # rows are appended as batches finish; resources already in the manifest were skipped by run
+    extra_columns = percentile_columns(percentile_names) if store is not None else []
+    writer = StreamingWriter(args.output_file, output_columns(meta_columns, metric_names, plugin.ops_total, plugin.bytes_total, extra_columns, peak_name), plugin.id_column, args.output_format, args.resume)
+
+    # accounts and regions run in parallel, so the run takes about as long as the slowest of them
+    engine = CollectionEngine(max_workers_per_region=args.workers)
+    try:
+        engine.run(jobs(), fetch, write, write_error)
+    finally:
+        with telemetry.stage('write'):
+            writer.close()
+            if store is not None:
+                store.close()
+    if quiet:
+        telemetry.show_progress(force=True)
+    print(f'Wrote {writer.rows_written} rows to {args.output_file}')
+    if store is not None:
+        print(f'Wrote {store.datapoints} datapoints in {store.files} files to {timeseries}')
+
+
+# pages of resources from --discover, filtered as the command line asks
+def discover(args, plugin):
+    regions = args.regions.split(',') if args.regions else None
+    accounts = args.accounts.split(',') if getattr(args, 'accounts', None) else None
+    return discover_resources(plugin, regions, parse_tag_args(args.tag), args.type, args.state, accounts=accounts)
+
+
+# whether this invocation reads the input file: not with --discover, --merge_shards only merges parts, and the
+# --processes driver leaves the input to its shards
+def reads_input(args):
+    if getattr(args, 'discover', False) or getattr(args, 'merge_shards', None):
+        return False
+    return not (getattr(args, 'processes', None) and getattr(args, 'shard', None) is None)
+
+
+# the whole run for one plugin: rate limits, --resume, an optional prepare step that looks up resource
+# metadata (e.g. get_vol_info), then collection with collect(args, resources) or collect_metrics
+# with --discover the resources come from the AWS APIs instead of resources_df and stream straight into collection
+# resources in other accounts are reached through an assumed role, from an account input column or --accounts
+# a JSON summary of the run's stages and per-region API counters is written next to the output at the end
+# --shard i/N collects only that shard into its own output part, --processes N runs every shard locally and
+# merges the parts, --merge_shards N only merges parts collected elsewhere
+def run(args, plugin, resources_df, prepare=None, collect=None):
+    if getattr(args, 'merge_shards', None):
+        merge_shards(args.output_file, args.merge_shards, args.output_format, getattr(args, 'summary_file', None))
+        return
+    shard = getattr(args, 'shard', None)
+    driver = getattr(args, 'processes', None) and shard is None
+    if shard is not None:
+        args.output_file = shard_path(args.output_file, shard)
+        if getattr(args, 'summary_file', None):
+            args.summary_file = shard_path(args.summary_file, shard)
+    # the shards of a run share every account and region quota
+    configure_rate_limits(parse_tps_args(args.tps), share=1 / shard[1] if shard else 1.0)
+    configure_roles(getattr(args, 'role_name', None), getattr(args, 'external_id', None))
+    # volume and instance metadata is kept across runs unless --no_cache, and in memory for this run either way
+    inventory_cache = configure_inventory_cache(None if args.no_cache else getattr(args, 'inventory_cache_file', None), getattr(args, 'inventory_ttl_hours', 24))
+    telemetry = get_telemetry()
+    telemetry.reset(plugin.noun, getattr(args, 'quiet', False))
+    if driver:
+        # the driver discovers the fleet once, with the full Describe* quotas, and hands every shard its part
+        # rather than each shard paging the whole fleet on 1/N of them
+        if getattr(args, 'discover', False):
+            with telemetry.stage('inventory'):
+                chunks = [chunk for chunk in discover(args, plugin) if not chunk.empty]
+            discovered = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=[plugin.id_column])
+            print(f'Discovered {len(discovered)} {plugin.noun} for {args.processes} shards')
+            run_shards(args, args.processes, discovered, plugin.id_column, telemetry.summary())
+        else:
+            run_shards(args, args.processes)
+        return
+    done = read_manifest(args.output_file) if args.resume else set()
+
+    if getattr(args, 'discover', False):
+        # discovered rows already carry their metadata, so there is nothing to prepare
+        if getattr(args, 'discovered', None):
+            # this shard's part of what the --processes driver discovered
+            chunks = [pd.read_pickle(args.discovered)]
+        else:
+            chunks = discover(args, plugin)
+            if shard is not None:
+                chunks = (shard_rows(chunk, plugin.id_column, shard) for chunk in chunks)
+        resources = (chunk[~resource_keys(chunk, plugin.id_column).isin(done)] for chunk in telemetry.timed('inventory', chunks))
+    else:
+        resources_df = drop_without_region(resources_df, plugin)
+        if shard is not None:
+            resources_df = shard_rows(resources_df, plugin.id_column, shard)
+            print(f'Shard {shard[0]}/{shard[1]}: {len(resources_df)} {plugin.noun}')
+        # skip resources an interrupted run already wrote out
+        resources = resources_df[~resource_keys(resources_df, plugin.id_column).isin(done)]
+        # an empty shard still writes its (empty) part, so the merge finds every part
+        if resources.empty and shard is None:
+            print(f'No {plugin.noun} left to collect, {args.output_file} is complete')
+            return
+        if prepare is not None:
+            with telemetry.stage('inventory'):
+                resources = prepare(args, resources)
+    if collect is not None:
+        collect(args, resources)
+    else:
+        collect_metrics(args, plugin, resources)
+    if not getattr(args, 'quiet', False):
+        print(f'API rate limiting: {rate_limiter_stats()}')
+    print(f'Inventory cache: {inventory_cache.stats()}')
+    summary_file = getattr(args, 'summary_file', None) or f'{args.output_file}.summary.json'
+    summary = telemetry.write_summary(summary_file)
+    print(f'Stage seconds: {summary["stages"]}, slowest region: {summary["slowest_region"]}, API totals: {summary["totals"]}')
+    print(f'Wrote run summary to {summary_file}')
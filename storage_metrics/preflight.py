@@ -0,0 +1,64 @@
+# purpose: trim the query plan before collection with what the inventory already knows about each resource
+# duplicate ids are collected once, statistics CloudWatch does not keep for a resource are left out, and queries
+# start no earlier than the resource was created
+
+import numpy as np
+import pandas as pd
+from storage_metrics.cloudwatch import floor_time
+from storage_metrics.inventory import ACCOUNT_COLUMN
+from storage_metrics.periods import QuerySegment
+
+
+# a datetime column value as a naive UTC datetime, None when unknown
+def naive_utc(value):
+    if value is None or value == '' or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    value = pd.Timestamp(value)
+    if value.tzinfo is not None:
+        value = value.tz_convert('UTC').tz_localize(None)
+    return value.to_pydatetime()
+
+
+# empty cells and NaN count as not set
+def is_set(value):
+    return not (value is None or value == '' or (not isinstance(value, str) and pd.isna(value)))
+
+
+# only an explicit False, an unknown value keeps the statistic
+def is_false(value):
+    return isinstance(value, (bool, np.bool_)) and not value
+
+
+# rows without a region can be neither looked up nor queried, they are reported and left out of the output
+def drop_without_region(df, plugin):
+    missing = ~df['region'].map(lambda value: is_set(value) and str(value).strip() != '').astype(bool)
+    if missing.any():
+        print(f'Skipping {missing.sum()} {plugin.noun} without a region: {list(df.loc[missing, plugin.id_column])}')
+    return df.loc[~missing]
+
+
+# one row per resource: later duplicates of an id in the same account and region are dropped
+def dedupe(df, plugin):
+    keys = [column for column in [ACCOUNT_COLUMN, 'region', plugin.id_column] if column in df.columns]
+    duplicated = df.duplicated(subset=keys)
+    if duplicated.any():
+        print(f'Skipping {duplicated.sum()} duplicate {plugin.noun}: {sorted(set(df.loc[duplicated, plugin.id_column]))}')
+    return df[~duplicated]
+
+
+# the part of a segment one resource can return data for, None when it cannot return any
+# a resource whose peak column is False has no Maximum (e.g. EBS volumes of instances that are not Nitro based),
+# one without an attachment now is still queried for its Sum, as it may have been detached within the window with data
+# from before, but its Maximum is left out to save queries; none has data from before it was created
+def resource_segment(plugin, row, segment):
+    stats = segment.stats
+    unattached = plugin.attached_column and hasattr(row, plugin.attached_column) and not is_set(getattr(row, plugin.attached_column))
+    if unattached or plugin.peak_column and hasattr(row, plugin.peak_column) and is_false(getattr(row, plugin.peak_column)):
+        stats = [stat for stat in stats if stat != 'Maximum']
+    created = naive_utc(getattr(row, plugin.created_column, None)) if plugin.created_column else None
+    start = segment.start if created is None else max(segment.start, floor_time(created, segment.period))
+    if not stats or start >= segment.end:
+        return None
+    if start == segment.start and stats == segment.stats:
+        return segment
+    return QuerySegment(start, segment.end, segment.period, stats)
@@ -0,0 +1,148 @@
+# purpose: token bucket rate limiting per region and API, shared by every boto3 client the scripts create
+# buckets start at the documented default quotas and back off (AIMD) when botocore reports throttling
+
+import threading
+import time
+
+# starting transactions per second per API, from the documented default quotas
+# CloudWatch GetMetricData is 50 TPS, EC2 non-mutating Describe* calls refill at 20 TPS,
+# RDS does not publish a per-API quota so its describe calls start conservatively
+DEFAULT_TPS = {
+    'GetMetricData': 50,
+    'DescribeVolumes': 20,
+    'DescribeInstances': 20,
+    'DescribeTags': 20,
+    'DescribeRegions': 20,
+    'DescribeDBInstances': 10
+}
+FALLBACK_TPS = 10
+
+# error codes botocore surfaces when a call was throttled
+THROTTLE_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'TooManyRequestsException'
+}
+
+
+# token bucket with additive increase / multiplicative decrease of its refill rate
+class TokenBucket:
+    def __init__(self, tps, min_tps=0.5, decrease=0.5, increase=1.0):
+        self.max_tps = float(tps)
+        self.tps = float(tps)
+        self.min_tps = min_tps
+        self.decrease = decrease
+        self.increase = increase
+        self.capacity = max(1.0, self.tps)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        # counters
+        self.calls = 0
+        self.throttles = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.tps)
+        self.updated = now
+
+    # take a token, sleeping until one is available; tokens can go negative to reserve a slot in line
+    def acquire(self):
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            self.calls += 1
+            wait = -self.tokens / self.tps if self.tokens < 0 else 0
+            self.wait_seconds += wait
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    # multiplicative decrease on throttling
+    def on_throttle(self):
+        with self.lock:
+            self.throttles += 1
+            self.tps = max(self.min_tps, self.tps * self.decrease)
+
+    # additive increase on success, roughly `increase` TPS per second of successful calls
+    def on_success(self):
+        with self.lock:
+            if self.tps < self.max_tps:
+                self.tps = min(self.max_tps, self.tps + self.increase / self.tps)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'tps': round(self.tps, 2),
+                'max_tps': self.max_tps,
+                'calls': self.calls,
+                'throttles': self.throttles,
+                'wait_seconds': round(self.wait_seconds, 2)
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_tps_overrides = {}
+# share of every quota this process may use, e.g. 1/N for one of N shards calling the same accounts and regions
+_share = {'share': 1.0}
+
+
+# override starting TPS per API, e.g. {'GetMetricData': 25}; applies to buckets created afterwards
+def configure_rate_limits(tps_overrides, share=1.0):
+    _tps_overrides.update(tps_overrides)
+    _share['share'] = share
+
+
+# parse repeated --tps API=N command-line values
+def parse_tps_args(values):
+    tps_overrides = {}
+    for value in values or []:
+        api, tps = value.split('=', 1)
+        tps_overrides[api.strip()] = float(tps)
+    return tps_overrides
+
+
+# one shared bucket per (account, region, API) across all clients and threads, account None is the default credentials
+def get_rate_limiter(region, api, account=None):
+    with _limiters_lock:
+        key = (account, region, api)
+        if key not in _limiters:
+            _limiters[key] = TokenBucket(_tps_overrides.get(api, DEFAULT_TPS.get(api, FALLBACK_TPS)) * _share['share'])
+        return _limiters[key]
+
+
+# counters for every bucket created so far
+def rate_limiter_stats():
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return [dict(**({'account': account} if account is not None else {}), region=region, api=api, **limiter.stats())
+            for (account, region, api), limiter in sorted(limiters.items(), key=lambda item: (item[0][0] or '',) + item[0][1:])]
+
+
+# hook a boto3 client into the shared buckets for its account and region
+# every HTTP attempt (including botocore retries) takes a token, throttled attempts shrink the rate
+def attach_rate_limiter(client, region=None, account=None):
+    region = region or client.meta.region_name
+    service = client.meta.service_model.service_id.hyphenize()
+
+    def before_send(event_name, **kwargs):
+        get_rate_limiter(region, event_name.split('.')[-1], account).acquire()
+
+    def needs_retry(event_name, response=None, **kwargs):
+        if response is not None and response[1].get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+            get_rate_limiter(region, event_name.split('.')[-1], account).on_throttle()
+
+    def after_call(event_name, http_response, **kwargs):
+        if http_response.status_code < 300:
+            get_rate_limiter(region, event_name.split('.')[-1], account).on_success()
+
+    client.meta.events.register(f'before-send.{service}', before_send)
+    client.meta.events.register(f'needs-retry.{service}', needs_retry)
+    client.meta.events.register(f'after-call.{service}', after_call)
+    return client
@@ -0,0 +1,137 @@
+# purpose: resource plugins, everything the collection pipeline needs to know about one kind of resource
+# a plugin only declares its CloudWatch namespace, dimension, metrics and output columns; batching, rate limiting,
+# concurrency, caching and output are shared in storage_metrics.pipeline
+
+import copy
+from datetime import timedelta
+from storage_metrics.cloudwatch import build_metric_queries, build_metric_math_queries, floor_time
+
+
+class ResourcePlugin:
+    # metrics maps metric name to unit, None when the metric is not filtered by unit
+    # ops_columns/bytes_columns are the Sum columns added up into ops_total/bytes_total for IoSize
+    # totals maps a combined metric to the metrics it adds up under --metric_math, None when the plugin has no metric math
+    # window_lag delays the end of the window on whole hours, for namespaces whose recent datapoints still move
+    # rate_sample_period is set for metrics that are already per-second rates sampled that often, e.g. RDS every 60 seconds,
+    # otherwise a Sum datapoint is a count over its period
+    # size_column is the provisioned GiB in the output, None when the resource has none
+    # preflight columns, each optional and only used when the resources carry it: created_column holds the creation
+    # time queries are clipped to, an empty attached_column means the resource is not attached now and only its
+    # Sum is queried, and a peak_column of False means CloudWatch has no Maximum for it
+    def __init__(self, name, namespace, dimension_name, id_column, metrics, meta_columns, ops_columns, bytes_columns,
+                 ops_total, bytes_total, totals=None, period=300, window_lag=None, fetch_kwargs=None, noun='resources',
+                 rate_sample_period=None, size_column=None, created_column=None, attached_column=None, peak_column=None):
+        self.name = name
+        self.namespace = namespace
+        self.dimension_name = dimension_name
+        self.id_column = id_column
+        self.metrics = dict(metrics)
+        self.meta_columns = list(meta_columns)
+        self.ops_columns = list(ops_columns)
+        self.bytes_columns = list(bytes_columns)
+        self.ops_total = ops_total
+        self.bytes_total = bytes_total
+        self.totals = totals
+        self.period = period
+        self.window_lag = window_lag
+        self.fetch_kwargs = dict(fetch_kwargs or {})
+        self.noun = noun
+        self.rate_sample_period = rate_sample_period
+        self.size_column = size_column
+        self.created_column = created_column
+        self.attached_column = attached_column
+        self.peak_column = peak_column
+
+    # the same plugin with some settings replaced, e.g. other input columns for the same resource
+    def copy(self, **changes):
+        plugin = copy.copy(self)
+        plugin.__dict__.update(changes)
+        return plugin
+
+    # metrics summarised per resource; metric math adds the combined totals
+    def metric_names(self, metric_math=False):
+        return list(self.metrics) + (list(self.totals) if metric_math else [])
+
+    # combined series added up from the metrics, e.g. VolumeOps from read and write ops, named after the IoSize totals
+    def combined_metrics(self):
+        return {
+            self.ops_total[:-len('Sum')]: [column[:-len('Sum')] for column in self.ops_columns],
+            self.bytes_total[:-len('Sum')]: [column[:-len('Sum')] for column in self.bytes_columns]
+        }
+
+    # operations or bytes represented by a Sum column, RDS sums add up one per-second rate per sample
+    def sum_to_total(self, values):
+        return values * (self.rate_sample_period or 1)
+
+    # per-second rate of each Sum datapoint over period seconds
+    def sum_to_rate(self, values, period):
+        return values / (period / self.rate_sample_period if self.rate_sample_period else period)
+
+    # end of the collection window, on a whole period or, with a lag, on a whole hour that far back
+    def window_end(self, now):
+        if self.window_lag is not None:
+            return now.replace(microsecond=0, second=0, minute=0) - self.window_lag
+        return floor_time(now, self.period)
+
+    # queries for one resource and one query segment
+    def build_queries(self, resource_id, segment, metric_math=False):
+        if metric_math:
+            return build_metric_math_queries(resource_id, self.namespace, self.dimension_name, self.metrics, segment.period, self.totals)
+        return build_metric_queries(resource_id, self.namespace, self.dimension_name, self.metrics, segment.stats, segment.period)
+
+
+# maximum statistic is only supported on Nitro-based instances
+EBS = ResourcePlugin(
+    name='ebs',
+    namespace='AWS/EBS',
+    dimension_name='VolumeId',
+    id_column='ebs_id',
+    metrics={
+        'VolumeReadOps': 'Count',
+        'VolumeWriteOps': 'Count',
+        'VolumeReadBytes': 'Bytes',
+        'VolumeWriteBytes': 'Bytes'
+    },
+    # can decide to remove any column but at least keep region and the resource id
+    meta_columns=['ec2_instance_id', 'ec2_instance_name', 'ebs_type', 'ebs_name', 'ebs_id', 'ebs_device', 'region', 'ebs_size', 'ebs_throughput', 'ebs_iops'],
+    ops_columns=['VolumeReadOpsSum', 'VolumeWriteOpsSum'],
+    bytes_columns=['VolumeReadBytesSum', 'VolumeWriteBytesSum'],
+    ops_total='VolumeOpsSum',
+    bytes_total='VolumeBytesSum',
+    # with --metric_math CloudWatch returns per-second rates (m/PERIOD(m)) instead of Maximum and Sum series,
+    # plus the coincident read+write rates; their peaks are period averages, reported as e.g. VolumeOpsRateMaximum
+    totals={
+        'VolumeOps': ['VolumeReadOps', 'VolumeWriteOps'],
+        'VolumeBytes': ['VolumeReadBytes', 'VolumeWriteBytes']
+    },
+    noun='volumes',
+    size_column='ebs_size',
+    # volumes only publish metrics while attached, so a detached volume only has data from before it was detached
+    # get_vol_info and discovery add the create time, the attachment and the Nitro flag
+    created_column='ebs_create_time',
+    attached_column='ec2_instance_id',
+    peak_column='ec2_nitro'
+)
+
+# metrics are not filtered by unit, RDS publishes them per second
+# the window ends an hour back on a whole hour so the data has settled
+RDS = ResourcePlugin(
+    name='rds',
+    namespace='AWS/RDS',
+    dimension_name='DBInstanceIdentifier',
+    id_column='instance',
+    metrics=dict.fromkeys(['ReadIOPS', 'WriteIOPS', 'WriteThroughput', 'ReadThroughput']),
+    meta_columns=['type', 'region', 'instance', 'instance_storage'],
+    ops_columns=['ReadIOPSSum', 'WriteIOPSSum'],
+    bytes_columns=['WriteThroughputSum', 'ReadThroughputSum'],
+    ops_total='VolumeIOPSSum',
+    bytes_total='VolumeBytesSum',
+    window_lag=timedelta(hours=1),
+    fetch_kwargs={'ScanBy': 'TimestampDescending'},
+    noun='instances',
+    rate_sample_period=60,
+    size_column='instance_storage',
+    created_column='instance_create_time'
+)
+
+PLUGINS = {plugin.name: plugin for plugin in [EBS, RDS]}
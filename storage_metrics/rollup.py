@@ -0,0 +1,177 @@
+# purpose: roll collected per-resource series up per group, e.g. every volume of an EC2 instance or of an application tag
+# a group's per-second rates are added up on matching timestamps before the peak is taken, so its peak is the coincident
+# peak of its resources rather than the sum of their separate peaks; groups are rolled up a chunk of whole groups at a time,
+# reading only that chunk's series from the --timeseries history, so memory is bounded by the chunk and not the fleet
+
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from storage_metrics.aggregate import masked_divide
+from storage_metrics.inventory import resource_keys
+from storage_metrics.timeseries import EPOCH
+
+# resources whose series are read and rolled up together, a group with more resources is rolled up on its own
+CHUNK_RESOURCES = 2000
+# per-second rates come from Sum series, or from Rate series under --metric_math
+RATE_STATS = ['Sum', 'Rate']
+SERIES_COLUMNS = ['account', 'resource_id', 'metric', 'stat', 'period', 'ts', 'value']
+
+
+# the datapoints history written by --timeseries, partitioned by region and date
+def open_history(root):
+    try:
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise ImportError('rolling up series requires pyarrow: pip install pyarrow')
+    path = os.path.join(root, 'datapoints')
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f'no time series in {root}, collect with --timeseries {root} first')
+    return ds, ds.dataset(path, format='parquet', partitioning='hive')
+
+
+# one period per time range of each series: a datapoint pulled again at the same period by a later run replaces the
+# earlier one, and a coarser datapoint whose period holds finer ones of the same series is dropped, e.g. the hourly
+# point a later run stored for a day an earlier run had stored at 5 minutes, so no time range is counted twice
+def finest_series(df):
+    df = df.drop_duplicates(['account', 'resource_id', 'metric', 'period', 'ts'], keep='last')
+    periods = df['period'].to_numpy()
+    ts = df['ts'].to_numpy(dtype=np.int64)
+    keep = np.ones(len(df), dtype=bool)
+    for period in np.unique(periods)[1:]:
+        finer, coarse = periods < period, periods == period
+        covered = pd.MultiIndex.from_arrays([df['account'].to_numpy()[finer], df['resource_id'].to_numpy()[finer], df['metric'].to_numpy()[finer], ts[finer] // period * period])
+        points = pd.MultiIndex.from_arrays([df['account'].to_numpy()[coarse], df['resource_id'].to_numpy()[coarse], df['metric'].to_numpy()[coarse], ts[coarse]])
+        keep[np.flatnonzero(coarse)[points.isin(covered)]] = False
+    return df[keep]
+
+
+# rate datapoints of the resources, (account, id) keys, since start_ts, one period per time range of each series
+# the filter reads every listed id in every listed account, the caller drops other pairs
+def read_series(history, keys, regions, metric_names, start_ts):
+    ds, dataset = history
+    accounts = {account for account, resource_id in keys}
+    resource_ids = {resource_id for account, resource_id in keys}
+    condition = (ds.field('region').isin(list(regions)) & ds.field('account').isin(list(accounts)) & ds.field('resource_id').isin(list(resource_ids)) &
+                 ds.field('metric').isin(list(metric_names)) & ds.field('stat').isin(RATE_STATS) & (ds.field('ts') >= start_ts))
+    df = dataset.to_table(columns=SERIES_COLUMNS, filter=condition).to_pandas()
+    for column in ['account', 'resource_id', 'metric']:
+        df[column] = df[column].astype(str)
+    return finest_series(df)
+
+
+# resources with a value in every group column, each with its group number, the group keys by number, and the number
+# of rows left out for a missing group value and as repeats of an (account, id) already seen
+def resource_groups(resources_df, id_column, group_columns):
+    missing = [column for column in group_columns if column not in resources_df.columns]
+    if missing:
+        raise ValueError(f'the collected output has no columns: {missing}, tags need --tag_columns when collecting')
+    keys = resources_df[group_columns].fillna('').astype(str)
+    has_group = (keys != '').all(axis=1)
+    duplicated = resource_keys(resources_df, id_column).duplicated()
+    grouped = has_group & ~duplicated
+    codes, uniques = pd.MultiIndex.from_frame(keys[grouped]).factorize()
+    resources = resources_df[grouped].assign(group=codes)
+    return resources, pd.DataFrame(list(uniques), columns=group_columns), int((~has_group).sum()), int((has_group & duplicated).sum())
+
+
+# lists of group numbers of at most size resources each, whole groups only, groups of a region kept together
+# so each chunk reads the partitions of as few regions as possible
+def group_chunks(resources, size=CHUNK_RESOURCES):
+    counts = resources.groupby('group').size()
+    regions = resources.groupby('group')['region'].min()
+    chunk, resource_count = [], 0
+    for group in regions.sort_values(kind='stable').index:
+        if chunk and resource_count + counts[group] > size:
+            yield chunk
+            chunk, resource_count = [], 0
+        chunk.append(group)
+        resource_count += counts[group]
+    if chunk:
+        yield chunk
+
+
+# the largest sum of rates on any one timestamp for each of n rows, and its timestamp index; NaN and -1 without data
+# (row, timestamp) slots are added up with one bincount, the slots sorted by row then sum give each row's peak last
+def coincident_peaks(rows, times, rates, n):
+    peaks = np.full(n, np.nan)
+    peak_times = np.full(n, -1, dtype=np.int64)
+    if not len(rows):
+        return peaks, peak_times
+    width = int(times.max()) + 1
+    slots, inverse = np.unique(rows.astype(np.int64) * width + times, return_inverse=True)
+    sums = np.bincount(inverse.ravel(), weights=rates)
+    slot_rows = slots // width
+    order = np.lexsort((sums, slot_rows))
+    last = order[np.append(np.flatnonzero(np.diff(slot_rows[order])), len(order) - 1)]
+    peaks[slot_rows[last]] = sums[last]
+    peak_times[slot_rows[last]] = slots[last] % width
+    return peaks, peak_times
+
+
+# one row per group of the chunk: the coincident peak of each combined metric, e.g. VolumeOpsMaximum, the sum of
+# the resources' own peaks (VolumeOpsSumOfMaximum), the timestamp of the coincident peak, totals normalised to
+# a 30 day month and the combined IoSize of the group
+# peaks are of the rate averaged over each datapoint's period, so both peaks are comparable with each other but can be
+# lower than the per-second Maximum columns of the collected output
+def rollup_chunk(plugin, resources, series_df, month_span):
+    groups = np.sort(resources['group'].unique())
+    local = pd.Series(np.arange(len(groups)), index=groups)
+    resource_index = pd.Series(np.arange(len(resources)), index=pd.MultiIndex.from_tuples(resource_keys(resources, plugin.id_column)))
+    resource_rows = resource_index.reindex(pd.MultiIndex.from_arrays([series_df['account'], series_df['resource_id']])).to_numpy()
+    group_of = local[resources['group']].to_numpy()
+    values = np.nan_to_num(series_df['value'].to_numpy(dtype=float))
+    periods = series_df['period'].to_numpy(dtype=float)
+    rates = np.where(series_df['stat'].to_numpy() == 'Rate', values, plugin.sum_to_rate(values, periods))
+    times, time_index = np.unique(series_df['ts'].to_numpy(), return_inverse=True)
+    time_index = time_index.ravel()
+    metrics = series_df['metric'].to_numpy()
+
+    columns = {plugin.noun: np.bincount(group_of, minlength=len(groups))}
+    if plugin.size_column and plugin.size_column in resources.columns:
+        columns[plugin.size_column] = np.bincount(group_of, weights=pd.to_numeric(resources[plugin.size_column], errors='coerce').fillna(0).to_numpy(), minlength=len(groups))
+    for name, metric_names in plugin.combined_metrics().items():
+        mask = np.isin(metrics, metric_names)
+        rows, row_times, row_rates = resource_rows[mask], time_index[mask], rates[mask]
+        peaks, peak_times = coincident_peaks(group_of[rows], row_times, row_rates, len(groups))
+        own_peaks, _ = coincident_peaks(rows, row_times, row_rates, len(resources))
+        columns[name + 'Maximum'] = np.round(peaks, 1)
+        columns[name + 'SumOfMaximum'] = np.round(np.bincount(group_of, weights=np.nan_to_num(own_peaks), minlength=len(groups)), 1)
+        columns[name + 'MaximumTime'] = [f'{EPOCH + pd.Timedelta(seconds=int(times[i])):%Y-%m-%dT%H:%M:%SZ}' if i >= 0 else '' for i in peak_times]
+        columns[name + 'Sum'] = np.bincount(group_of[rows], weights=row_rates * periods[mask], minlength=len(groups)) / month_span
+    df = pd.DataFrame(columns, index=groups)
+    df['IoSize'] = masked_divide(df[plugin.bytes_total], df[plugin.ops_total])
+    return df
+
+
+# roll the resources of a collected output up by group_columns and write one row per group to output_file (csv)
+# returns the number of groups written
+def rollup(resources_df, plugin, timeseries, group_columns, output_file, days_back=30, chunk_resources=CHUNK_RESOURCES, now=None):
+    # the same window a collection run with days_back covers
+    end = plugin.window_end(now or datetime.utcnow())
+    start_ts = int((end - EPOCH).total_seconds()) - days_back * 86400
+    month_span = days_back / 30
+    history = open_history(timeseries)
+    resources, group_keys, without_group, duplicates = resource_groups(resources_df, plugin.id_column, group_columns)
+    print(f'Rolling up {len(resources)} {plugin.noun} into {len(group_keys)} groups by {group_columns}, {without_group} without a group')
+    if duplicates:
+        print(f'Skipping {duplicates} duplicate rows of {plugin.noun} already in a group')
+    metric_names = [metric_name for metric_names in plugin.combined_metrics().values() for metric_name in metric_names]
+    written = 0
+    without_data = 0
+    for chunk in group_chunks(resources, chunk_resources):
+        chunk_resources_df = resources[resources['group'].isin(chunk)]
+        keys = resource_keys(chunk_resources_df, plugin.id_column)
+        series_df = read_series(history, keys, chunk_resources_df['region'].unique(), metric_names, start_ts)
+        series_df = series_df[pd.Series(list(zip(series_df['account'], series_df['resource_id'])), index=series_df.index, dtype=object).isin(set(keys))]
+        without_data += (~keys.isin(set(zip(series_df['account'], series_df['resource_id'])))).sum()
+        df = rollup_chunk(plugin, chunk_resources_df, series_df, month_span)
+        df = pd.concat([group_keys.loc[df.index].reset_index(drop=True), df.reset_index(drop=True).round({plugin.ops_total: 0, plugin.bytes_total: 0, 'IoSize': 0})], axis=1)
+        df = df[group_columns + sorted(set(df.columns) - set(group_columns), reverse=True)]
+        df.to_csv(output_file, mode='w' if not written else 'a', header=not written, index=False)
+        written += len(df)
+    if not written:
+        pd.DataFrame(columns=group_columns).to_csv(output_file, index=False)
+    if without_data:
+        print(f'No time series since {EPOCH + pd.Timedelta(seconds=start_ts):%Y-%m-%d} for {without_data} {plugin.noun}, they add nothing to their groups')
+    return written
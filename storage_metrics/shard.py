@@ -0,0 +1,160 @@
+# purpose: split a fleet into shards by a hash of the resource id, run them in worker processes or on several
+# hosts, and merge their output parts back into the one output file an unsharded run writes
+# shard i of N writes <output>.shard-i-of-N<ext> with its own manifest and run summary
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import zlib
+import pandas as pd
+from storage_metrics.writer import manifest_path
+
+
+# 'i/N' to (i, N), shards are numbered 0 to N-1
+def parse_shard(value):
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected a shard as i/N, e.g. 0/4, got: {value}')
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f'shard index must be between 0 and {count - 1}, got: {value}')
+    return index, count
+
+
+# stable across processes and hosts, unlike hash() of a str
+def shard_of(resource_id, count):
+    return zlib.crc32(str(resource_id).encode('utf-8')) % count
+
+
+# rows of the frame whose resource id falls in the shard
+def shard_rows(df, id_column, shard):
+    index, count = shard
+    return df[df[id_column].map(lambda resource_id: shard_of(resource_id, count) == index)]
+
+
+# data/ebs-cw-output.csv -> data/ebs-cw-output.shard-0-of-4.csv
+def shard_path(path, shard):
+    root, ext = os.path.splitext(path)
+    return f'{root}.shard-{shard[0]}-of-{shard[1]}{ext}'
+
+
+# the script's own command line for one shard, without the options that start the driver
+def shard_command(argv, shard):
+    command = [sys.executable, argv[0]]
+    skip = False
+    for arg in argv[1:]:
+        if skip:
+            skip = False
+        elif arg == '--processes':
+            skip = True
+        elif not arg.startswith('--processes='):
+            command.append(arg)
+    return command + ['--shard', f'{shard[0]}/{shard[1]}']
+
+
+# run all count shards of the script at once, each in its own process, then merge their parts
+# each process gets its own GIL, pandas post-processing and 1/count of every API quota
+# resources the driver already discovered are split by id_column and handed to each shard as a pickled frame,
+# the driver's discovery_summary is added to the merged summary
+def run_shards(args, count, discovered=None, id_column=None, discovery_summary=None, argv=None):
+    argv = argv or sys.argv
+    start = time.monotonic()
+    print(f'Running {count} shards in worker processes')
+    commands = [shard_command(argv, (index, count)) for index in range(count)]
+    parts = []
+    if discovered is not None:
+        for index, command in enumerate(commands):
+            parts.append(shard_path(args.output_file, (index, count)) + '.discovered.pkl')
+            shard_rows(discovered, id_column, (index, count)).to_pickle(parts[-1])
+            command += ['--discovered', parts[-1]]
+    processes = [subprocess.Popen(command) for command in commands]
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    for part in parts:
+        os.remove(part)
+    if failed:
+        print(f'Shards {failed} of {count} failed, rerun them with --shard i/{count} --resume and merge with --merge_shards {count}')
+        sys.exit(1)
+    merge_shards(args.output_file, count, args.output_format, getattr(args, 'summary_file', None), time.monotonic() - start, discovery_summary)
+
+
+# combine the parts of count shards into output_file, in the sorted columns every part was written with
+# csv parts with the same header are appended as text so the numbers are written exactly as in the parts
+def merge_shards(output_file, count, output_format='csv', summary_file=None, wall_seconds=None, discovery_summary=None):
+    shards = [(index, count) for index in range(count)]
+    parts = [shard_path(output_file, shard) for shard in shards]
+    missing = [part for part in parts if not os.path.exists(part)]
+    if missing:
+        raise FileNotFoundError(f'missing shard outputs: {missing}')
+
+    if output_format == 'parquet':
+        # a parquet output is a directory of part files, the shards' part files move into it
+        os.makedirs(output_file, exist_ok=True)
+        for name in os.listdir(output_file):
+            if name.startswith('part-') and name.endswith('.parquet'):
+                os.remove(os.path.join(output_file, name))
+        for index, part in enumerate(parts):
+            for name in sorted(os.listdir(part)):
+                shutil.move(os.path.join(part, name), os.path.join(output_file, f'part-shard{index}-{name[len("part-"):]}'))
+            os.rmdir(part)
+    elif output_format == 'jsonl':
+        with open(output_file, 'w') as out:
+            for part in parts:
+                with open(part) as f:
+                    shutil.copyfileobj(f, out)
+    else:
+        headers = []
+        for part in parts:
+            with open(part) as f:
+                headers.append(f.readline().rstrip('\n').split(','))
+        columns = sorted(set().union(*headers), reverse=True)
+        with open(output_file, 'w') as out:
+            out.write(','.join(columns) + '\n')
+            for part, header in zip(parts, headers):
+                if header == columns:
+                    with open(part) as f:
+                        f.readline()
+                        shutil.copyfileobj(f, out)
+                else:
+                    pd.read_csv(part, dtype=str, keep_default_na=False).reindex(columns=columns).to_csv(out, header=False, index=False)
+
+    # one manifest for the merged output, so an unsharded --resume carries on from it
+    with open(manifest_path(output_file), 'w') as out:
+        for part in parts:
+            if os.path.exists(manifest_path(part)):
+                with open(manifest_path(part)) as f:
+                    shutil.copyfileobj(f, out)
+    rows = sum(1 for line in open(manifest_path(output_file)) if line.strip())
+    print(f'Merged {count} shards, {rows} rows, into {output_file}')
+    merge_summaries(output_file, shards, summary_file, wall_seconds, discovery_summary)
+
+
+# the shards' run summaries added up, with every shard's own summary kept under shards
+# the summary of a driver that discovered for the shards counts towards the stages and totals and is kept under discovery
+def merge_summaries(output_file, shards, summary_file=None, wall_seconds=None, discovery_summary=None):
+    summaries = []
+    for shard in shards:
+        path = shard_path(summary_file, shard) if summary_file else f'{shard_path(output_file, shard)}.summary.json'
+        if os.path.exists(path):
+            with open(path) as f:
+                summaries.append(json.load(f))
+    if not summaries:
+        return
+    runs = summaries + ([discovery_summary] if discovery_summary else [])
+    summary = {
+        'started': min(run_summary['started'] for run_summary in runs),
+        'wall_seconds': round(wall_seconds, 3) if wall_seconds is not None else max(shard_summary['wall_seconds'] for shard_summary in summaries),
+        'resources': {name: sum(shard_summary['resources'][name] for shard_summary in summaries) for name in summaries[0]['resources']},
+        'stages': {name: round(sum(run_summary['stages'].get(name, 0.0) for run_summary in runs), 3) for name in summaries[0]['stages']},
+        'totals': {name: sum(run_summary['totals'][name] for run_summary in runs) for name in summaries[0]['totals']},
+        'shards': summaries
+    }
+    if discovery_summary:
+        summary['discovery'] = discovery_summary
+    summary_file = summary_file or f'{output_file}.summary.json'
+    with open(summary_file, 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f'Wrote merged run summary to {summary_file}')
@@ -0,0 +1,197 @@
+# purpose: where a run spends its time and what every region's APIs sent back
+# stage timers (inventory, fetch, aggregate, write), API call, retry, throttle and error counters per region and API,
+# bytes and datapoints received, a progress line with ETA and a JSON run summary at the end
+
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from storage_metrics.ratelimit import THROTTLE_ERROR_CODES, rate_limiter_stats
+
+STAGES = ['inventory', 'fetch', 'aggregate', 'write']
+COUNTERS = ['api_calls', 'retries', 'throttles', 'errors', 'bytes_received', 'datapoints']
+# seconds between progress updates on a terminal, and between progress lines in a log
+PROGRESS_INTERVAL = 0.5
+LOG_PROGRESS_INTERVAL = 30
+PROGRESS_WIDTH = 30
+
+
+# where counters are kept: the region, or account/region for an assumed role
+def location(region, account=None):
+    return region if account is None else f'{account}/{region}'
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h{minutes:02d}m{seconds:02d}s' if hours else f'{minutes}m{seconds:02d}s'
+
+
+class Telemetry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    # start a new run; quiet runs replace per-batch printing with a live progress line
+    def reset(self, noun='resources', quiet=False):
+        with self.lock:
+            self.noun = noun
+            self.quiet = quiet
+            self.started = time.monotonic()
+            self.started_at = datetime.utcnow()
+            self.stages = dict.fromkeys(STAGES, 0.0)
+            self.apis = {}
+            self.fetch_seconds = {}
+            self.total = 0
+            self.total_known = False
+            self.done = 0
+            self.failed = 0
+            self.shown = 0.0
+
+    # time a stage; stages run on several threads add up their busy seconds, fetch is also kept per location
+    @contextmanager
+    def stage(self, name, region=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+                if region is not None:
+                    self.fetch_seconds[region] = self.fetch_seconds.get(region, 0.0) + elapsed
+
+    # time spent waiting on each item of a lazy iterable, e.g. pages of discovery
+    def timed(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def count(self, region, api, **counts):
+        with self.lock:
+            counters = self.apis.setdefault((region, api), dict.fromkeys(COUNTERS, 0))
+            for name, value in counts.items():
+                counters[name] += value
+
+    # resources to collect, final once every chunk of input has been seen
+    def add_total(self, count, final=False):
+        with self.lock:
+            self.total += count
+            self.total_known = self.total_known or final
+
+    def finish_total(self):
+        with self.lock:
+            self.total_known = True
+
+    def advance(self, count, failed=False):
+        with self.lock:
+            self.done += count
+            if failed:
+                self.failed += count
+        if self.quiet:
+            self.show_progress()
+
+    # e.g. '[#######.......] 1200/5000 volumes 24% 35.2/s ETA 1m48s'
+    def progress_text(self):
+        with self.lock:
+            done, total, total_known = self.done, self.total, self.total_known
+            elapsed = time.monotonic() - self.started
+        rate = done / elapsed if elapsed else 0.0
+        if not total_known:
+            return f'{done}/{total}+ {self.noun} {rate:.1f}/s, still discovering'
+        share = done / total if total else 1.0
+        filled = int(share * PROGRESS_WIDTH)
+        eta = format_seconds((total - done) / rate) if rate else '?'
+        return f'[{"#" * filled}{"." * (PROGRESS_WIDTH - filled)}] {done}/{total} {self.noun} {share:.0%} {rate:.1f}/s ETA {eta}'
+
+    # redraw the progress line on a terminal, or log it every LOG_PROGRESS_INTERVAL seconds otherwise
+    def show_progress(self, force=False):
+        terminal = sys.stderr.isatty()
+        now = time.monotonic()
+        if not force and now - self.shown < (PROGRESS_INTERVAL if terminal else LOG_PROGRESS_INTERVAL):
+            return
+        self.shown = now
+        if terminal:
+            sys.stderr.write(f'\r{self.progress_text()}' + ('\n' if force else ''))
+            sys.stderr.flush()
+        else:
+            print(f'Progress: {self.progress_text()}')
+
+    # counters per region, with the busiest region and stage called out as the likely bottleneck
+    def summary(self):
+        with self.lock:
+            apis = {key: dict(counters) for key, counters in self.apis.items()}
+            fetch_seconds = dict(self.fetch_seconds)
+            stages = {name: round(seconds, 3) for name, seconds in self.stages.items()}
+            summary = {
+                'started': f'{self.started_at:%Y-%m-%dT%H:%M:%SZ}',
+                'wall_seconds': round(time.monotonic() - self.started, 3),
+                'resources': {'total': self.total, 'done': self.done, 'failed': self.failed},
+                'stages': stages
+            }
+        regions = {}
+        for (region, api), counters in sorted(apis.items()):
+            totals = regions.setdefault(region, dict(dict.fromkeys(COUNTERS, 0), fetch_seconds=round(fetch_seconds.get(region, 0.0), 3), apis={}))
+            totals['apis'][api] = counters
+            for name in COUNTERS:
+                totals[name] += counters[name]
+        summary['regions'] = regions
+        summary['totals'] = {name: sum(totals[name] for totals in regions.values()) for name in COUNTERS}
+        summary['slowest_stage'] = max(stages, key=stages.get) if any(stages.values()) else None
+        summary['slowest_region'] = max(fetch_seconds, key=fetch_seconds.get) if fetch_seconds else None
+        summary['rate_limits'] = rate_limiter_stats()
+        return summary
+
+    def write_summary(self, summary_file):
+        summary = self.summary()
+        with open(summary_file, 'w') as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+_telemetry = Telemetry()
+
+
+# the telemetry of the current run, shared by every module and thread
+def get_telemetry():
+    return _telemetry
+
+
+# hook a boto3 client into the run's counters for its region, or account/region
+# every HTTP attempt counts as a call, attempts after the first as retries; throttles, errors, response bytes and
+# GetMetricData datapoints are counted from each attempt's response
+def attach_telemetry(client, region=None, account=None):
+    region = location(region or client.meta.region_name, account)
+    service = client.meta.service_model.service_id.hyphenize()
+
+    def before_send(event_name, request, **kwargs):
+        # amz-sdk-request: attempt=2; max=10
+        header = request.headers.get('amz-sdk-request', b'attempt=1')
+        header = header.decode() if isinstance(header, bytes) else header
+        attempt = int(header.split(';')[0].split('=')[1])
+        _telemetry.count(region, event_name.split('.')[-1], api_calls=1, retries=int(attempt > 1))
+
+    def response_received(event_name, response_dict=None, parsed_response=None, exception=None, **kwargs):
+        counts = {}
+        if response_dict is not None:
+            counts['bytes_received'] = len(response_dict.get('body') or b'')
+        if parsed_response is not None:
+            code = parsed_response.get('Error', {}).get('Code')
+            if code in THROTTLE_ERROR_CODES:
+                counts['throttles'] = 1
+            elif code:
+                counts['errors'] = 1
+            counts['datapoints'] = sum(len(result['Values']) for result in parsed_response.get('MetricDataResults', []))
+        if exception is not None:
+            counts['errors'] = 1
+        _telemetry.count(region, event_name.split('.')[-1], **counts)
+
+    client.meta.events.register(f'before-send.{service}', before_send)
+    client.meta.events.register(f'response-received.{service}', response_received)
+    return client
@@ -0,0 +1,198 @@
+# purpose: keep the pulled series for percentiles, hourly profiles and a compact Parquet history
+# series are held only until their resource has every segment, then percentiles are computed for all
+# finished resources at once; the history is float32 values with delta encoded timestamps, partitioned by region/date
+
+import os
+import warnings
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+PERCENTILES = [50, 95, 99]
+# datapoints buffered before they are flushed into the region/date partitions
+FLUSH_ROWS = 1000000
+EPOCH = datetime(1970, 1, 1)
+
+
+# seconds since the epoch for a list of naive UTC (from the cache) or timezone aware (from boto3) datetimes
+def epoch_seconds(timestamps):
+    if not len(timestamps):
+        return np.empty(0, dtype=np.int64)
+    if timestamps[0].tzinfo is None:
+        seconds = ((ts - EPOCH).total_seconds() for ts in timestamps)
+    else:
+        seconds = (ts.timestamp() for ts in timestamps)
+    return np.fromiter(seconds, dtype=np.float64, count=len(timestamps)).astype(np.int64)
+
+
+# per resource and metric: the per-second rate series of every segment, until the resource is finished
+class SeriesBuffer:
+    def __init__(self):
+        self.series = {}
+
+    def add(self, label, metric_name, timestamps, rates):
+        self.series.setdefault(label, {}).setdefault(metric_name, []).append((np.asarray(timestamps, dtype=np.int64), np.asarray(rates, dtype=np.float32)))
+
+    # {label: {metric_name: (timestamps, rates)}} with the segments joined in time order, removed from the buffer
+    def pop(self, labels):
+        popped = {}
+        for label in labels:
+            popped[label] = {}
+            for metric_name, parts in self.series.pop(label, {}).items():
+                timestamps = np.concatenate([part[0] for part in parts])
+                order = np.argsort(timestamps, kind='stable')
+                popped[label][metric_name] = (timestamps[order], np.concatenate([part[1] for part in parts])[order])
+        return popped
+
+
+# add up several metrics of one resource on matching timestamps, e.g. read and write ops into total ops
+def combine_series(series):
+    if not series:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    timestamps = np.unique(np.concatenate([s[0] for s in series]))
+    total = np.zeros(len(timestamps), dtype=np.float32)
+    for s_timestamps, s_rates in series:
+        np.add.at(total, np.searchsorted(timestamps, s_timestamps), np.nan_to_num(s_rates))
+    return timestamps, total
+
+
+# add the combined series, {name: [metric names]}, to every resource's popped series
+def add_combined_series(series_by_label, combined):
+    for series in series_by_label.values():
+        for name, metric_names in combined.items():
+            if name not in series:
+                series[name] = combine_series([series[metric_name] for metric_name in metric_names if metric_name in series])
+    return series_by_label
+
+
+# series of different lengths stacked into one NaN padded float32 matrix, one row per resource
+def pad_matrix(arrays):
+    width = max((len(a) for a in arrays), default=0)
+    matrix = np.full((len(arrays), width), np.nan, dtype=np.float32)
+    for i, a in enumerate(arrays):
+        matrix[i, :len(a)] = a
+    return matrix
+
+
+# {metric}P50/P95/P99 of the per-second rate for every resource at once, one nanpercentile per metric
+def percentile_frame(series_by_label, metric_names, percentiles=PERCENTILES):
+    labels = list(series_by_label)
+    columns = {}
+    for metric_name in metric_names:
+        matrix = pad_matrix([series_by_label[label].get(metric_name, (None, np.empty(0)))[1] for label in labels])
+        # resources without datapoints are all NaN rows and come out as NaN
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            values = np.nanpercentile(matrix, percentiles, axis=1) if matrix.shape[1] else np.full((len(percentiles), len(labels)), np.nan)
+        for percentile, row in zip(percentiles, values):
+            columns[f'{metric_name}P{percentile}'] = row
+    return pd.DataFrame(columns, index=labels)
+
+
+def percentile_columns(metric_names, percentiles=PERCENTILES):
+    return [f'{metric_name}P{percentile}' for metric_name in metric_names for percentile in percentiles]
+
+
+# mean per-second rate by UTC hour of day, one row per resource and metric with columns h00..h23
+# keys are the (account, id) tuples of resource_keys and regions the region of each label, as ids can repeat across both
+# every resource's series is binned with a single bincount per metric
+def hourly_profile_frame(series_by_label, metric_names, keys, regions):
+    labels = list(series_by_label)
+    frames = []
+    for metric_name in metric_names:
+        parts = [series_by_label[label].get(metric_name) for label in labels]
+        rows = np.concatenate([np.full(len(part[0]), i) for i, part in enumerate(parts) if part is not None] or [np.empty(0, dtype=int)])
+        if not len(rows):
+            continue
+        timestamps = np.concatenate([part[0] for part in parts if part is not None])
+        rates = np.concatenate([part[1] for part in parts if part is not None]).astype(float)
+        valid = ~np.isnan(rates)
+        bins = rows[valid] * 24 + (timestamps[valid] // 3600) % 24
+        totals = np.bincount(bins, weights=rates[valid], minlength=len(labels) * 24).reshape(len(labels), 24)
+        counts = np.bincount(bins, minlength=len(labels) * 24).reshape(len(labels), 24)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = totals / counts
+        df = pd.DataFrame(means, columns=[f'h{hour:02d}' for hour in range(24)])
+        df.insert(0, 'metric', metric_name)
+        df.insert(0, 'resource_id', [keys[label][1] for label in labels])
+        df.insert(0, 'region', [regions[label] for label in labels])
+        df.insert(0, 'account', [keys[label][0] for label in labels])
+        frames.append(df[counts.sum(axis=1) > 0])
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+# append-only Parquet history of every pulled datapoint under <root>/datapoints, hive partitioned as region=<region>/date=<yyyy-mm-dd>,
+# and the hourly profiles, one row per account, region, resource and metric, under <root>/hourly-profile
+# every datapoint carries the account of its resource ('' with the default credentials), as ids can repeat across accounts
+# rows are sorted by series and time inside each file so the delta encoded timestamps shrink to a few bits,
+# values are float32 with byte stream split encoding and account, resource, metric and stat are dictionary encoded
+class TimeSeriesStore:
+    def __init__(self, root, flush_rows=FLUSH_ROWS):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('time series output requires pyarrow: pip install pyarrow')
+        self.pa = pa
+        self.pq = pq
+        self.root = root
+        self.flush_rows = flush_rows
+        self.run_id = f'{datetime.utcnow():%Y%m%d%H%M%S%f}'
+        self.schema = pa.schema([
+            ('account', pa.string()), ('resource_id', pa.string()), ('metric', pa.string()), ('stat', pa.string()),
+            ('period', pa.int32()), ('ts', pa.int64()), ('value', pa.float32())
+        ])
+        self.series = []
+        self.buffered = 0
+        self.files = 0
+        self.datapoints = 0
+        self.profile_writer = None
+        os.makedirs(root, exist_ok=True)
+
+    # buffered as arrays per series, the frame is only built when flushing
+    def add(self, region, account, resource_id, metric_name, stat, period, timestamps, values):
+        if not len(values):
+            return
+        self.series.append(((region, account or '', resource_id, metric_name, stat, period), np.asarray(timestamps, dtype=np.int64), np.asarray(values, dtype=np.float32)))
+        self.buffered += len(values)
+        if self.buffered >= self.flush_rows:
+            self.flush()
+
+    # write the buffered datapoints, one new file per region/date partition they touch
+    def flush(self):
+        if not self.series:
+            return
+        keys = pd.DataFrame([key for key, timestamps, values in self.series], columns=['region', 'account', 'resource_id', 'metric', 'stat', 'period'])
+        lengths = [len(values) for key, timestamps, values in self.series]
+        # series-level columns are repeated as categoricals, so strings are not copied per datapoint
+        rows = np.repeat(np.arange(len(keys)), lengths)
+        df = pd.DataFrame({column: pd.Categorical(keys[column]).take(rows) if column != 'period' else keys[column].to_numpy(np.int32)[rows] for column in keys.columns})
+        df['ts'] = np.concatenate([timestamps for key, timestamps, values in self.series])
+        df['value'] = np.concatenate([values for key, timestamps, values in self.series])
+        self.series, self.buffered = [], 0
+        df['date'] = (df['ts'].to_numpy() // 86400).astype('datetime64[D]').astype(str)
+        for (region, date), part in df.groupby(['region', 'date'], observed=True):
+            part = part.sort_values(['account', 'resource_id', 'metric', 'stat', 'ts'])
+            directory = os.path.join(self.root, 'datapoints', f'region={region}', f'date={date}')
+            os.makedirs(directory, exist_ok=True)
+            table = self.pa.Table.from_pandas(part[self.schema.names], schema=self.schema, preserve_index=False)
+            self.pq.write_table(table, os.path.join(directory, f'part-{self.run_id}-{self.files:05d}.parquet'), compression='zstd',
+                                use_dictionary=['account', 'resource_id', 'metric', 'stat', 'period'],
+                                column_encoding={'ts': 'DELTA_BINARY_PACKED', 'value': 'BYTE_STREAM_SPLIT'})
+            self.files += 1
+            self.datapoints += len(part)
+
+    # one profile file per run
+    def write_profiles(self, df):
+        if df.empty:
+            return
+        table = self.pa.Table.from_pandas(df.astype({column: 'float32' for column in df.columns if column.startswith('h')}), preserve_index=False)
+        if self.profile_writer is None:
+            os.makedirs(os.path.join(self.root, 'hourly-profile'), exist_ok=True)
+            self.profile_writer = self.pq.ParquetWriter(os.path.join(self.root, 'hourly-profile', f'part-{self.run_id}.parquet'), table.schema, compression='zstd')
+        self.profile_writer.write_table(table)
+
+    def close(self):
+        self.flush()
+        if self.profile_writer is not None:
+            self.profile_writer.close()
@@ -0,0 +1,104 @@
+# purpose: stream finished output rows to disk batch by batch, with a checkpoint manifest for --resume
+# csv and jsonl files are appended to; parquet output is a directory with one part file per run
+
+import os
+from datetime import datetime
+import pandas as pd
+from storage_metrics.inventory import resource_keys
+
+OUTPUT_FORMATS = ['csv', 'jsonl', 'parquet']
+
+
+def manifest_path(output_file):
+    return output_file + '.manifest'
+
+
+# a collected output back as a frame, csv, jsonl or a parquet directory
+def read_output(path, dtype=None):
+    if os.path.isdir(path) or path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    if path.endswith('.jsonl'):
+        return pd.read_json(path, lines=True, dtype=dtype)
+    return pd.read_csv(path, dtype=dtype)
+
+
+# (account, id) of the resources already written by earlier runs, one tab separated line each
+def read_manifest(output_file):
+    path = manifest_path(output_file)
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {tuple(line.rstrip('\n').split('\t', 1)) for line in f if line.strip()}
+
+
+class StreamingWriter:
+    # columns fixes the column order of every row written, the account and id_column are recorded in the manifest
+    # without resume any previous output and manifest are replaced
+    def __init__(self, output_file, columns, id_column, output_format='csv', resume=False):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f'unknown output format: {output_format}, expected one of {OUTPUT_FORMATS}')
+        self.output_file = output_file
+        self.columns = list(columns)
+        self.id_column = id_column
+        self.output_format = output_format
+        self.parquet_writer = None
+        self.rows_written = 0
+
+        if not resume:
+            for path in [output_file, manifest_path(output_file)]:
+                if os.path.isfile(path):
+                    os.remove(path)
+            if output_format == 'parquet' and os.path.isdir(output_file):
+                for name in os.listdir(output_file):
+                    if name.startswith('part-') and name.endswith('.parquet'):
+                        os.remove(os.path.join(output_file, name))
+        if output_format == 'parquet':
+            os.makedirs(output_file, exist_ok=True)
+            self.part_file = os.path.join(output_file, f'part-{datetime.utcnow():%Y%m%d%H%M%S%f}.parquet')
+        elif output_format == 'csv' and not os.path.exists(output_file):
+            with open(output_file, 'w') as f:
+                f.write(','.join(self.columns) + '\n')
+        self.manifest = open(manifest_path(output_file), 'a')
+
+    # append finished rows, then checkpoint their (account, id); a row is only in the manifest once it is on disk
+    def write(self, df):
+        if df.empty:
+            return
+        df = df.reindex(columns=self.columns)
+        if self.output_format == 'csv':
+            df.to_csv(self.output_file, mode='a', header=False, index=False)
+        elif self.output_format == 'jsonl':
+            lines = df.to_json(orient='records', lines=True)
+            with open(self.output_file, 'a') as f:
+                f.write(lines if lines.endswith('\n') else lines + '\n')
+        else:
+            self._write_parquet(df)
+        self.manifest.write(''.join(f'{account}\t{resource_id}\n' for account, resource_id in resource_keys(df, self.id_column)))
+        self.manifest.flush()
+        os.fsync(self.manifest.fileno())
+        self.rows_written += len(df)
+
+    # the first batch fixes the schema: text columns are stored as strings and everything else as float64,
+    # later batches are cast to it so every row group matches
+    def _write_parquet(self, df):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('parquet output requires pyarrow: pip install pyarrow')
+        df = df.copy()
+        if self.parquet_writer is None:
+            text_columns = [column for column in df.columns if df[column].dtype == object]
+            self.schema = pa.schema([(column, pa.string() if column in text_columns else pa.float64()) for column in df.columns])
+            self.parquet_writer = pq.ParquetWriter(self.part_file, self.schema)
+        for field in self.schema:
+            if pa.types.is_string(field.type):
+                df[field.name] = df[field.name].astype(str)
+            else:
+                df[field.name] = pd.to_numeric(df[field.name], errors='coerce').astype('float64')
+        self.parquet_writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        self.manifest.close()
@@ -0,0 +1,179 @@
+# purpose: regression checks of the collection scripts against the offline stand-in (storage_metrics/fakeaws.py)
+# usage: python -m pytest -q tests
+
+import importlib.util
+import os
+import sys
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pytest
+from storage_metrics import clients, pipeline
+from storage_metrics.fakeaws import FakeAWS, FakeFleet, evaluate
+from storage_metrics.inventory import VolumeInventory
+from storage_metrics.metadata import configure_inventory_cache
+from storage_metrics.periods import plan_segments
+from storage_metrics.resources import EBS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# collection runs see the same clock, so reruns plan the same window
+NOW = datetime(2026, 10, 1, 12)
+DAYS_BACK = 3
+# the columns the original get-ebs-metrics.py wrote, in its order
+BASELINE_COLUMNS = ['region', 'ec2_instance_name', 'ec2_instance_id', 'ebs_type', 'ebs_throughput', 'ebs_size', 'ebs_name',
+                    'ebs_iops', 'ebs_id', 'ebs_device', 'VolumeWriteOpsSum', 'VolumeWriteOpsMaximum', 'VolumeWriteBytesSum',
+                    'VolumeWriteBytesMaximum', 'VolumeReadOpsSum', 'VolumeReadOpsMaximum', 'VolumeReadBytesSum',
+                    'VolumeReadBytesMaximum', 'VolumeOpsSum', 'VolumeBytesSum', 'IoSize']
+
+
+class FixedDatetime(datetime):
+    @classmethod
+    def utcnow(cls):
+        return NOW
+
+
+# import a hyphenated script as a module
+def load_script(file_name):
+    spec = importlib.util.spec_from_file_location(file_name[:-3].replace('-', '_'), os.path.join(ROOT, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fleet = FakeFleet(volumes=40, db_instances=6, regions=['us-east-1', 'eu-west-1'], now=NOW)
+    fake = FakeAWS(fleet, latency_ms=0)
+    monkeypatch.setattr(pipeline, 'datetime', FixedDatetime)
+    # the previous factory comes back afterwards, with the sessions and clients made from the stand-in dropped
+    previous = clients._session_factory
+    clients.set_session_factory(fake.session)
+    yield fake
+    clients.set_session_factory(previous)
+
+
+# run get-ebs-metrics.py over the whole fleet with extra arguments and return its output
+def collect(fake, tmp_path, monkeypatch, *extra):
+    input_file = tmp_path / 'ebs-input.csv'
+    if not input_file.exists():
+        pd.DataFrame(fake.fleet.input_rows('ebs')).to_csv(input_file, index=False)
+    output_file = tmp_path / 'ebs-output.csv'
+    monkeypatch.setattr(sys, 'argv', ['get-ebs-metrics.py', '-i', str(input_file), '-o', str(output_file), '-d', str(DAYS_BACK),
+                                      '--inventory_cache_file', str(tmp_path / 'inventory.sqlite'), '--quiet', *extra])
+    load_script('get-ebs-metrics.py').main()
+    return pd.read_csv(output_file, keep_default_na=False, dtype=str)
+
+
+# the fleet's own series of one volume metric over the planned segments
+def expected_values(fleet, ebs_id, metric_name, stat):
+    end = EBS.window_end(NOW)
+    segments = plan_segments(end, DAYS_BACK, EBS.period, ['Maximum'], ['Sum'], NOW)
+    values = []
+    for segment in segments:
+        if stat not in segment.stats:
+            continue
+        metric = {'Namespace': EBS.namespace, 'MetricName': metric_name, 'Dimensions': [{'Name': EBS.dimension_name, 'Value': ebs_id}]}
+        _, segment_values = fleet.metric_stat({'Metric': metric, 'Period': segment.period, 'Stat': stat}, pd.Timestamp(segment.start, tz='UTC').timestamp(), pd.Timestamp(segment.end, tz='UTC').timestamp())
+        values.append(segment_values)
+    return np.concatenate(values)
+
+
+# GetMetricData calls the stand-in served so far
+def metric_data_calls(fake):
+    return sum(call['calls'] for call in fake.stats()['calls'] if call['api'] == 'GetMetricData')
+
+
+def test_output_matches_baseline_shape(fake, tmp_path, monkeypatch):
+    df = collect(fake, tmp_path, monkeypatch, '--no_cache')
+    assert list(df.columns) == BASELINE_COLUMNS
+    assert sorted(df['ebs_id']) == sorted(row['ebs_id'] for row in fake.fleet.input_rows('ebs'))
+
+
+def test_empty_input_collects_nothing(fake, tmp_path, monkeypatch, capsys):
+    (tmp_path / 'ebs-input.csv').write_text('region,ebs_id\n')
+    monkeypatch.setattr(sys, 'argv', ['get-ebs-metrics.py', '-i', str(tmp_path / 'ebs-input.csv'), '-o', str(tmp_path / 'ebs-output.csv'), '--no_cache', '--quiet'])
+    load_script('get-ebs-metrics.py').main()
+    assert 'No volumes left to collect' in capsys.readouterr().out
+    assert metric_data_calls(fake) == 0
+
+
+def test_output_values(fake, tmp_path, monkeypatch):
+    fake.fleet.detach_volume(4, NOW - timedelta(days=1))
+    df = collect(fake, tmp_path, monkeypatch, '--no_cache').set_index('ebs_id')
+    fleet = fake.fleet
+    checked, detached = 0, 0
+    for i in range(fleet.volume_count):
+        row = df.loc[fleet.volume_id(i)]
+        # a detached volume keeps the data it published before it was detached, without Maximum
+        if not fleet.attached(i) or not fleet.nitro(i // fleet.volumes_per_instance):
+            assert row['VolumeReadOpsMaximum'] == ''
+        else:
+            peak = expected_values(fleet, fleet.volume_id(i), 'VolumeReadOps', 'Maximum').max() / 60
+            assert float(row['VolumeReadOpsMaximum']) == pytest.approx(round(peak), abs=1)
+        total = expected_values(fleet, fleet.volume_id(i), 'VolumeWriteBytes', 'Sum').sum() / (DAYS_BACK / 30)
+        assert float(row['VolumeWriteBytesSum']) == pytest.approx(total, rel=1e-6)
+        assert float(row['VolumeOpsSum']) == pytest.approx(float(row['VolumeReadOpsSum']) + float(row['VolumeWriteOpsSum']), abs=1)
+        checked += 1
+        detached += not fleet.attached(i) and total > 0
+    assert checked and detached
+
+
+def test_cache_rerun_gives_identical_output(fake, tmp_path, monkeypatch):
+    cache_file = str(tmp_path / 'metrics-cache.sqlite')
+    first = collect(fake, tmp_path, monkeypatch, '--cache_file', cache_file)
+    first_calls = metric_data_calls(fake)
+    second = collect(fake, tmp_path, monkeypatch, '--cache_file', cache_file)
+    pd.testing.assert_frame_equal(first.sort_values('ebs_id').reset_index(drop=True), second.sort_values('ebs_id').reset_index(drop=True))
+    # the window is settled, so the rerun reads every datapoint from the cache
+    assert first_calls and metric_data_calls(fake) == first_calls
+
+
+def test_hourly_profiles_keep_account_and_region(fake, tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    collect(fake, tmp_path, monkeypatch, '--no_cache', '--timeseries', str(tmp_path / 'series'))
+    profiles = pd.read_parquet(tmp_path / 'series' / 'hourly-profile')
+    assert list(profiles.columns[:4]) == ['account', 'region', 'resource_id', 'metric']
+    regions = {row['ebs_id']: row['region'] for row in fake.fleet.input_rows('ebs')}
+    assert set(profiles['account']) == {''} and (profiles['resource_id'].map(regions) == profiles['region']).all()
+
+
+# DescribeVolumes calls a fresh inventory of the fleet's volumes (or the given ones) makes, reading through the cache in path
+def described_volumes(fake, path, volumes=None):
+    configure_inventory_cache(path)
+    before = {call['region']: call['calls'] for call in fake.stats()['calls'] if call['api'] == 'DescribeVolumes'}
+    rows = fake.fleet.input_rows('ebs')
+    inventory = VolumeInventory().load(pd.DataFrame([rows[i] for i in volumes] if volumes is not None else rows))
+    calls = sum(call['calls'] - before.get(call['region'], 0) for call in fake.stats()['calls'] if call['api'] == 'DescribeVolumes')
+    return inventory, calls
+
+
+def test_inventory_cache_describes_retagged_volumes(fake, tmp_path):
+    path = str(tmp_path / 'inventory.sqlite')
+    attached = [i for i in range(fake.fleet.volume_count) if fake.fleet.attached(i)]
+    _, first_calls = described_volumes(fake, path, attached)
+    _, cached_calls = described_volumes(fake, path, attached)
+    fake.fleet.tag_volume(attached[0], 'app', 'moved')
+    inventory, retagged_calls = described_volumes(fake, path, attached)
+    configure_inventory_cache()
+    assert first_calls and not cached_calls and retagged_calls == 1
+    assert inventory.volume_tags(fake.fleet.volume_id(attached[0]))['app'] == 'moved'
+
+
+def test_inventory_cache_describes_unattached_volumes(fake, tmp_path):
+    path = str(tmp_path / 'inventory.sqlite')
+    fake.fleet.detach_volume(4, NOW - timedelta(days=1))
+    unattached = [4]
+    described_volumes(fake, path, unattached)
+    # attaching changes neither tags nor modifications, the volume is described again in case it was attached
+    _, calls = described_volumes(fake, path, unattached)
+    configure_inventory_cache()
+    assert calls == 1
+
+
+def test_metric_math_is_parsed_not_run():
+    series = {'q0': (np.array([0, 60]), np.array([60.0, 120.0])), 'q1': (np.array([0, 60]), np.array([6.0, 6.0]))}
+    periods = {'q0': 60, 'q1': 60}
+    np.testing.assert_allclose(evaluate('SUM([q0, q1])/PERIOD(q0)', series, periods)[1], [1.1, 2.1])
+    np.testing.assert_allclose(evaluate('q1', series, periods)[1], [6.0, 6.0])
+    with pytest.raises(ValueError):
+        evaluate('__import__("os").getcwd()', series, periods)
@@ -0,0 +1,45 @@
+# purpose: value checks of the Aurora cost model on a hand-built collected frame
+
+import numpy as np
+import pandas as pd
+import pytest
+from storage_metrics.cost import PRICE_COLUMNS, CostModel, billed_ios, scenario_grid
+from storage_metrics.resources import RDS
+
+PRICES = pd.DataFrame([[0.10, 0.20, 0.225, 0.3]], columns=PRICE_COLUMNS, index=pd.Index(['us-east-1'], name='region'))
+
+
+# RDS output rows: a busy instance with 20000 byte reads, the same without an instance cost, and an idle one
+def collected():
+    return pd.DataFrame({'region': 'us-east-1', 'instance': ['db-busy', 'db-unknown', 'db-idle'], 'instance_storage': [100, 100, 100],
+                         'instance_cost': [50.0, np.nan, 50.0],
+                         'ReadIOPSSum': [1e6, 1e6, 0], 'ReadThroughputSum': [1e6 * 20000, 1e6 * 20000, 0],
+                         'WriteIOPSSum': [1e5, 1e5, 0], 'WriteThroughputSum': [1e5 * 1000, 1e5 * 1000, 0]})
+
+
+def test_billed_ios_round_up_to_pages():
+    read_ios, write_ios = billed_ios(collected(), RDS)
+    # 20000 bytes is 3 read pages, 1000 bytes still one write unit, per second sums count 60 samples each
+    np.testing.assert_allclose(read_ios, [1e6 * 60 * 3, 1e6 * 60 * 3, 0])
+    np.testing.assert_allclose(write_ios, [1e5 * 60, 1e5 * 60, 0])
+
+
+def test_resources_without_instance_cost_get_no_recommendation():
+    model = CostModel(collected(), RDS, PRICES, instance_column='instance_cost')
+    df = model.resource_costs(scenario_grid())
+    # without its instance cost the second instance looks cheaper on I/O-Optimized, which is not a recommendation
+    assert list(df['AuroraRecommendation']) == ['io-optimized', '', 'standard']
+    assert model.missing == {'instance cost': 1, 'storage size': 0}
+    assert df['AuroraIoOptimizedSavings'].iloc[0] == pytest.approx(97.2 - 87.5)
+
+
+def test_fleet_summary_per_scenario():
+    model = CostModel(collected(), RDS, PRICES, instance_column='instance_cost')
+    summary = model.fleet_summary(scenario_grid(io_growth=[1, 2])).set_index('scenario')
+    baseline = summary.loc['io_growth=1']
+    assert baseline['standard_monthly'] == pytest.approx(97.2 + 47.2 + 60)
+    assert baseline['io_optimized_monthly'] == pytest.approx(87.5 + 22.5 + 87.5)
+    assert baseline['io_optimized_resources'] == 1 and baseline['unrecommended_resources'] == 1
+    # the unrecommended instance stays on Standard in the best mix
+    assert baseline['best_mix_monthly'] == pytest.approx(87.5 + 47.2 + 60)
+    assert summary.loc['io_growth=2', 'standard_monthly'] == pytest.approx(97.2 + 47.2 + 60 + 2 * 37.2)
@@ -0,0 +1,38 @@
+# purpose: checks of the query plan against CloudWatch's retention tiers
+
+from datetime import datetime, timedelta
+from storage_metrics.periods import DAY, HOUR, plan_segments
+
+NOW = datetime(2026, 10, 1, 12)
+
+
+def spans(segments):
+    return [(segment.start, segment.end, segment.period, segment.stats) for segment in segments]
+
+
+def test_short_window_is_one_peak_and_one_hourly_sum_segment():
+    segments = plan_segments(NOW, 3, 300, ['Maximum'], ['Sum'], NOW)
+    start = NOW - timedelta(days=3)
+    assert spans(segments) == [(start, NOW, 300, ['Maximum']), (start, NOW, HOUR, ['Sum'])]
+
+
+def test_long_window_splits_peaks_by_tier_and_sums_daily():
+    segments = plan_segments(NOW, 100, 300, ['Maximum'], ['Sum'], NOW)
+    # the 1 and 5 minute tiers share the 300 second base period, so they merge into one segment
+    day_end = datetime(2026, 10, 1)
+    assert spans(segments) == [(NOW - timedelta(days=63), NOW, 300, ['Maximum']),
+                               (NOW - timedelta(days=100), NOW - timedelta(days=63), HOUR, ['Maximum']),
+                               (day_end - timedelta(days=100), day_end, DAY, ['Sum'])]
+
+
+def test_one_minute_base_period_keeps_the_first_tier_apart():
+    segments = plan_segments(NOW, 20, 60, ['Maximum'], [], NOW)
+    assert [(segment.period, segment.end - segment.start) for segment in segments] == [(60, timedelta(days=15)), (300, timedelta(days=5))]
+
+
+def test_window_beyond_retention_is_clipped(capsys):
+    segments = plan_segments(NOW, 500, 300, ['Maximum'], ['Sum'], NOW)
+    assert 'only keeps 455 days' in capsys.readouterr().out
+    assert segments[-2].start == NOW - timedelta(days=455)
+    # daily sums start on the first whole day CloudWatch still holds
+    assert segments[-1].start == datetime(2025, 7, 4) and segments[-1].period == DAY
@@ -0,0 +1,53 @@
+# purpose: value checks of the group rollup on hand-built series, no time series history needed
+
+import numpy as np
+import pandas as pd
+from storage_metrics.resources import EBS
+from storage_metrics.rollup import coincident_peaks, finest_series, resource_groups, rollup_chunk
+
+
+# Sum datapoints of one volume metric, value ops per 300 second datapoint starting at ts
+def sum_points(resource_id, metric, ts, values, period=300, account=''):
+    return pd.DataFrame({'account': account, 'resource_id': resource_id, 'metric': metric, 'stat': 'Sum', 'period': period,
+                         'ts': np.asarray(ts, dtype=np.int64), 'value': np.asarray(values, dtype=float)})
+
+
+def test_coincident_peaks_add_up_rates_on_matching_timestamps():
+    rows = np.array([0, 0, 0, 0, 1])
+    times = np.array([0, 1, 0, 1, 2])
+    rates = np.array([1.0, 5.0, 4.0, 1.0, 3.0])
+    peaks, peak_times = coincident_peaks(rows, times, rates, 3)
+    np.testing.assert_allclose(peaks[:2], [6.0, 3.0])
+    assert list(peak_times) == [1, 2, -1] and np.isnan(peaks[2])
+
+
+def test_rollup_chunk_coincident_peak_below_sum_of_peaks():
+    resources = pd.DataFrame({'ebs_id': ['vol-a', 'vol-b'], 'region': 'us-east-1', 'ebs_size': [100, 50], 'group': [0, 0]})
+    series = pd.concat([
+        sum_points('vol-a', 'VolumeReadOps', [0, 300], [3000, 600]),
+        sum_points('vol-b', 'VolumeReadOps', [0, 300], [300, 1500]),
+        sum_points('vol-a', 'VolumeReadBytes', [0, 300], [3000 * 4096, 600 * 4096]),
+    ], ignore_index=True)
+    row = rollup_chunk(EBS, resources, series, month_span=1).iloc[0]
+    # 10 + 1 ops/s at the first timestamp, 2 + 5 at the second, against the volumes' own peaks of 10 and 5
+    assert row['volumes'] == 2 and row['ebs_size'] == 150
+    assert row['VolumeOpsMaximum'] == 11.0 and row['VolumeOpsSumOfMaximum'] == 15.0
+    assert row['VolumeOpsMaximumTime'] == '1970-01-01T00:00:00Z'
+    assert row['VolumeOpsSum'] == 5400 and row['IoSize'] == 3600 * 4096 / 5400
+
+
+def test_finest_series_counts_each_time_range_once():
+    five_minutes = sum_points('vol-a', 'VolumeReadOps', np.arange(0, 3600, 300), np.full(12, 300.0))
+    hourly = sum_points('vol-a', 'VolumeReadOps', [0, 3600], [3600.0, 7200.0], period=3600)
+    rerun = sum_points('vol-a', 'VolumeReadOps', [300], [600.0])
+    df = finest_series(pd.concat([five_minutes, hourly, rerun], ignore_index=True))
+    # the first hour stays at 5 minutes with the rerun's value, the second hour only exists hourly
+    assert len(df) == 13 and df['value'].sum() == 11 * 300 + 600 + 7200
+
+
+def test_resource_groups_dedupe_on_account_and_id():
+    df = pd.DataFrame({'account': ['111122223333', '444455556666', '111122223333', '111122223333'],
+                       'ebs_id': ['vol-a', 'vol-a', 'vol-a', 'vol-b'], 'tag_app': ['web', 'web', 'web', '']})
+    resources, keys, without_group, duplicates = resource_groups(df, 'ebs_id', ['tag_app'])
+    assert list(resources.index) == [0, 1] and list(keys['tag_app']) == ['web']
+    assert without_group == 1 and duplicates == 1
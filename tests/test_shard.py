@@ -0,0 +1,44 @@
+# purpose: checks of shard assignment and of merging shard parts back into one output
+
+import argparse
+import zlib
+import pandas as pd
+import pytest
+from storage_metrics.shard import merge_shards, parse_shard, shard_of, shard_path, shard_rows
+from storage_metrics.writer import manifest_path, read_manifest
+
+
+def test_shard_of_is_a_stable_partition():
+    ids = [f'vol-{i:017x}' for i in range(200)]
+    # the assignment is crc32, the same in every process and on every host
+    assert [shard_of(resource_id, 4) for resource_id in ids] == [zlib.crc32(resource_id.encode('utf-8')) % 4 for resource_id in ids]
+    df = pd.DataFrame({'ebs_id': ids})
+    shards = [shard_rows(df, 'ebs_id', (index, 4)) for index in range(4)]
+    assert sorted(id for shard in shards for id in shard['ebs_id']) == sorted(ids) and all(len(shard) for shard in shards)
+
+
+def test_parse_shard_rejects_indexes_outside_the_count():
+    assert parse_shard('3/4') == (3, 4)
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_shard('4/4')
+
+
+def test_merge_csv_parts_and_manifests(tmp_path, capsys):
+    output_file = str(tmp_path / 'ebs-output.csv')
+    # the second shard had no data for one column, its part is reindexed to the union of the headers
+    parts = {0: 'region,ebs_id,VolumeReadOpsSum\nus-east-1,vol-a,1.50\n', 1: 'region,ebs_id\neu-west-1,vol-b\n'}
+    manifests = {0: '\tvol-a\n', 1: '111122223333\tvol-b\n'}
+    for index, text in parts.items():
+        (tmp_path / shard_path('ebs-output.csv', (index, 2))).write_text(text)
+        (tmp_path / manifest_path(shard_path('ebs-output.csv', (index, 2)))).write_text(manifests[index])
+    merge_shards(output_file, 2)
+    assert 'Merged 2 shards, 2 rows' in capsys.readouterr().out
+    with open(output_file) as f:
+        assert f.read() == 'region,ebs_id,VolumeReadOpsSum\nus-east-1,vol-a,1.50\neu-west-1,vol-b,\n'
+    assert read_manifest(output_file) == {('', 'vol-a'), ('111122223333', 'vol-b')}
+
+
+def test_merge_fails_on_a_missing_part(tmp_path):
+    (tmp_path / shard_path('ebs-output.csv', (0, 2))).write_text('region,ebs_id\n')
+    with pytest.raises(FileNotFoundError):
+        merge_shards(str(tmp_path / 'ebs-output.csv'), 2)